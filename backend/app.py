@@ -1,15 +1,29 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import os
 from werkzeug.utils import secure_filename
 import sys
 import random
 import time
+import json
+import queue
+import threading
+import contextvars
+from jobQueue import JobStore, JobQueue, stream_job_events
+
+# myEnv holds the model code and the instrumentation module; import it by its
+# top-level name everywhere so there is a single metrics registry
+MYENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'myEnv')
+if MYENV_PATH not in sys.path:
+    sys.path.insert(0, MYENV_PATH)
+from instrumentation import span, trace, render_metrics, observe_request, METRICS_CONTENT_TYPE
+from memoryGovernor import MemoryGovernor, MemoryBudgetExceeded, downscale_image
 
 app = Flask(__name__)
 # CORS configuration - explicitly allow your Vercel domain
+CORS_ORIGINS = ["https://chatisthisreal-zeta.vercel.app", "http://localhost:5173", "http://localhost:3000"]
 CORS(app, 
-     origins=["https://chatisthisreal-zeta.vercel.app", "http://localhost:5173", "http://localhost:3000"],
+     origins=CORS_ORIGINS,
      methods=["GET", "POST", "OPTIONS"],
      allow_headers=["Content-Type"],
      supports_credentials=False)
@@ -43,28 +57,57 @@ except Exception as e:
 # Initialize model variables - will be loaded when needed
 MODEL_AVAILABLE = False
 runModel = None
-runVideo = None
+runVideoAdaptive = None
+analyzeVideo = None
+videoModelPendingMb = None
+videoClipFrames = None
 model_loaded = False
 model_loading = False
+# Held for the whole load: threads (gthread workers) that arrive meanwhile wait
+# for it and use its result instead of falling back to a random score
+model_load_lock = threading.Lock()
+model_load_attempts = 0
+
+# When set, the models live in separate inference worker processes (see
+# myEnv/inferenceWorkers.py) and this process neither imports torch nor loads them
+INFERENCE_WORKERS_ADDRESS = os.environ.get('INFERENCE_WORKERS_ADDRESS')
+inference_client = None
+
+# Admission control against MEMORY_BUDGET_MB (see myEnv/memoryGovernor.py); RSS is reported in /health
+memory_governor = MemoryGovernor()
 
 def load_model():
-    """Load the model from Render secret files to avoid memory issues"""
-    global MODEL_AVAILABLE, runModel, runVideo, model_loaded, model_loading
+    """
+    Load the model from Render secret files to avoid memory issues.
+    Concurrent callers wait for a load in progress and return its result.
+    """
+    global model_load_attempts
     
     if model_loaded:
         print("=== MODEL ALREADY LOADED ===")
         return MODEL_AVAILABLE
     
-    if model_loading:
-        print("=== MODEL ALREADY LOADING ===")
-        return False
+    attempts = model_load_attempts
+    with model_load_lock:
+        if model_loaded or model_load_attempts != attempts:
+            # Another thread loaded (or failed to load) the model while this one waited
+            print("=== MODEL LOADED BY ANOTHER REQUEST ===")
+            return MODEL_AVAILABLE
+        model_load_attempts += 1
+        return _load_model()
+
+def _load_model():
+    """load_model() itself; runs with model_load_lock held."""
+    global MODEL_AVAILABLE, runModel, runVideoAdaptive, analyzeVideo, videoModelPendingMb, videoClipFrames, model_loaded, model_loading
     
     model_loading = True
     start_time = time.time()
     print("=== STARTING MODEL LOAD ===")
-    print(f"Load start time: {start_time}")
         
     try:
+        if INFERENCE_WORKERS_ADDRESS:
+            return connect_inference_workers(start_time)
+
         print("Step 1: Loading ML dependencies...")
         
         # Optimize PyTorch memory usage
@@ -122,16 +165,19 @@ def load_model():
         
         print("Step 4: Importing model functions...")
         
-        # Import the actual model functions only when needed
+        # Import the actual model functions only when needed. Direct imports
+        # come first: sigmaMethod and videoService import runModel by its
+        # top-level name, and a second copy as myEnv.runModel would load a
+        # second image classifier into the process
         try:
             # Try different import approaches
             try:
-                from myEnv.runModel import runModel as imported_runModel
-                print("Successfully imported runModel using myEnv.runModel")
-            except ImportError as e:
-                print(f"Failed myEnv.runModel import: {e}")
                 from runModel import runModel as imported_runModel
                 print("Successfully imported runModel using direct import")
+            except ImportError as e:
+                print(f"Failed direct runModel import: {e}")
+                from myEnv.runModel import runModel as imported_runModel
+                print("Successfully imported runModel using myEnv.runModel")
             
             runModel = imported_runModel
             print("runModel function loaded successfully")
@@ -142,29 +188,52 @@ def load_model():
         try:
             # Try different import approaches
             try:
-                from myEnv.sigmaMethod import runVideo as imported_runVideo
-                print("Successfully imported runVideo using myEnv.sigmaMethod")
+                from sigmaMethod import runVideoAdaptive as imported_runVideoAdaptive
+                print("Successfully imported runVideoAdaptive using direct import")
             except ImportError as e:
-                print(f"Failed myEnv.sigmaMethod import: {e}")
-                from sigmaMethod import runVideo as imported_runVideo
-                print("Successfully imported runVideo using direct import")
+                print(f"Failed direct sigmaMethod import: {e}")
+                from myEnv.sigmaMethod import runVideoAdaptive as imported_runVideoAdaptive
+                print("Successfully imported runVideoAdaptive using myEnv.sigmaMethod")
             
-            runVideo = imported_runVideo
-            print("runVideo function loaded successfully")
+            runVideoAdaptive = imported_runVideoAdaptive
+            print("runVideoAdaptive function loaded successfully")
         except ImportError as e:
-            print(f"Failed to import runVideo: {e}")
-            runVideo = None
+            print(f"Failed to import runVideoAdaptive: {e}")
+            runVideoAdaptive = None
+        
+        try:
+            # Temporal transformer video path; falls back to runVideoAdaptive when unavailable
+            try:
+                from videoService import analyze_video as imported_analyzeVideo
+                from videoService import pending_model_mb as imported_videoModelPendingMb
+                from videoService import clip_frames as imported_videoClipFrames
+                print("Successfully imported analyze_video using direct import")
+            except ImportError as e:
+                print(f"Failed direct videoService import: {e}")
+                from myEnv.videoService import analyze_video as imported_analyzeVideo
+                from myEnv.videoService import pending_model_mb as imported_videoModelPendingMb
+                from myEnv.videoService import clip_frames as imported_videoClipFrames
+                print("Successfully imported analyze_video using myEnv.videoService")
+            
+            analyzeVideo = imported_analyzeVideo
+            videoModelPendingMb = imported_videoModelPendingMb
+            videoClipFrames = imported_videoClipFrames
+            print("analyze_video function loaded successfully")
+        except ImportError as e:
+            print(f"Failed to import analyze_video: {e}")
+            analyzeVideo = None
+            videoModelPendingMb = None
+            videoClipFrames = None
         
         MODEL_AVAILABLE = True
         model_loaded = True
         model_loading = False
-        end_time = time.time()
-        load_duration = end_time - start_time
         print("=== MODEL LOAD COMPLETE ===")
-        print(f"Load duration: {load_duration:.2f} seconds")
+        print(f"Load duration: {time.time() - start_time:.2f} seconds")
         print(f"Model available: {MODEL_AVAILABLE}")
         print(f"runModel available: {runModel is not None}")
-        print(f"runVideo available: {runVideo is not None}")
+        print(f"runVideoAdaptive available: {runVideoAdaptive is not None}")
+        print(f"analyze_video available: {analyzeVideo is not None}")
         return True
     except ImportError as e:
         print(f"Warning: Could not import model files: {e}")
@@ -178,233 +247,522 @@ def load_model():
         model_loading = False
         return False
 
+def connect_inference_workers(start_time):
+    """load_model() for INFERENCE_WORKERS_ADDRESS: route the model functions to the inference workers."""
+    global MODEL_AVAILABLE, runModel, runVideoAdaptive, analyzeVideo, videoModelPendingMb, videoClipFrames, model_loaded, model_loading, inference_client
+    import functools
+    from inferenceWorkers import InferenceClient
+    from sigmaMethod import runVideoAdaptive as local_runVideoAdaptive
+
+    print(f"Connecting to inference workers at {INFERENCE_WORKERS_ADDRESS}...")
+    if inference_client is None:
+        inference_client = InferenceClient(INFERENCE_WORKERS_ADDRESS)
+    info = inference_client.info()
+    print(f"Inference workers: {info['workers']}, image model: {info['image_model']}, "
+          f"video model: {info['video_model']}")
+    if not info['image_model']:
+        model_loading = False
+        return False
+    # Frames are decoded here and scored by the workers
+    runModel = inference_client.run_model
+    runVideoAdaptive = functools.partial(local_runVideoAdaptive, scoreFrames=inference_client.score_frames)
+    analyzeVideo = inference_client.analyze_video if info['video_model'] else None
+    videoModelPendingMb = None  # the workers load their models at startup
+    videoClipFrames = lambda: info.get('video_frames', 0)  # noqa: E731
+    MODEL_AVAILABLE = True
+    model_loaded = True
+    model_loading = False
+    print("=== MODEL LOAD COMPLETE (inference workers) ===")
+    print(f"Load duration: {time.time() - start_time:.2f} seconds")
+    return True
+
+def preload_models():
+    """
+    load_model(), then build the image classifier and the video transformer
+    right away instead of on the first request. Used by gunicornPreload.py in
+    the master process, so that forked workers start with both models and
+    share their pages. Runs no inference: the workers must be the first to
+    start torch's thread pool.
+    Returns True if the image classifier is ready.
+    """
+    if not load_model():
+        return False
+    if INFERENCE_WORKERS_ADDRESS:
+        return True  # the inference workers hold the models
+    import torch
+    if torch.cuda.is_available():
+        print("CUDA is available; models are not preloaded (CUDA state cannot be shared across fork)")
+        return False
+    device = torch.device("cpu")
+    with span("model_preload"):
+        image_model = sys.modules[runModel.__module__].load_image_classifier(device)
+        if analyzeVideo is not None:
+            sys.modules[analyzeVideo.__module__].load_video_model(device)
+    return image_model is not None
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/upload', methods=['POST', 'OPTIONS'])
-def upload_file():
-    request_start_time = time.time()
-    print(f"\n=== UPLOAD REQUEST RECEIVED ===")
-    print(f"Request start time: {request_start_time}")
-    print(f"Request method: {request.method}")
-    print(f"Request headers: {dict(request.headers)}")
-    print(f"Request files: {request.files}")
-    print(f"Request form: {request.form}")
+class UploadError(Exception):
+    """Invalid or unsavable upload; carries the HTTP status to answer with."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class AnalysisCancelled(Exception):
+    """Raised from a progress callback when the client of a streamed analysis went away."""
+
+def unique_upload_path(filename):
+    """Path in the upload folder for filename, suffixed _1, _2, ... if that name is taken."""
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     
-    # Handle CORS preflight requests
-    if request.method == 'OPTIONS':
-        print("Handling CORS preflight request")
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        return response
+    # Check if file already exists
+    if os.path.exists(filepath):
+        # Rename the file to avoid conflicts
+        base_name, extension = os.path.splitext(filename)
+        counter = 1
+        while os.path.exists(filepath):
+            new_filename = f"{base_name}_{counter}{extension}"
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
+            counter += 1
+    return filepath
+
+def save_upload(files):
+    """
+    Steps 1-3 of an upload: validate request.files['file'] and save it to the
+    upload folder under a unique name. Returns (filename, filepath).
+    Raises UploadError with the status code to return to the client.
+    """
+    # Check if file was uploaded
+    if 'file' not in files:
+        raise UploadError('No file provided', 400)
     
-    try:
-        print("Step 1: Checking if file was uploaded...")
-        # Check if file was uploaded
-        if 'file' not in request.files:
-            print("ERROR: No file in request.files")
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
-        print(f"File object: {file}")
-        print(f"File filename: {file.filename}")
-        print(f"File content type: {file.content_type}")
-        
-        # Check if file was selected
-        if file.filename == '':
-            print("ERROR: Empty filename")
-            return jsonify({'error': 'No file selected'}), 400
-        
-        print("Step 2: Checking file type...")
-        # Check if file type is allowed
-        if not allowed_file(file.filename):
-            print(f"ERROR: File type not allowed: {file.filename}")
-            return jsonify({'error': 'File type not allowed'}), 400
-        
-        print("Step 3: Saving file...")
-        # Save the file
-        if file.filename is None:
-            print("ERROR: Filename is None")
-            return jsonify({'error': 'Invalid filename'}), 400
-            
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        absolute_filepath = os.path.abspath(filepath)
-        print(f"Attempting to save file to: {filepath}")
-        print(f"Absolute filepath: {absolute_filepath}")
-        print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
-        print(f"Upload folder exists: {os.path.exists(app.config['UPLOAD_FOLDER'])}")
-        print(f"Upload folder writable: {os.access(app.config['UPLOAD_FOLDER'], os.W_OK)}")
-        
-        # Check if file already exists
-        if os.path.exists(filepath):
-            print(f"WARNING: File already exists: {filepath}")
-            # Optionally, you can rename the file to avoid conflicts
-            base_name, extension = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(filepath):
-                new_filename = f"{base_name}_{counter}{extension}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                counter += 1
-            print(f"Using new filename: {os.path.basename(filepath)}")
+    file = files['file']
+    
+    # Check if file was selected
+    if file.filename == '':
+        raise UploadError('No file selected', 400)
+    
+    # Check if file type is allowed
+    if not allowed_file(file.filename):
+        raise UploadError('File type not allowed', 400)
+    
+    # Save the file
+    if file.filename is None:
+        raise UploadError('Invalid filename', 400)
         
+    filename = secure_filename(file.filename)
+    filepath = unique_upload_path(filename)
+    
+    with span("save_upload"):
         try:
             file.save(filepath)
-            print(f"SUCCESS: File saved to {filepath}")
         except Exception as save_error:
             print(f"ERROR saving file: {save_error}")
-            return jsonify({'error': f'Failed to save file: {save_error}'}), 500
-        
-        # Verify file was actually saved
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            print(f"VERIFICATION: File exists with size {file_size} bytes")
-        else:
-            print(f"ERROR: File was not actually saved to {filepath}")
-            return jsonify({'error': 'File was not saved successfully'}), 500
-        
-        # List contents of uploads directory
+            raise UploadError(f'Failed to save file: {save_error}', 500)
+    
+    # Verify file was actually saved
+    if not os.path.exists(filepath):
+        print(f"ERROR: File was not actually saved to {filepath}")
+        raise UploadError('File was not saved successfully', 500)
+    return filename, filepath
+
+def analyze_file(filepath, progress=None):
+    """
+    Steps 4-6 of an upload: load the model if needed, score the file as an
+    image or video, and turn the score into the response fields.
+    progress: optional callable(event, data_dict) receiving stage events
+      (model_loaded, decoded, fft_features, cnn, ...) and per-frame video
+      scores as they happen (used by the job API and streamed uploads). It may
+      raise AnalysisCancelled to stop the analysis.
+    Returns a dict with 'percentage', 'analysis_result', 'model_used',
+    'fallback', 'memory' (the governor's decision, when a model ran) and, when
+    the video transformer ran, 'top_frames'. 'fallback' is None when the model
+    produced the score, otherwise why the percentage is random: 'no_model',
+    'model_error' or 'unexpected_result'.
+    Raises UploadError (413/503) when the memory governor rejects the file.
+    """
+    # Try to load model if not already loaded
+    model_load_start = time.time()
+    if not MODEL_AVAILABLE:
+        with span("model_load"):
+            load_model()
+    if progress is not None:
+        progress('model_loaded', {'seconds': round(time.time() - model_load_start, 4), 'model_available': MODEL_AVAILABLE})
+    
+    top_frames = None
+    fallback = None
+    admission = None
+    # Determine if file is video or image based on extension
+    video_extensions = {'.mp4', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.webm'}
+    file_extension = os.path.splitext(filepath)[1].lower()
+    max_frames = int(os.environ.get('VIDEO_ADAPTIVE_MAX_FRAMES', 8))
+    if MODEL_AVAILABLE and runModel is not None:
+        # Check the file against the memory budget before anything decodes it
+        pending_mb = videoModelPendingMb() if file_extension in video_extensions and videoModelPendingMb else 0.0
         try:
-            uploads_contents = os.listdir(app.config['UPLOAD_FOLDER'])
-            print(f"Uploads directory contents: {uploads_contents}")
-        except Exception as list_error:
-            print(f"ERROR listing uploads directory: {list_error}")
-        
-        print("Step 4: Loading model...")
-        # Try to load model if not already loaded
-        model_load_start = time.time()
-        if not MODEL_AVAILABLE:
-            print("Model not available, attempting to load...")
-            load_success = load_model()
-            model_load_end = time.time()
-            model_load_duration = model_load_end - model_load_start
-            print(f"Model load attempt completed in {model_load_duration:.2f} seconds")
-            print(f"Model load success: {load_success}")
-        else:
-            print("Model already available, skipping load")
-        
-        print("Step 5: Processing with model...")
-        # Use the actual AI detection model if available, otherwise use random
-        if MODEL_AVAILABLE and runModel is not None:
-            try:
-                # Determine if file is video or image based on extension
-                video_extensions = {'.mp4', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.webm'}
-                file_extension = os.path.splitext(filepath)[1].lower()
-                print(f"File extension: {file_extension}")
-                
-                # Use the actual model to detect AI vs Human
-                if file_extension in video_extensions and runVideo is not None:
-                    print("Processing as VIDEO")
-                    model_result = runVideo(filepath, 3)
-                    print("______________VIDEO______________")
-                else:
-                    print("Processing as IMAGE")
-                    model_result = runModel(filepath)
-                    print("______________IMAGE______________")
-                print(f"Model result: {model_result}")
-                print(f"Model result type: {type(model_result)}")
-                
-                # Convert model result to percentage (assuming it returns a confidence score)
-                if isinstance(model_result, (int, float)):
-                    percentage = round(float(model_result), 1)
-                    print("==============MODEL SUCCESS==============")
-                else:
-                    # Fallback to random if model result is unexpected
-                    percentage = round(random.random() * 100, 1)
-                    print("==============MODEL FALLBACK==============")
-            except Exception as e:
-                print(f"Model failed, using fallback: {e}")
-                print(f"Model error type: {type(e).__name__}")
-                import traceback
-                print(f"Model error traceback: {traceback.format_exc()}")
-                print("==============MODEL ERROR FALLBACK==============")
+            with span("memory_admission"):
+                # Frames held at once: the transformer's clip when it runs, and the
+                # adaptive scan's cap should it fall back to that
+                held_frames = max_frames
+                if file_extension in video_extensions and analyzeVideo is not None and videoClipFrames:
+                    held_frames = max(held_frames, videoClipFrames())
+                admission = memory_governor.reserve(filepath, file_extension in video_extensions,
+                                                    max_frames=held_frames, extra_mb=pending_mb)
+        except MemoryBudgetExceeded as e:
+            print(f"Memory governor rejected {os.path.basename(filepath)} ({e.status}): {e}")
+            raise UploadError(str(e), e.status)
+        except Exception as e:
+            # Unreadable header: let the model path report the real error
+            print(f"Memory governor could not probe {os.path.basename(filepath)}: {e}")
+    decode_size = admission.max_side if admission is not None else None
+    # Use the actual AI detection model if available, otherwise use random
+    if MODEL_AVAILABLE and runModel is not None:
+        try:
+            # Use the actual model to detect AI vs Human
+            video_result = None
+            if file_extension in video_extensions and analyzeVideo is not None:
+                try:
+                    with span("analyze_video"):
+                        video_result = analyzeVideo(filepath, progress=progress, decode_size=decode_size)
+                except AnalysisCancelled:
+                    raise
+                except Exception as video_error:
+                    print(f"Video transformer failed, falling back to runVideoAdaptive: {video_error}")
+                if video_result is None:
+                    print("Video transformer unavailable, falling back to runVideoAdaptive")
+            if video_result is not None:
+                model_result = video_result['percentage']
+                top_frames = video_result['top_frames']
+            elif file_extension in video_extensions and runVideoAdaptive is not None:
+                with span("run_video_adaptive"):
+                    model_result, details = runVideoAdaptive(filepath, maxFrames=max_frames, returnDetails=True,
+                                                              progress=progress, decodeSize=decode_size)
+            else:
+                if decode_size is not None:
+                    with span("downscale"):
+                        downscale_image(filepath, decode_size)
+                with span("run_model"):
+                    model_result = runModel(filepath, progress=progress)
+            
+            # Convert model result to percentage (assuming it returns a confidence score)
+            if isinstance(model_result, (int, float)):
+                percentage = round(float(model_result), 1)
+            else:
+                # Fallback to random if model result is unexpected
                 percentage = round(random.random() * 100, 1)
-        else:
-            # Fallback to random function if model not loaded
+                fallback = 'unexpected_result'
+                print(f"==============MODEL FALLBACK============== unexpected result {model_result!r}")
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            print(f"Model failed, using fallback: {e}")
+            print(f"Model error type: {type(e).__name__}")
+            import traceback
+            print(f"Model error traceback: {traceback.format_exc()}")
+            print("==============MODEL ERROR FALLBACK==============")
             percentage = round(random.random() * 100, 1)
-            print("==============NO MODEL FALLBACK==============")
-        
-        print("Step 6: Calculating results...")
-        # Calculate percentage and determine AI/Human
-        if percentage < 50:
-            confidence = round(100 - percentage, 1)
-            analysis_result = f"{confidence}% sure this is AI"
-        else:
-            confidence = round(percentage, 1)
-            analysis_result = f"{confidence}% sure this is human"
-        
-        print(f"Final percentage: {percentage}%")
-        print(f"Final analysis: {analysis_result}")
-        
-        print("Step 7: Cleaning up...")
+            fallback = 'model_error'
+        finally:
+            memory_governor.release(admission)
+    else:
+        # Fallback to random function if model not loaded
+        percentage = round(random.random() * 100, 1)
+        fallback = 'no_model'
+        print("==============NO MODEL FALLBACK==============")
+    
+    # Calculate percentage and determine AI/Human
+    if percentage < 50:
+        confidence = round(100 - percentage, 1)
+        analysis_result = f"{confidence}% sure this is AI"
+    else:
+        confidence = round(percentage, 1)
+        analysis_result = f"{confidence}% sure this is human"
+    
+    result = {'percentage': percentage, 'analysis_result': analysis_result, 'model_used': MODEL_AVAILABLE,
+              'fallback': fallback, 'memory': admission.as_dict() if admission is not None else None}
+    if top_frames is not None:
+        result['top_frames'] = top_frames
+    return result
+
+def cleanup_upload(filepath):
+    """
+    Step 7 of an upload: delete the file and release cached GPU memory.
+    No forced gc.collect(): the analysis does not build reference cycles, so
+    its arrays are freed as soon as it returns, and the memory governor keeps
+    each request's peak within MEMORY_BUDGET_MB up front.
+    """
+    with span("cleanup"):
         # Delete the uploaded file after processing
         try:
             if os.path.exists(filepath):
                 os.remove(filepath)
-                print(f"SUCCESS: File deleted from {filepath}")
             else:
                 print(f"WARNING: File not found for deletion: {filepath}")
         except Exception as e:
             print(f"ERROR: Failed to delete file {filepath}: {str(e)}")
         
-        # Clean up memory after processing
         try:
-            import gc
-            gc.collect()  # Force garbage collection
             if 'torch' in sys.modules:
                 import torch
                 if torch.cuda.is_available():
                     torch.cuda.empty_cache()
-            print("Memory cleanup completed")
         except Exception as e:
             print(f"Memory cleanup failed: {e}")
-        
-        request_end_time = time.time()
-        total_duration = request_end_time - request_start_time
-        print(f"=== UPLOAD REQUEST COMPLETE ===")
-        print(f"Total request duration: {total_duration:.2f} seconds")
-        
-        response = jsonify({
-            'message': 'File uploaded successfully',
-            'filename': filename,
-            'filepath': filepath,
-            'percentage': percentage,
-            'analysis_result': analysis_result,
-            'model_used': MODEL_AVAILABLE,
-            'request_duration': round(total_duration, 2)
-        })
-        
-        # Add CORS headers to the response
+
+def stream_analysis(filename, filepath, stream_format, request_start_time, request_trace, debug_spans=False):
+    """
+    Streamed variant of /upload (?stream=ndjson or ?stream=sse). The analysis
+    runs on a helper thread and every progress event is sent as soon as it
+    happens: one JSON object per line for ndjson, or an SSE message, each with
+    'event' and 'elapsed' (seconds since the request started). The last event
+    is 'result' (the usual /upload response fields, plus 'spans' when
+    debug_spans is set) or 'error'.
+    If the client disconnects, the next progress callback raises
+    AnalysisCancelled, so an abandoned video stops between frames.
+    The request latency is observed when the stream ends, with the status of
+    its last event (499 if the client went away first), instead of in
+    record_request_latency when the headers are sent.
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+    endpoint, method, request_timer = request.url_rule.rule, request.method, g.request_timer
+    g.stream_observes_latency = True
+    
+    def progress(event, data=None):
+        if cancelled.is_set():
+            raise AnalysisCancelled()
+        events.put((event, data or {}))
+    
+    def run():
+        try:
+            analysis = analyze_file(filepath, progress=progress)
+            result = {'message': 'File uploaded successfully', 'filename': filename}
+            result.update(analysis)
+            result['request_duration'] = round(time.time() - request_start_time, 2)
+            if debug_spans:
+                result['spans'] = request_trace.breakdown()
+            print(f"upload {filename} streamed in {result['request_duration']:.2f}s: {request_trace.summary()}")
+            events.put(('result', result))
+        except AnalysisCancelled:
+            print(f"Analysis of {filename} cancelled: client disconnected")
+        except UploadError as e:
+            events.put(('error', {'error': str(e), 'status': e.status}))
+        except Exception as e:
+            print(f"Streamed analysis failed: {e}")
+            events.put(('error', {'error': str(e)}))
+        finally:
+            cleanup_upload(filepath)
+            events.put(None)
+    
+    def encode_event(event, data):
+        payload = dict(data, event=event, elapsed=round(time.time() - request_start_time, 3))
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps(payload) + "\n"
+    
+    def generate():
+        status = 499  # client closed the stream before the last event
+        try:
+            yield encode_event('saved', {'filename': filename})
+            while True:
+                item = events.get()
+                if item is None:
+                    break
+                event, data = item
+                if event == 'result':
+                    status = 200
+                elif event == 'error':
+                    status = data.get('status', 500)
+                yield encode_event(event, data)
+        finally:
+            # Runs when the stream ends or the client goes away (generator closed)
+            cancelled.set()
+            observe_request(endpoint, method, status, time.perf_counter() - request_timer)
+    
+    # The thread runs in a copy of this context so its spans land on request_trace
+    threading.Thread(target=contextvars.copy_context().run, args=(run,),
+                     name=f'analysis-{filename}', daemon=True).start()
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+    return response, 200
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if g.get('stream_observes_latency'):
+        return response  # streamed /upload: observed when the stream ends
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    observe_request(endpoint, request.method, response.status_code, time.perf_counter() - g.request_timer)
+    return response
+
+def debug_spans_requested():
+    """?debug=1 (or SPAN_DEBUG=1 for every request) adds the span breakdown to /upload responses."""
+    return request.args.get('debug') == '1' or os.environ.get('SPAN_DEBUG') == '1'
+
+@app.route('/upload', methods=['POST', 'OPTIONS'])
+def upload_file():
+    request_start_time = time.time()
+    
+    # Handle CORS preflight requests
+    if request.method == 'OPTIONS':
+        response = jsonify({'status': 'ok'})
         response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
         response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        
-        return response, 200
-        
-    except Exception as e:
-        request_end_time = time.time()
-        total_duration = request_end_time - request_start_time
-        print(f"=== UPLOAD REQUEST FAILED ===")
-        print(f"Exception: {str(e)}")
-        print(f"Exception type: {type(e).__name__}")
-        print(f"Total request duration: {total_duration:.2f} seconds")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        
-        response = jsonify({'error': str(e)})
-        response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
-        return response, 500
+        return response
+    
+    with trace() as request_trace:
+        try:
+            try:
+                filename, filepath = save_upload(request.files)
+            except UploadError as upload_error:
+                print(f"upload rejected ({upload_error.status}): {upload_error}")
+                return jsonify({'error': str(upload_error)}), upload_error.status
+            
+            stream_format = request.args.get('stream')
+            if stream_format in ('ndjson', 'sse'):
+                return stream_analysis(filename, filepath, stream_format, request_start_time,
+                                       request_trace, debug_spans=debug_spans_requested())
+            
+            try:
+                analysis = analyze_file(filepath)
+            except UploadError as upload_error:
+                cleanup_upload(filepath)
+                response = jsonify({'error': str(upload_error)})
+                response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
+                return response, upload_error.status
+            percentage = analysis['percentage']
+            analysis_result = analysis['analysis_result']
+            
+            cleanup_upload(filepath)
+            
+            total_duration = time.time() - request_start_time
+            print(f"upload {filename} done in {total_duration:.2f}s: {request_trace.summary()}")
+            
+            result = {
+                'message': 'File uploaded successfully',
+                'filename': filename,
+                'filepath': filepath,
+                'percentage': percentage,
+                'analysis_result': analysis_result,
+                'model_used': analysis['model_used'],
+                'fallback': analysis['fallback'],
+                'memory': analysis['memory'],
+                'request_duration': round(total_duration, 2)
+            }
+            if 'top_frames' in analysis:
+                result['top_frames'] = analysis['top_frames']
+            if debug_spans_requested():
+                result['spans'] = request_trace.breakdown()
+            response = jsonify(result)
+            
+            # Add CORS headers to the response
+            response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
+            response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+            response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+            
+            return response, 200
+            
+        except Exception as e:
+            total_duration = time.time() - request_start_time
+            print(f"=== UPLOAD REQUEST FAILED === after {total_duration:.2f}s: {request_trace.summary()}")
+            print(f"Exception: {str(e)}")
+            print(f"Exception type: {type(e).__name__}")
+            import traceback
+            print(f"Traceback: {traceback.format_exc()}")
+            
+            response = jsonify({'error': str(e)})
+            response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
+            return response, 500
+
+# Background jobs: the queue is created on first use, in the process that serves it
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join(UPLOAD_FOLDER, 'jobs.sqlite'))
+job_store = None
+job_queue = None
+job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global job_store, job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_store = JobStore(JOBS_DB_PATH)
+            job_queue = JobQueue(job_store, analyze_file,
+                                 max_workers=int(os.environ.get('JOB_WORKERS', 1)))
+            print(f"Job queue started: {JOBS_DB_PATH} ({os.environ.get('JOB_WORKERS', 1)} workers)")
+    return job_queue
+
+def cors_response(response):
+    response.headers.add('Access-Control-Allow-Origin', 'https://chatisthisreal-zeta.vercel.app')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+    return response
+
+@app.route('/jobs', methods=['POST', 'OPTIONS'])
+def create_job():
+    """Save the upload, queue it for analysis and return the job ID immediately (202)."""
+    if request.method == 'OPTIONS':
+        return cors_response(jsonify({'status': 'ok'}))
+    try:
+        filename, filepath = save_upload(request.files)
+    except UploadError as upload_error:
+        return cors_response(jsonify({'error': str(upload_error)})), upload_error.status
+    job_id = get_job_queue().submit(filepath, filename, cleanup=cleanup_upload)
+    print(f"Queued job {job_id} for {filename}")
+    return cors_response(jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/jobs/{job_id}',
+        'events_url': f'/jobs/{job_id}/events'
+    })), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status, latest per-frame progress, and the result once done."""
+    get_job_queue()
+    job = job_store.get(job_id)
+    if job is None:
+        return cors_response(jsonify({'error': 'Unknown job'})), 404
+    return cors_response(jsonify(job)), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream of a job's progress, ending with 'done' or 'failed'."""
+    get_job_queue()
+    if job_store.get(job_id) is None:
+        return cors_response(jsonify({'error': 'Unknown job'})), 404
+    try:
+        after_seq = max(0, int(request.headers.get('Last-Event-ID', 0) or 0))
+    except ValueError:
+        after_seq = 0  # malformed header: replay from the start
+    response = Response(stream_with_context(stream_job_events(job_store, job_id, after_seq)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return cors_response(response)
 
 @app.route('/test', methods=['GET'])
 def test_endpoint():
     return jsonify({'message': 'Backend is working!', 'timestamp': '2024-01-01'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage and request latency histograms in the Prometheus text format."""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'model_available': MODEL_AVAILABLE}), 200
+    return jsonify({'status': 'healthy', 'model_available': MODEL_AVAILABLE,
+                    'memory': memory_governor.stats()}), 200
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000) 
\ No newline at end of file
@@ -0,0 +1,364 @@
+# ASGI entry point: the /upload, /health, /test and /metrics contract of app.py for an
+# async server, e.g.
+#     uvicorn asgi:app --host 0.0.0.0 --port $PORT
+#
+# Under gunicorn sync workers one slow upload holds a whole worker while the
+# body trickles in, and the same worker then runs the model. Here uploads are
+# received on the event loop and streamed to disk part by part (werkzeug's
+# sans-IO multipart decoder), so slow clients only cost a coroutine. The
+# analysis itself (app.analyze_file) runs on a bounded thread pool:
+#
+#   INFERENCE_CONCURRENCY    analyses running at once, default 1
+#   INFERENCE_QUEUE_DEPTH    uploads allowed to wait for a slot, default 4
+#   INFERENCE_QUEUE_TIMEOUT  seconds an upload may wait for a slot, default 60
+#   MAX_UPLOAD_MB            request body limit, default 100
+#
+# Excess load is turned away quickly instead of piling up:
+#   429 + Retry-After  all slots busy and the wait queue is full (checked before
+#                      the body is read, and again once it has arrived)
+#   503 + Retry-After  the model is still loading, a queued upload waited longer
+#                      than INFERENCE_QUEUE_TIMEOUT, or the server is shutting down
+# Retry-After is estimated from the average analysis time and the queue length.
+
+import asyncio
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from werkzeug.utils import secure_filename
+import app as flask_app
+from app import UploadError, AnalysisCancelled
+from instrumentation import span, trace, render_metrics, observe_request, METRICS_CONTENT_TYPE
+
+
+def _env_number(name, default, cast=int):
+    try:
+        return cast(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class Overloaded(Exception):
+    """Request turned away by admission control; carries the status and Retry-After seconds."""
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the upload was fully received."""
+
+
+class InferenceGate:
+    def __init__(self, concurrency=1, queue_depth=4, queue_timeout=60.0):
+        """
+        concurrency: analyses run at once, each on its own executor thread.
+        queue_depth: requests allowed to wait for a free slot.
+        queue_timeout: seconds a request may wait before it gets a 503.
+        """
+        self.concurrency = max(1, concurrency)
+        self.queue_depth = max(0, queue_depth)
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='inference')
+        self.running = 0
+        self.waiting = 0
+        self.closing = False
+        # Running average of one analysis, seeds the Retry-After estimate
+        self.average_seconds = _env_number('INFERENCE_SECONDS_ESTIMATE', 5.0, float)
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    def is_full(self):
+        return self.running + self.waiting >= self.concurrency + self.queue_depth
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up for a new request."""
+        return max(1, math.ceil(self.average_seconds * (self.waiting + 1) / self.concurrency))
+
+    def check_admission(self):
+        if self.closing:
+            raise Overloaded('Server is shutting down', 503, self.retry_after())
+        if self.is_full():
+            raise Overloaded('Server busy, too many analyses queued', 429, self.retry_after())
+
+    def _finish(self, start):
+        self.running -= 1
+        self._slots.release()
+        self.average_seconds = 0.7 * self.average_seconds + 0.3 * (time.time() - start)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the executor once a slot is free; raises Overloaded instead of waiting too long."""
+        self.check_admission()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded('Timed out waiting for an inference slot', 503, self.retry_after())
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the caller's context so spans land on its request trace
+        future = self.executor.submit(contextvars.copy_context().run, fn, *args)
+        # Free the slot when the thread is done, not when this coroutine is, so
+        # a cancelled request never lets more than `concurrency` analyses run
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._finish, start))
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        return {'running': self.running, 'waiting': self.waiting, 'concurrency': self.concurrency,
+                'queue_depth': self.queue_depth, 'average_seconds': round(self.average_seconds, 2)}
+
+
+gate = InferenceGate(concurrency=_env_number('INFERENCE_CONCURRENCY', 1),
+                     queue_depth=_env_number('INFERENCE_QUEUE_DEPTH', 4),
+                     queue_timeout=_env_number('INFERENCE_QUEUE_TIMEOUT', 60.0, float))
+MAX_UPLOAD_BYTES = _env_number('MAX_UPLOAD_MB', 100, float) * 1024 * 1024
+
+# ---------------------------
+# HTTP helpers
+# ---------------------------
+
+def _cors_headers(headers):
+    origin = headers.get('origin')
+    if origin not in flask_app.CORS_ORIGINS:
+        return []
+    return [(b'access-control-allow-origin', origin.encode()),
+            (b'access-control-allow-headers', b'Content-Type'),
+            (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+            (b'vary', b'Origin')]
+
+
+async def send_json(send, status, payload, headers, extra_headers=()):
+    body = json.dumps(payload).encode()
+    response_headers = [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())]
+    response_headers += _cors_headers(headers) + list(extra_headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_overloaded(send, error, headers):
+    print(f"Rejected upload ({error.status}): {error}; retry after {error.retry_after}s, {gate.stats()}")
+    await send_json(send, error.status, {'error': str(error), 'retry_after': error.retry_after}, headers,
+                    [(b'retry-after', str(error.retry_after).encode())])
+
+
+def _parsed_events(decoder):
+    """Multipart events complete so far; a malformed body becomes an UploadError."""
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError as parse_error:
+            raise UploadError(f'Malformed upload: {parse_error}', 400)
+        if isinstance(event, (NeedData, Epilogue)):
+            return
+        yield event
+
+
+async def receive_upload(receive, headers):
+    """
+    Stream the multipart body to the upload folder as it arrives.
+    Only the 'file' part is kept. Returns (filename, filepath); raises
+    UploadError with the same messages and statuses as app.save_upload, or
+    ClientDisconnected.
+    """
+    mimetype, options = parse_options_header(headers.get('content-type', ''))
+    if mimetype != 'multipart/form-data' or 'boundary' not in options:
+        raise UploadError('No file provided', 400)
+    decoder = MultipartDecoder(options['boundary'].encode())
+    filename = filepath = out = None
+    writing = False
+    received = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES:
+                raise UploadError('File too large', 413)
+            decoder.receive_data(chunk)
+            if not message.get('more_body'):
+                decoder.receive_data(None)
+            for event in _parsed_events(decoder):
+                if isinstance(event, File) and event.name == 'file' and filepath is None:
+                    if event.filename == '':
+                        raise UploadError('No file selected', 400)
+                    if not flask_app.allowed_file(event.filename):
+                        raise UploadError('File type not allowed', 400)
+                    filename = secure_filename(event.filename)
+                    filepath = flask_app.unique_upload_path(filename)
+                    # Body chunks are small, so plain writes don't stall the loop
+                    out = open(filepath, 'wb')
+                    writing = True
+                elif isinstance(event, (File, Field)):
+                    writing = False
+                elif isinstance(event, Data) and writing:
+                    out.write(event.data)
+            if not message.get('more_body'):
+                break
+    except Exception:
+        if out is not None:
+            out.close()
+            os.remove(filepath)
+        raise
+    if out is None:
+        raise UploadError('No file provided', 400)
+    out.close()
+    print(f"SUCCESS: File saved to {filepath} ({received} bytes received)")
+    return filename, filepath
+
+# ---------------------------
+# Routes
+# ---------------------------
+
+async def upload(receive, send, headers, query, request_start_time):
+    with trace() as request_trace:
+        await _upload(receive, send, headers, query, request_start_time, request_trace)
+
+
+async def _upload(receive, send, headers, query, request_start_time, request_trace):
+    try:
+        if flask_app.model_loading:
+            raise Overloaded('Model is loading', 503, max(1, math.ceil(gate.average_seconds)))
+        # Reject before reading the body when there is no room anyway
+        gate.check_admission()
+        content_length = int(headers.get('content-length') or 0)
+        if content_length > MAX_UPLOAD_BYTES:
+            raise UploadError('File too large', 413)
+    except Overloaded as error:
+        # Answer without reading the body; the server closes the connection
+        return await send_overloaded(send, error, headers)
+    except UploadError as error:
+        return await send_json(send, error.status, {'error': str(error)}, headers)
+
+    try:
+        with span("receive_upload"):
+            filename, filepath = await receive_upload(receive, headers)
+    except UploadError as error:
+        return await send_json(send, error.status, {'error': str(error)}, headers)
+    except ClientDisconnected:
+        print("Client disconnected during upload")
+        return
+
+    # A client that hangs up while its analysis waits or runs cancels it between stages
+    cancelled = threading.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        cancelled.set()
+
+    def progress(event, data=None):
+        if cancelled.is_set():
+            raise AnalysisCancelled()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    loop = asyncio.get_running_loop()
+    try:
+        analysis = await gate.run(flask_app.analyze_file, filepath, progress)
+    except Overloaded as error:
+        return await send_overloaded(send, error, headers)
+    except AnalysisCancelled:
+        print(f"Analysis of {filename} cancelled: client disconnected")
+        return
+    except UploadError as error:
+        return await send_json(send, error.status, {'error': str(error)}, headers)
+    except Exception as e:
+        print(f"=== UPLOAD REQUEST FAILED === {type(e).__name__}: {e}")
+        return await send_json(send, 500, {'error': str(e)}, headers)
+    finally:
+        watcher.cancel()
+        # File deletion is blocking I/O; keep it off the event loop
+        await loop.run_in_executor(None, contextvars.copy_context().run, flask_app.cleanup_upload, filepath)
+
+    total_duration = time.time() - request_start_time
+    print(f"upload {filename} done in {total_duration:.2f}s: {request_trace.summary()}")
+    result = {
+        'message': 'File uploaded successfully',
+        'filename': filename,
+        'filepath': filepath,
+        'percentage': analysis['percentage'],
+        'analysis_result': analysis['analysis_result'],
+        'model_used': analysis['model_used'],
+        'fallback': analysis['fallback'],
+        'memory': analysis['memory'],
+        'request_duration': round(total_duration, 2)
+    }
+    if 'top_frames' in analysis:
+        result['top_frames'] = analysis['top_frames']
+    if query.get('debug') == ['1'] or os.environ.get('SPAN_DEBUG') == '1':
+        result['spans'] = request_trace.breakdown()
+    await send_json(send, 200, result, headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Import torch and the models in the background; uploads get a 503 until done
+            asyncio.get_running_loop().run_in_executor(None, flask_app.load_model)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            gate.closing = True
+            gate.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+ROUTES = ('/upload', '/health', '/test', '/metrics')
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    request_start_time = time.time()
+    timer = time.perf_counter()
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    path, method = scope['path'], scope['method']
+    status = {'code': 500}
+
+    async def send_recording_status(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+        await send(message)
+
+    try:
+        await route(path, method, receive, send_recording_status, headers, query, request_start_time)
+    finally:
+        observe_request(path if path in ROUTES else 'unmatched', method, status['code'],
+                        time.perf_counter() - timer)
+
+
+async def route(path, method, receive, send, headers, query, request_start_time):
+    if method == 'OPTIONS':
+        return await send_json(send, 200, {'status': 'ok'}, headers)
+    if path == '/upload':
+        if method != 'POST':
+            return await send_json(send, 405, {'error': 'Method not allowed'}, headers)
+        return await upload(receive, send, headers, query, request_start_time)
+    if path == '/health' and method == 'GET':
+        return await send_json(send, 200, {'status': 'healthy', 'model_available': flask_app.MODEL_AVAILABLE,
+                                           'inference': gate.stats(),
+                                           'memory': flask_app.memory_governor.stats()}, headers)
+    if path == '/test' and method == 'GET':
+        return await send_json(send, 200, {'message': 'Backend is working!', 'timestamp': '2024-01-01'}, headers)
+    if path == '/metrics' and method == 'GET':
+        body = render_metrics().encode()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', METRICS_CONTENT_TYPE.encode()),
+                                (b'content-length', str(len(body)).encode())]})
+        return await send({'type': 'http.response.body', 'body': body})
+    await send_json(send, 404, {'error': 'Not found'}, headers)
@@ -0,0 +1,336 @@
+"""
+End-to-end benchmark suite for the inference pipeline, with regression gates.
+
+`run` measures, and writes one JSON file with machine metadata:
+  runModel.<size>px           runModel on a synthetic PNG of each --sizes value
+  runVideo.<frames>f          runVideo(path, 3) on a generated clip (cv2.VideoWriter)
+  upload.c<n>.p50 / .p95      /upload latency through Flask's test client with n
+  upload.c<n>.throughput      concurrent clients, and requests per second
+  train_step.samples_per_s    ImageClassifier training steps, set up like
+                              imageModel.train_validate_test: AdamW, BCELoss,
+                              grad clipping, first 20 VGG layers frozen
+
+`compare` flags every metric that got worse than the baseline by more than
+--threshold (relative) and exits with status 1 if any did, so it can gate CI.
+It also warns when the two runs come from different machines or library
+versions, since those numbers are not comparable.
+
+Everything runs offline. The image classifier checkpoint is the real
+architecture with random weights (seeded), written to a temporary directory
+and picked up through RENDER_SECRET_FILES_DIR the same way the server finds
+it. The scores are meaningless; the cost is the same as with trained weights.
+No video transformer checkpoint is written, so /upload of a video would use
+the frame-scoring fallback; the upload benchmark posts images only.
+
+Usage (from backend/):
+    python benchmarks/benchSuite.py run --out bench-baseline.json
+    python benchmarks/benchSuite.py run --quick --out bench-new.json
+    python benchmarks/benchSuite.py compare bench-baseline.json bench-new.json --threshold 0.1
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MYENV_DIR = os.path.join(BACKEND_DIR, 'myEnv')
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, MYENV_DIR)
+
+import torch  # noqa: E402
+from torchvision import models  # noqa: E402
+
+
+# ---------------------------
+# Fixtures
+# ---------------------------
+
+def write_random_checkpoint(directory, seed=0):
+    """Random-weight ImageClassifier checkpoint at <directory>/image_classifier.pt."""
+    from runModel import ImageClassifier
+    from spectralOps import FFT_FEATURE_NAMES
+    torch.manual_seed(seed)
+    model = ImageClassifier(models.vgg16(weights=None).features, len(FFT_FEATURE_NAMES))
+    path = os.path.join(directory, 'image_classifier.pt')
+    torch.save(model.state_dict(), path)
+    return path
+
+
+def synthetic_image(size, seed=0):
+    """BGR uint8 test image: smooth gradients, a periodic texture and sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = np.stack([x, y, 1 - x * y], axis=-1) * 200
+    texture = 25 * np.sin(2 * np.pi * 12 * (x + y))[..., None]
+    return np.clip(base + texture + rng.normal(0, 6, (size, size, 3)), 0, 255).astype(np.uint8)
+
+
+def synthetic_clip(path, frames=48, width=320, height=240, fps=24, seed=0):
+    """Write an mp4 of a drifting synthetic scene."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    base = cv2.resize(synthetic_image(max(width, height) * 2, seed), (width * 2, height * 2))
+    for i in range(frames):
+        writer.write(np.ascontiguousarray(base[i:i + height, 2 * i:2 * i + width]))
+    writer.release()
+    return path
+
+
+def timed_runs(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def metric(value, unit, better, samples=None):
+    entry = {'value': round(value, 6), 'unit': unit, 'better': better}
+    if samples is not None:
+        entry['samples'] = [round(s, 6) for s in samples]
+    return entry
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values), q))
+
+# ---------------------------
+# Benchmarks
+# ---------------------------
+
+def bench_run_model(workdir, sizes, repeat):
+    from runModel import runModel
+    results = {}
+    for size in sizes:
+        path = os.path.join(workdir, f'bench_{size}.png')
+        cv2.imwrite(path, synthetic_image(size, seed=size))
+        runs = timed_runs(lambda: runModel(path), repeat)
+        results[f'runModel.{size}px'] = metric(statistics.median(runs), 's', 'lower', runs)
+    return results
+
+
+def bench_run_video(workdir, frames, repeat):
+    from sigmaMethod import runVideo
+    path = synthetic_clip(os.path.join(workdir, 'bench_clip.mp4'), frames=frames)
+    runs = timed_runs(lambda: runVideo(path, 3), repeat)
+    return {f'runVideo.{frames}f': metric(statistics.median(runs), 's', 'lower', runs)}
+
+
+def bench_upload(workdir, concurrencies, requests_per_level, size=512):
+    import app as flask_app
+    image_bytes = cv2.imencode('.png', synthetic_image(size, seed=1))[1].tobytes()
+
+    def post(client):
+        response = client.post('/upload', data={'file': (io.BytesIO(image_bytes), 'bench.png')},
+                               content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/upload returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    post(flask_app.app.test_client())  # loads the model
+    results = {}
+    for concurrency in concurrencies:
+        latencies = []
+        lock = threading.Lock()
+        remaining = [requests_per_level]
+
+        def client_loop():
+            client = flask_app.app.test_client()
+            while True:
+                with lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                start = time.perf_counter()
+                post(client)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+        results[f'upload.c{concurrency}.p50'] = metric(percentile(latencies, 50), 's', 'lower', latencies)
+        results[f'upload.c{concurrency}.p95'] = metric(percentile(latencies, 95), 's', 'lower')
+        results[f'upload.c{concurrency}.throughput'] = metric(len(latencies) / wall, 'req/s', 'higher')
+    return results
+
+
+def bench_train_step(batch_size, steps):
+    from runModel import ImageClassifier
+    from spectralOps import FFT_FEATURE_NAMES
+    torch.manual_seed(0)
+    vgg16 = models.vgg16(weights=None)
+    for param in vgg16.features[:20].parameters():
+        param.requires_grad = False
+    model = ImageClassifier(vgg16.features, len(FFT_FEATURE_NAMES))
+    model.train()
+    criterion = torch.nn.BCELoss()
+    optimizer = torch.optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=5e-5, weight_decay=1e-3)
+    images = torch.randn(batch_size, 3, 224, 224)
+    metas = torch.randn(batch_size, len(FFT_FEATURE_NAMES))
+    labels = torch.randint(0, 2, (batch_size, 1)).float()
+
+    def step():
+        optimizer.zero_grad()
+        loss = criterion(model(images, metas), labels)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+        optimizer.step()
+
+    runs = timed_runs(step, steps)
+    return {'train_step.samples_per_s': metric(batch_size / statistics.median(runs), 'samples/s', 'higher'),
+            'train_step.seconds': metric(statistics.median(runs), 's', 'lower', runs)}
+
+# ---------------------------
+# Metadata and comparison
+# ---------------------------
+
+def machine_metadata(threads):
+    cpu_model = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=BACKEND_DIR).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'cpu_model': cpu_model,
+        'cpu_count': os.cpu_count(),
+        'torch_threads': threads,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cuda': torch.cuda.is_available(),
+        'git_commit': commit,
+    }
+
+
+# Metadata that must match for two runs to be comparable
+COMPARABLE_KEYS = ('cpu_model', 'cpu_count', 'torch_threads', 'torch', 'numpy', 'cuda')
+
+
+def compare(baseline, current, threshold):
+    """Print a comparison table; returns the names of regressed metrics."""
+    for key in COMPARABLE_KEYS:
+        if baseline['metadata'].get(key) != current['metadata'].get(key):
+            print(f"WARNING: {key} differs ({baseline['metadata'].get(key)} vs {current['metadata'].get(key)}); "
+                  f"results may not be comparable")
+    regressions = []
+    print(f"\n{'metric':<32}{'baseline':>12}{'current':>12}{'change':>9}  status")
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        base, cur = baseline['results'].get(name), current['results'].get(name)
+        if base is None or cur is None:
+            print(f"{name:<32}{'-' if base is None else base['value']:>12}{'-' if cur is None else cur['value']:>12}"
+                  f"{'':>9}  {'new' if base is None else 'missing'}")
+            continue
+        change = (cur['value'] - base['value']) / base['value'] if base['value'] else 0.0
+        worse = change > threshold if base['better'] == 'lower' else change < -threshold
+        better = change < -threshold if base['better'] == 'lower' else change > threshold
+        status = 'REGRESSION' if worse else ('improved' if better else 'ok')
+        if worse:
+            regressions.append(name)
+        print(f"{name:<32}{base['value']:>12.4f}{cur['value']:>12.4f}{change * 100:>8.1f}%  {status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='run the suite and write results JSON')
+    run_parser.add_argument('--out', default='bench-results.json')
+    run_parser.add_argument('--sizes', default='256,512,1024', help='runModel image sizes')
+    run_parser.add_argument('--repeat', type=int, default=5, help='timed runs per runModel/runVideo case')
+    run_parser.add_argument('--clip-frames', type=int, default=48)
+    run_parser.add_argument('--concurrency', default='1,2,4', help='/upload client counts')
+    run_parser.add_argument('--requests', type=int, default=8, help='/upload requests per concurrency level')
+    run_parser.add_argument('--train-batch', type=int, default=16, help='batch size of a training step')
+    run_parser.add_argument('--train-steps', type=int, default=3)
+    run_parser.add_argument('--threads', type=int, default=1,
+                            help='torch threads (app.py uses 1 in production)')
+    run_parser.add_argument('--only', help='comma-separated subset: runModel,runVideo,upload,train')
+    run_parser.add_argument('--quick', action='store_true', help='small sizes and few repeats, for CI smoke runs')
+    run_parser.add_argument('--verbose', action='store_true', help="show the pipeline's own log output")
+    compare_parser = sub.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='relative change counted as a regression (default 0.10)')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+        return
+
+    if args.quick:
+        args.sizes, args.repeat, args.clip_frames = '256', 2, 24
+        args.concurrency, args.requests, args.train_batch, args.train_steps = '1,2', 4, 4, 2
+    only = set(args.only.split(',')) if args.only else {'runModel', 'runVideo', 'upload', 'train'}
+    torch.set_num_threads(args.threads)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ['RENDER_SECRET_FILES_DIR'] = workdir
+        write_random_checkpoint(workdir)
+        stages = [
+            ('runModel', lambda: bench_run_model(workdir, [int(s) for s in args.sizes.split(',')], args.repeat)),
+            ('runVideo', lambda: bench_run_video(workdir, args.clip_frames, args.repeat)),
+            ('upload', lambda: bench_upload(workdir, [int(c) for c in args.concurrency.split(',')], args.requests)),
+            ('train', lambda: bench_train_step(args.train_batch, args.train_steps)),
+        ]
+        for name, fn in stages:
+            if name not in only:
+                continue
+            start = time.perf_counter()
+            with contextlib.ExitStack() as quiet:
+                if not args.verbose:
+                    quiet.enter_context(contextlib.redirect_stdout(io.StringIO()))
+                    quiet.enter_context(contextlib.redirect_stderr(io.StringIO()))
+                stage_results = fn()
+            # app.load_model() sets torch to 1 thread; keep every stage on the requested count
+            torch.set_num_threads(args.threads)
+            results.update(stage_results)
+            print(f"{name}: done in {time.perf_counter() - start:.1f}s")
+            for key, value in stage_results.items():
+                print(f"  {key:<30}{value['value']:>12.4f} {value['unit']}")
+
+    with open(args.out, 'w') as f:
+        json.dump({'metadata': machine_metadata(args.threads), 'results': results}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Per-feature profile of extract_fft_features across a resolution sweep.
+
+Every image in the corpus is resized to each --sizes value (square), and each
+step of extract_fft_features is run on its own: the spectrum (grayscale,
+normalize, compute_fft), the ten feature functions from fft_line_energy to
+fft_rgb_cross_spectral_corr (which together give the 15 features), and the
+whole extract_fft_features call from a PNG on disk for reference.
+
+For every (size, step) it reports:
+  ms           median wall time per image (after one warm-up call, so cached
+               spectrum geometry is not counted), averaged over the corpus
+  share        percentage of the summed per-step time at that size
+  peak_kb      peak traced memory above the starting level (tracemalloc)
+  allocs       memory blocks allocated during the call that are still alive
+               when it returns (result and caches), from a tracemalloc snapshot
+               diff. tracemalloc only sees live blocks, so temporaries freed
+               inside the call are not counted; peak_kb is what shows them
+Timing, memory and the stack profile are separate passes, so tracing overhead
+never shows up in the timings.
+
+--folded writes a flamegraph-compatible profile in the folded-stack format
+("<size>px;<step>;caller;callee <microseconds>", one line per stack; feed it to
+flamegraph.pl or load it in speedscope). It is collected with sys.setprofile,
+so numpy C functions appear as leaves.
+
+Without --images a small synthetic corpus is used (seeded noise, a smooth
+gradient and a periodic pattern, so the peak detector has work to do).
+
+Usage (from backend/):
+    python benchmarks/featureProfile.py
+    python benchmarks/featureProfile.py --images 'photos/*.jpg' --sizes 256,512,1024 --repeat 5
+    python benchmarks/featureProfile.py --folded features.folded --json features.json
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'myEnv'))
+
+import runModel as rm  # noqa: E402
+
+
+def synthetic_corpus(size=512, seed=0):
+    """Three BGR uint8 images with different spectra."""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    y, x = np.mgrid[0:size, 0:size] / size
+    gradient = np.stack([x, y, (x + y) / 2], axis=-1) * 255
+    gradient = np.clip(gradient + rng.normal(0, 8, gradient.shape), 0, 255).astype(np.uint8)
+    pattern = (127 + 60 * np.sin(2 * np.pi * 24 * x) + 60 * np.cos(2 * np.pi * 16 * y))[..., None]
+    pattern = np.clip(np.repeat(pattern, 3, axis=-1) + rng.normal(0, 4, (size, size, 3)), 0, 255)
+    return [('noise', noise), ('gradient', gradient), ('pattern', pattern.astype(np.uint8))]
+
+
+def load_corpus(patterns):
+    images = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"Skipping unreadable image: {path}")
+                continue
+            images.append((os.path.basename(path), img))
+    return images
+
+
+def prepare_inputs(img):
+    """The intermediate arrays extract_fft_features builds from a BGR image."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    gray = gray - gray.min()
+    if gray.max() > 0:
+        gray = gray / gray.max()
+    img_rgb = img[..., ::-1].astype(np.float32)
+    for c in range(3):
+        ch = img_rgb[..., c] - img_rgb[..., c].min()
+        if ch.max() > 0:
+            img_rgb[..., c] = ch / ch.max()
+    return {'gray': gray, 'log_mag': rm.compute_fft(gray), 'img_rgb': img_rgb}
+
+
+# Steps in the order extract_fft_features runs them; each takes the prepare_inputs dict
+STEPS = [
+    ('spectrum', lambda d: rm.compute_fft(d['gray'])),
+    ('fft_line_energy', lambda d: rm.fft_line_energy(d['log_mag'])),
+    ('fft_central_cross_ratio', lambda d: rm.fft_central_cross_ratio(d['log_mag'])),
+    ('fft_radial_slope', lambda d: rm.fft_radial_slope(d['log_mag'])),
+    ('fft_high_low_freq_ratio', lambda d: rm.fft_high_low_freq_ratio(d['log_mag'])),
+    ('fft_mid_band_gap', lambda d: rm.fft_mid_band_gap(d['log_mag'])),
+    ('fft_entropy', lambda d: rm.fft_entropy(d['log_mag'])),
+    ('fft_peak_features', lambda d: rm.fft_peak_features(d['log_mag'])),
+    ('fft_angular_variance', lambda d: rm.fft_angular_variance(d['log_mag'])),
+    ('fft_kurtosis_skew', lambda d: rm.fft_kurtosis_skew(d['log_mag'])),
+    ('fft_rgb_cross_spectral_corr', lambda d: rm.fft_rgb_cross_spectral_corr(d['img_rgb'])),
+    # End to end from disk, including cv2.imread and the preparation above
+    ('extract_fft_features', lambda d: rm.extract_fft_features(d['path'])),
+]
+
+
+def time_step(fn, inputs, repeat):
+    fn(inputs)  # warm-up: fills the spectrum geometry cache for this size
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(inputs)
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def memory_step(fn, inputs):
+    """(peak bytes above the starting level, blocks allocated by the call and still alive after it)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = fn(inputs)  # kept alive for the snapshot below
+        peak = tracemalloc.get_traced_memory()[1] - base
+        after = tracemalloc.take_snapshot()
+        allocs = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'traceback'))
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak, allocs
+
+
+class FoldedStackProfiler:
+    """Deterministic stack profiler (sys.setprofile) that accumulates self time per full stack."""
+
+    def __init__(self):
+        self.totals = collections.Counter()
+        self._stack = []
+        self._root = ''
+        self._last = 0.0
+
+    @staticmethod
+    def _name(frame, event, arg):
+        if event == 'c_call':
+            module = getattr(arg, '__module__', None)
+            name = getattr(arg, '__qualname__', None) or getattr(arg, '__name__', '?')
+            return f"{module}.{name}" if module else name
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+        return f"{module}.{frame.f_code.co_name}"
+
+    def _profile(self, frame, event, arg):
+        now = time.perf_counter()
+        self.totals[';'.join([self._root] + self._stack)] += now - self._last
+        if event in ('call', 'c_call'):
+            self._stack.append(self._name(frame, event, arg))
+        elif self._stack:
+            self._stack.pop()
+        self._last = time.perf_counter()
+
+    def run(self, root, fn, *args):
+        self._root, self._stack = root, []
+        self._last = time.perf_counter()
+        sys.setprofile(self._profile)
+        try:
+            fn(*args)
+        finally:
+            sys.setprofile(None)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, seconds in sorted(self.totals.items()):
+                microseconds = int(round(seconds * 1e6))
+                if microseconds > 0:
+                    f.write(f"{stack.replace(' ', '_')} {microseconds}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", default=[], help="image files or glob patterns (default: synthetic)")
+    parser.add_argument("--sizes", default="128,256,512,1024", help="comma-separated square sizes in pixels")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per image and step; the median is kept")
+    parser.add_argument("--folded", help="write a folded-stack profile (flamegraph.pl / speedscope) here")
+    parser.add_argument("--json", help="write the results table as JSON here")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images) if args.images else synthetic_corpus()
+    if not corpus:
+        sys.exit("No readable images in the corpus")
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    profiler = FoldedStackProfiler() if args.folded else None
+    print(f"Corpus: {len(corpus)} images ({'synthetic' if not args.images else 'from disk'}), "
+          f"sizes {sizes}, repeat {args.repeat}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            per_step = {name: {'seconds': [], 'peak': [], 'allocs': []} for name, _ in STEPS}
+            for index, (label, img) in enumerate(corpus):
+                resized = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+                inputs = prepare_inputs(resized)
+                inputs['path'] = os.path.join(tmp, f"{index}_{size}.png")
+                cv2.imwrite(inputs['path'], resized)
+                for name, fn in STEPS:
+                    per_step[name]['seconds'].append(time_step(fn, inputs, args.repeat))
+                    peak, allocs = memory_step(fn, inputs)
+                    per_step[name]['peak'].append(peak)
+                    per_step[name]['allocs'].append(allocs)
+                    if profiler is not None:
+                        profiler.run(f"{size}px;{name}", fn, inputs)
+            # Share is relative to the individual steps, not the end-to-end row
+            step_total = sum(statistics.mean(v['seconds']) for name, v in per_step.items()
+                             if name != 'extract_fft_features')
+            for name, v in per_step.items():
+                mean_seconds = statistics.mean(v['seconds'])
+                results.append({
+                    'size': size,
+                    'step': name,
+                    'ms': round(mean_seconds * 1000, 3),
+                    'share': None if name == 'extract_fft_features' else round(100 * mean_seconds / step_total, 1),
+                    'peak_kb': round(max(v['peak']) / 1024, 1),
+                    'allocs': int(statistics.mean(v['allocs'])),
+                })
+
+    print(f"\n{'size':>6}  {'step':<30}{'ms':>10}{'share':>8}{'peak_kb':>12}{'allocs':>9}")
+    for row in results:
+        share = '' if row['share'] is None else f"{row['share']:.1f}%"
+        print(f"{row['size']:>6}  {row['step']:<30}{row['ms']:>10.3f}{share:>8}{row['peak_kb']:>12.1f}{row['allocs']:>9}")
+        if row['step'] == 'extract_fft_features':
+            print()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'sizes': sizes, 'repeat': args.repeat, 'images': [label for label, _ in corpus],
+                       'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+    if profiler is not None:
+        profiler.write(args.folded)
+        print(f"Folded stacks written to {args.folded}")
+
+
+if __name__ == "__main__":
+    main()
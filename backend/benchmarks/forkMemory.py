@@ -0,0 +1,149 @@
+"""
+Per-worker memory of gunicorn with and without model preloading.
+
+Starts gunicorn with --workers N in each mode, sends image and video uploads
+until every worker has served both (so each one has loaded whatever it loads
+lazily), then reads /proc/<pid>/smaps_rollup of the master and each worker:
+
+  uss     unique set size: Private_Clean + Private_Dirty, the memory that
+          would be freed if that process exited
+  shared  Shared_Clean + Shared_Dirty, pages mapped by other processes too
+  pss     proportional set size: private pages plus each shared page divided
+          by the number of processes mapping it. Summed over the process
+          tree this is the real footprint of the server
+  rss     what top shows; counts every shared page once per process
+
+Modes:
+  lazy           gunicorn app:app, models read into private memory on each
+                 worker's first request (MODEL_MMAP=0, the behaviour before
+                 memory-mapped checkpoints)
+  lazy-mmap      the same with memory-mapped checkpoints (the default now):
+                 the weights are shared through the page cache
+  preload        gunicorn -c gunicornPreload.py: models loaded in the master
+                 before fork, memory-mapped, and gc.freeze()
+
+The model files come from RENDER_SECRET_FILES_DIR as in app.py; without real
+checkpoints, write random ones first (benchSuite.write_random_checkpoint) or
+the numbers will not include the weights.
+
+Usage (from backend/):
+    python benchmarks/forkMemory.py --workers 2
+    python benchmarks/forkMemory.py --workers 3 --modes lazy,preload --json fork.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadTest import build_payloads, free_port, post_upload, process_tree, start_gunicorn  # noqa: E402
+
+MODES = {
+    'lazy': {'config': None, 'env': {'MODEL_MMAP': '0'}},
+    'lazy-mmap': {'config': None, 'env': {'MODEL_MMAP': '1'}},
+    'preload': {'config': 'gunicornPreload.py', 'env': {'MODEL_MMAP': '1'}},
+}
+
+
+def smaps_rollup_mb(pid):
+    """{field: MB} from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': round(fields.get('Rss', 0), 1),
+        'pss': round(fields.get('Pss', 0), 1),
+        'uss': round(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0), 1),
+        'shared': round(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0), 1),
+    }
+
+
+def worker_rss_mb(master_pid):
+    return {pid: smaps_rollup_mb(pid)['rss'] for pid in process_tree(master_pid) if pid != master_pid}
+
+
+def warm_all_workers(url, master_pid, payloads, workers, timeout, rounds=6):
+    """
+    Concurrent rounds of every payload until each worker's RSS has stopped
+    growing, i.e. every worker has loaded its models and served both kinds.
+    """
+    import concurrent.futures
+    previous = {}
+    for _ in range(rounds):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers * len(payloads)) as pool:
+            list(pool.map(lambda p: post_upload(url, p[2], p[3], timeout), payloads * workers))
+        current = worker_rss_mb(master_pid)
+        if previous and all(abs(current.get(pid, 0) - rss) < 5 for pid, rss in previous.items()):
+            return current
+        previous = current
+    return previous
+
+
+def measure(mode, workers, payloads, timeout):
+    port = free_port()
+    log_path = os.path.join(tempfile.gettempdir(), f'forkMemory-{mode}.log')
+    print(f"\n[{mode}] starting gunicorn --workers {workers} (log: {log_path})")
+    settings = MODES[mode]
+    process = start_gunicorn(workers, 1, port, log_path, int(timeout), config=settings['config'],
+                             env=settings['env'])
+    try:
+        url = f'http://127.0.0.1:{port}'
+        start = time.perf_counter()
+        warm_all_workers(url, process.pid, payloads, workers, timeout)
+        print(f"[{mode}] warm-up took {time.perf_counter() - start:.1f}s")
+        processes = [('master', process.pid)] + [
+            (f'worker {i + 1}', pid) for i, pid in enumerate(p for p in process_tree(process.pid)
+                                                              if p != process.pid)]
+        rows = [dict(smaps_rollup_mb(pid), process=name, pid=pid) for name, pid in processes]
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    worker_rows = [r for r in rows if r['process'] != 'master']
+    return {
+        'mode': mode,
+        'processes': rows,
+        'worker_uss_mean': round(sum(r['uss'] for r in worker_rows) / max(len(worker_rows), 1), 1),
+        'total_pss': round(sum(r['pss'] for r in rows), 1),
+        'total_rss': round(sum(r['rss'] for r in rows), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--modes', default='lazy,lazy-mmap,preload', help=f"comma-separated: {', '.join(MODES)}")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', help='write the measurements here')
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(',') if m]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        sys.exit(f"Unknown mode(s): {', '.join(unknown)}")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        payloads = build_payloads(workdir, [('image', 1), ('video', 1)], [(256, 1)], [(24, 1)])
+        for mode in modes:
+            results.append(measure(mode, args.workers, payloads, args.timeout))
+
+    print(f"\n{'mode':<11}{'process':<10}{'pid':>8}{'uss':>9}{'shared':>9}{'pss':>9}{'rss':>9}   (MB)")
+    for result in results:
+        for row in result['processes']:
+            print(f"{result['mode']:<11}{row['process']:<10}{row['pid']:>8}{row['uss']:>9.0f}{row['shared']:>9.0f}"
+                  f"{row['pss']:>9.0f}{row['rss']:>9.0f}")
+        print(f"{result['mode']:<11}{'total':<10}{'':>8}{'':>9}{'':>9}{result['total_pss']:>9.0f}"
+              f"{result['total_rss']:>9.0f}   mean worker USS {result['worker_uss_mean']:.0f} MB\n")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'workers': args.workers, 'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
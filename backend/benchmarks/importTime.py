@@ -0,0 +1,88 @@
+"""
+Import-time benchmark for the serving path.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter (with
+myEnv on sys.path, the same way app.py sets it up), parses the importtime
+report, and prints the total cumulative import time, peak RSS after import and
+the heaviest top-level packages. Each module is measured --repeat times and
+the fastest run is reported, since the first run also pays for a cold disk cache.
+
+Usage (from backend/):
+    python benchmarks/importTime.py                      # runModel
+    python benchmarks/importTime.py runModel scipy.stats skimage.feature
+    python benchmarks/importTime.py --top 20 --repeat 5 runModel
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MYENV_DIR = os.path.join(BACKEND_DIR, 'myEnv')
+
+# importtime lines look like: "import time:       123 |       4567 | package.sub"
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+CHILD_CODE = """
+import sys, resource
+sys.path.insert(0, {backend!r})
+sys.path.insert(0, {myenv!r})
+import {module}
+print("MAXRSS_KB", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure(module):
+    """
+    Import `module` in a fresh interpreter under -X importtime.
+    Returns (total_us, maxrss_kb, {top-level package: self_us summed over its modules}).
+    """
+    code = CHILD_CODE.format(backend=BACKEND_DIR, myenv=MYENV_DIR, module=module)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, cwd=BACKEND_DIR)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    total_us = 0
+    packages = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us = int(match.group(1)), int(match.group(2))
+        depth = len(match.group(3)) // 2
+        name = match.group(4)
+        top = name.split('.')[0]
+        packages[top] = packages.get(top, 0) + self_us
+        # The depth-0 entry for the module itself carries the whole import
+        if depth == 0 and name == module:
+            total_us = cumulative_us
+    maxrss_kb = 0
+    for line in proc.stdout.splitlines():
+        if line.startswith("MAXRSS_KB"):
+            maxrss_kb = int(line.split()[1])
+    return total_us, maxrss_kb, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["runModel"],
+                        help="modules to import (resolved with backend/ and myEnv/ on sys.path)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module; the fastest is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of heaviest packages to list")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        total_us, maxrss_kb, packages = min(runs, key=lambda run: run[0])
+        print(f"\n=== import {module} ===")
+        print(f"Cumulative import time: {total_us / 1000:.1f} ms (best of {args.repeat})")
+        print(f"Peak RSS after import:  {maxrss_kb / 1024:.1f} MB")
+        print(f"{'package':<24}{'self ms':>14}")
+        for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"{name:<24}{us / 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
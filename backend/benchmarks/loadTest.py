@@ -0,0 +1,431 @@
+"""
+Load generator and capacity planner for the /upload endpoint.
+
+Replays a mix of image and video uploads with Poisson (open-loop) arrivals at
+--rate requests per second for --duration seconds. Requests are sent on
+schedule whether or not earlier ones have finished, the way real users
+arrive, so queueing inside the server shows up as latency and not as a
+lower arrival rate.
+
+The payloads are synthetic (see benchSuite.py): images of --image-sizes and
+clips of --video-frames frames, picked with the given weights, e.g.
+    --mix image:0.8,video:0.2 --image-sizes 512:0.6,1024:0.4 --video-frames 48:1
+
+Two ways to run:
+  --configs 1x1,1x2,2x1   start `gunicorn app:app --workers W --threads T` for
+                          each WxT configuration in turn (as render.yaml does,
+                          on a local port), warm every worker up, then measure
+  --url http://host:port  measure a server that is already running; pass --pid
+                          (its master process) to also sample its memory
+
+For each configuration it reports throughput, latency percentiles (p50, p90,
+p99, successful requests only), the error rate (non-200 responses and
+connection failures), the fallback rate (200 responses whose percentage is
+random, by the 'fallback' field of the response: no_model, model_error,
+unexpected_result) and the RSS of the server process tree sampled over time
+from /proc.
+
+The capacity report then recommends the configuration that meets --target-p99
+with at most --max-error-rate errors, at most --max-fallback-rate random
+answers and a peak RSS under --memory-limit-mb (Render's free plan has
+512 MB), preferring the smallest memory footprint.
+If none qualifies, it says so and names the configuration with the lowest p99.
+
+Usage (from backend/):
+    python benchmarks/loadTest.py --configs 1x1,1x2,2x1 --rate 0.5 --duration 60 --target-p99 10
+    python benchmarks/loadTest.py --url http://127.0.0.1:5000 --pid 1234 --rate 1 --json load.json
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchSuite import synthetic_clip, synthetic_image  # noqa: E402
+
+
+# ---------------------------
+# Workload
+# ---------------------------
+
+def parse_weights(spec, cast=str):
+    """'a:0.8,b:0.2' -> [(cast('a'), 0.8), (cast('b'), 0.2)]; a missing weight counts as 1."""
+    pairs = []
+    for item in spec.split(','):
+        if not item:
+            continue
+        key, _, weight = item.partition(':')
+        pairs.append((cast(key), float(weight or 1)))
+    return pairs
+
+
+def build_payloads(workdir, mix, image_sizes, video_frames):
+    """[(kind, label, filename, bytes, probability)] for every payload in the workload."""
+    kinds = dict(mix)
+    total_kind = sum(kinds.values())
+    payloads = []
+    for kind, variants in (('image', image_sizes), ('video', video_frames)):
+        if not kinds.get(kind):
+            continue
+        total_variant = sum(weight for _, weight in variants)
+        for value, weight in variants:
+            if kind == 'image':
+                filename = f'load_{value}px.png'
+                data = cv2.imencode('.png', synthetic_image(value, seed=value))[1].tobytes()
+                label = f'image {value}px'
+            else:
+                filename = f'load_{value}f.mp4'
+                path = synthetic_clip(os.path.join(workdir, filename), frames=value, seed=value)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                label = f'video {value}f'
+            payloads.append((kind, label, filename, data,
+                             kinds[kind] / total_kind * weight / total_variant))
+    return payloads
+
+
+def multipart_body(filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def post_upload(url, filename, data, timeout):
+    """(status, parsed JSON body or None, seconds)"""
+    # Every request gets its own name: uploads are saved under the client's filename and the
+    # server's collision check is not atomic across workers
+    stem, ext = os.path.splitext(filename)
+    body, content_type = multipart_body(f'{stem}_{uuid.uuid4().hex[:8]}{ext}', data)
+    req = urllib.request.Request(url.rstrip('/') + '/upload', data=body, method='POST',
+                                 headers={'Content-Type': content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    except (urllib.error.URLError, OSError) as e:
+        return None, {'error': str(e)}, time.perf_counter() - start
+    seconds = time.perf_counter() - start
+    try:
+        return status, json.loads(raw), seconds
+    except ValueError:
+        return status, None, seconds
+
+
+def run_load(url, payloads, rate, duration, timeout, max_in_flight, seed=0):
+    """Send Poisson arrivals for `duration` seconds; returns one record per request."""
+    rng = np.random.default_rng(seed)
+    probabilities = np.array([p[4] for p in payloads])
+    records = []
+    lock = threading.Lock()
+
+    def send(index, offset):
+        kind, label, filename, data, _ = payloads[index]
+        status, body, seconds = post_upload(url, filename, data, timeout)
+        record = {'kind': kind, 'payload': label, 'offset': round(offset, 3), 'status': status,
+                  'seconds': round(seconds, 4),
+                  'fallback': body.get('fallback') if status == 200 and body else None,
+                  'error': body.get('error') if status != 200 and body else None}
+        if status == 200 and body and body.get('model_used') is False and not record['fallback']:
+            record['fallback'] = 'no_model'
+        with lock:
+            records.append(record)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        start = time.perf_counter()
+        next_arrival = rng.exponential(1 / rate)
+        while next_arrival < duration:
+            delay = start + next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, rng.choice(len(payloads), p=probabilities), next_arrival)
+            next_arrival += rng.exponential(1 / rate)
+    return records
+
+# ---------------------------
+# Server process tree memory
+# ---------------------------
+
+def process_tree(pid):
+    """pid and all of its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the command name may contain spaces; ppid is the second field after it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler:
+    """Samples the summed RSS of a process tree every `interval` seconds on a background thread."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # (seconds since start, total MB, {pid: MB})
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            per_process = {pid: round(rss_mb(pid), 1) for pid in process_tree(self.pid)}
+            self.samples.append((round(time.perf_counter() - start, 2), round(sum(per_process.values()), 1),
+                                 per_process))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+# ---------------------------
+# gunicorn configurations
+# ---------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, threads, port, log_path, timeout=120, config=None, env=None):
+    """
+    Start gunicorn with the render.yaml command line, plus workers/threads; wait for /health.
+    config: gunicorn config file (-c), e.g. gunicornPreload.py. env: extra environment variables.
+    """
+    log = open(log_path, 'ab')
+    command = [sys.executable, '-m', 'gunicorn']
+    if config:
+        command += ['-c', config]
+    command += ['app:app', '--bind', f'127.0.0.1:{port}', '--timeout', str(timeout),
+                '--workers', str(workers), '--threads', str(threads)]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT,
+                               env=dict(os.environ, **(env or {})))
+    log.close()
+    # A preloading master loads the models before the first worker answers
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}; see {log_path}")
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=2):
+                return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not answer /health within 120s; see {log_path}")
+
+
+def warm_up(url, payloads, count, timeout):
+    """Concurrent image uploads so that every worker loads the model before measuring; returns seconds."""
+    image = next((p for p in payloads if p[0] == 'image'), payloads[0])
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as pool:
+        list(pool.map(lambda _: post_upload(url, image[2], image[3], timeout), range(count)))
+    return time.perf_counter() - start
+
+# ---------------------------
+# Reporting
+# ---------------------------
+
+def summarize(name, records, wall, samples):
+    ok = [r for r in records if r['status'] == 200]
+    latencies = np.array([r['seconds'] for r in ok]) if ok else np.array([np.nan])
+    fallbacks = {}
+    for r in ok:
+        if r['fallback']:
+            fallbacks[r['fallback']] = fallbacks.get(r['fallback'], 0) + 1
+    by_payload = {}
+    for label in sorted({r['payload'] for r in ok}):
+        values = [r['seconds'] for r in ok if r['payload'] == label]
+        by_payload[label] = {'count': len(values), 'p50': round(float(np.percentile(values, 50)), 3),
+                             'p99': round(float(np.percentile(values, 99)), 3)}
+    totals = [s[1] for s in samples]
+    return {
+        'config': name,
+        'requests': len(records),
+        'throughput': round(len(ok) / wall, 3) if wall else 0.0,
+        'p50': round(float(np.percentile(latencies, 50)), 3),
+        'p90': round(float(np.percentile(latencies, 90)), 3),
+        'p99': round(float(np.percentile(latencies, 99)), 3),
+        'error_rate': round(1 - len(ok) / len(records), 4) if records else 0.0,
+        'fallback_rate': round(sum(fallbacks.values()) / len(ok), 4) if ok else 0.0,
+        'fallbacks': fallbacks,
+        'statuses': {str(s): sum(1 for r in records if r['status'] == s) for s in {r['status'] for r in records}},
+        'by_payload': by_payload,
+        'rss_peak_mb': round(max(totals), 1) if totals else None,
+        'rss_mean_mb': round(sum(totals) / len(totals), 1) if totals else None,
+        'rss_timeline': [(t, total) for t, total, _ in samples],
+    }
+
+
+def recommend(summaries, target_p99, max_error_rate, max_fallback_rate, memory_limit_mb):
+    """(summary of the recommended configuration or None, reason)"""
+    def fits(s):
+        return (s['p99'] <= target_p99 and s['error_rate'] <= max_error_rate
+                and s['fallback_rate'] <= max_fallback_rate
+                and (memory_limit_mb is None or s['rss_peak_mb'] is None or s['rss_peak_mb'] <= memory_limit_mb))
+
+    candidates = [s for s in summaries if fits(s)]
+    if candidates:
+        best = min(candidates, key=lambda s: (s['rss_peak_mb'] or 0, s['p99']))
+        return best, (f"meets p99 <= {target_p99}s with {best['error_rate']:.1%} errors "
+                      f"at the lowest peak RSS ({best['rss_peak_mb']} MB)")
+    best = min(summaries, key=lambda s: s['p99'])
+    return None, (f"no configuration meets p99 <= {target_p99}s with <= {max_error_rate:.0%} errors "
+                  f"and <= {max_fallback_rate:.0%} fallbacks"
+                  f"{'' if memory_limit_mb is None else f' under {memory_limit_mb} MB'}; "
+                  f"lowest p99 was {best['config']} ({best['p99']}s). Lower the arrival rate "
+                  f"or use a larger instance")
+
+
+def print_report(summaries, recommendation, reason, args):
+    print(f"\nCapacity report: {args.rate} req/s Poisson for {args.duration}s, mix {args.mix}, "
+          f"target p99 {args.target_p99}s")
+    print(f"{'config':<10}{'req':>6}{'req/s':>8}{'p50':>8}{'p90':>8}{'p99':>8}{'errors':>8}{'fallback':>10}"
+          f"{'rss peak':>10}{'rss mean':>10}")
+    for s in summaries:
+        peak = '-' if s['rss_peak_mb'] is None else f"{s['rss_peak_mb']:.0f}MB"
+        mean = '-' if s['rss_mean_mb'] is None else f"{s['rss_mean_mb']:.0f}MB"
+        print(f"{s['config']:<10}{s['requests']:>6}{s['throughput']:>8.2f}{s['p50']:>8.2f}{s['p90']:>8.2f}"
+              f"{s['p99']:>8.2f}{s['error_rate']:>8.1%}{s['fallback_rate']:>10.1%}{peak:>10}{mean:>10}")
+        for label, stats in s['by_payload'].items():
+            print(f"{'':<10}  {label:<16}{stats['count']:>4} ok  p50 {stats['p50']:.2f}s  p99 {stats['p99']:.2f}s")
+        if s['fallbacks']:
+            print(f"{'':<10}  fallbacks: {s['fallbacks']}")
+    if recommendation is None:
+        print(f"\nNo recommendation: {reason}")
+    else:
+        print(f"\nRecommended: {recommendation['config']} (workers x threads): {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--configs', default='1x1,1x2,2x1', help='gunicorn WORKERSxTHREADS configurations to try')
+    target.add_argument('--url', help='measure an already running server instead')
+    parser.add_argument('--pid', type=int, help='with --url: server master pid for RSS sampling')
+    parser.add_argument('--rate', type=float, default=0.5, help='mean arrivals per second')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of arrivals per configuration')
+    parser.add_argument('--mix', default='image:0.8,video:0.2', help='kind:weight pairs')
+    parser.add_argument('--image-sizes', default='512:0.6,1024:0.4', help='size:weight pairs (square pixels)')
+    parser.add_argument('--video-frames', default='48:1', help='frames:weight pairs (320x240 clips)')
+    parser.add_argument('--target-p99', type=float, default=10.0, help='latency target in seconds')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--max-fallback-rate', type=float, default=0.01,
+                        help='share of random (fallback) answers tolerated')
+    parser.add_argument('--memory-limit-mb', type=float, default=512, help='instance memory; 0 disables the check')
+    parser.add_argument('--timeout', type=float, default=120, help='client timeout per request (gunicorn --timeout)')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='client-side cap on open requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write summaries, RSS timelines and per-request records here')
+    args = parser.parse_args()
+
+    memory_limit = args.memory_limit_mb or None
+    summaries, all_records = [], {}
+    with tempfile.TemporaryDirectory() as workdir:
+        payloads = build_payloads(workdir, parse_weights(args.mix), parse_weights(args.image_sizes, int),
+                                  parse_weights(args.video_frames, int))
+        if not payloads:
+            sys.exit("The workload is empty; check --mix")
+        print("Workload: " + ', '.join(f"{label} {p:.0%}" for _, label, _, _, p in payloads))
+
+        if args.url:
+            runs = [('external', args.url, None)]
+        else:
+            runs = []
+            for config in args.configs.split(','):
+                workers, threads = (int(v) for v in config.lower().split('x'))
+                runs.append((config, None, (workers, threads)))
+
+        for name, url, shape in runs:
+            process = None
+            try:
+                if shape is not None:
+                    port = free_port()
+                    log_path = os.path.join(tempfile.gettempdir(), f'loadTest-{name}.log')
+                    print(f"\n[{name}] starting gunicorn --workers {shape[0]} --threads {shape[1]} (log: {log_path})")
+                    process = start_gunicorn(shape[0], shape[1], port, log_path, int(args.timeout))
+                    url = f'http://127.0.0.1:{port}'
+                    pid = process.pid
+                    warmup_seconds = warm_up(url, payloads, shape[0] * shape[1] * 2, args.timeout)
+                    print(f"[{name}] warm-up (model load in each worker) took {warmup_seconds:.1f}s")
+                else:
+                    pid = args.pid
+                print(f"[{name}] sending {args.rate} req/s for {args.duration}s")
+                start = time.perf_counter()
+                if pid:
+                    with RssSampler(pid) as sampler:
+                        records = run_load(url, payloads, args.rate, args.duration, args.timeout,
+                                           args.max_in_flight, args.seed)
+                    samples = sampler.samples
+                else:
+                    records = run_load(url, payloads, args.rate, args.duration, args.timeout,
+                                       args.max_in_flight, args.seed)
+                    samples = []
+                wall = time.perf_counter() - start
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait(timeout=30)
+            summary = summarize(name, records, wall, samples)
+            if shape is not None:
+                summary['warmup_seconds'] = round(warmup_seconds, 2)
+            summaries.append(summary)
+            all_records[name] = records
+
+    recommendation, reason = recommend(summaries, args.target_p99, args.max_error_rate, args.max_fallback_rate,
+                                      memory_limit)
+    print_report(summaries, recommendation, reason, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'summaries': summaries, 'records': all_records,
+                       'recommendation': recommendation['config'] if recommendation else None,
+                       'reason': reason}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
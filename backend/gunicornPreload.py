@@ -0,0 +1,54 @@
+# gunicorn config for preforked serving with one shared copy of the models, e.g.
+#     gunicorn -c gunicornPreload.py app:app --bind 0.0.0.0:$PORT
+#
+# Without it every worker imports torch and builds its own VGG16 +
+# ImageClassifier (and video transformer) on its first request, so memory
+# grows linearly with the number of workers. Here the master imports the app
+# (preload_app), loads both models (app.preload_models) and then forks the
+# workers, which inherit everything copy-on-write:
+#
+#   - the weights are memory-mapped from the checkpoint files
+#     (runModel.load_checkpoint), so they are clean file-backed pages that are
+#     never copied, and are shared even with processes that did not fork from here;
+#   - torch, numpy, OpenCV and the rest of the import-time heap are shared as
+#     long as nothing writes to it. Python writes to objects it only reads
+#     (reference counts, and the cyclic GC's bookkeeping on every object it
+#     scans), so after loading, gc.freeze() moves every existing object out of
+#     the collector's reach: collections in the workers no longer touch (and
+#     copy) the pages of objects inherited from the master.
+#
+# No inference runs in the master: torch's thread pool must start in the
+# workers. benchmarks/forkMemory.py measures per-worker unique memory (USS)
+# with and without this config.
+#
+# Workers come from WEB_CONCURRENCY (default 1, as plain gunicorn), threads
+# per worker from GUNICORN_THREADS (default 4); code changes need a full
+# restart, since HUP reloads would fork from the stale preloaded app.
+
+import gc
+import os
+import random
+
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Threaded workers, as in render.yaml: job event streams outlive --timeout (see jobQueue.py)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120  # as in render.yaml
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked
+    import app
+    if app.preload_models():
+        server.log.info("Models preloaded in the master; workers will share them")
+    else:
+        server.log.warning("Models not preloaded; each worker loads them on its first request")
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Workers would otherwise share the master's random state (used by the fallback scores)
+    random.seed()
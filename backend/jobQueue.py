@@ -0,0 +1,221 @@
+import json
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------
+# Background analysis jobs for the /jobs API.
+#
+# Jobs and their progress events live in a small SQLite file, so any gunicorn
+# worker can answer GET /jobs/<id> for a job another worker is running. Each
+# web process runs jobs on its own bounded thread pool; the request that
+# submits a job returns immediately, so long videos never hold a request open
+# past gunicorn's timeout.
+#
+# A job dies with the process that runs it (worker restart, timeout kill,
+# deploy). Every job row records its owner (host and pid); queued or running
+# jobs whose owner is no longer alive are marked failed when a queue starts,
+# on every submit, and by event streams that have been idle for a heartbeat,
+# so clients following them get a 'failed' event instead of waiting forever.
+#
+# The jobs run in the web process and /jobs/<id>/events holds its request
+# open until the job ends, so serve the app with a threaded or async worker
+# class (gunicorn --worker-class gthread, as in render.yaml and
+# gunicornPreload.py). A sync worker is blocked by the stream and gets killed
+# by gunicorn's --timeout, taking its jobs with it.
+# ---------------------------
+
+HOST = socket.gethostname()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+class JobStore:
+    def __init__(self, db_path):
+        """db_path: SQLite file holding jobs and their events (created if missing)."""
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, filename TEXT, status TEXT, created REAL, updated REAL,"
+                " result TEXT, error TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " job_id TEXT, seq INTEGER, created REAL, event TEXT, data TEXT,"
+                " PRIMARY KEY (job_id, seq))"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'owner_host' not in columns:
+                # Files created before jobs recorded their owner
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_host TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections are not shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, filename):
+        """New queued job owned by this process (the one whose pool will run it)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, filename, status, created, updated, owner_host, owner_pid)"
+                         " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                         (job_id, filename, now, now, HOST, os.getpid()))
+        return job_id
+
+    def fail_orphans(self, job_id=None):
+        """
+        Mark queued/running jobs whose owning process on this host has exited
+        (or that predate owner tracking) as failed, with a 'failed' event.
+        job_id: only check that job. Returns the IDs marked failed.
+        """
+        query = ("SELECT id, owner_host, owner_pid FROM jobs WHERE status IN ('queued', 'running')"
+                 + (" AND id = ?" if job_id is not None else ""))
+        rows = self._connect().execute(query, (job_id,) if job_id is not None else ()).fetchall()
+        orphans = [row[0] for row in rows
+                   if row[1] is None or (row[1] == HOST and not _pid_alive(row[2]))]
+        error = 'The server process running this job exited; please resubmit'
+        for orphan in orphans:
+            with self._connect() as conn:
+                # Re-check the status so a job that just finished is left alone
+                updated = conn.execute("UPDATE jobs SET status = 'failed', updated = ?, error = ?"
+                                       " WHERE id = ? AND status IN ('queued', 'running')",
+                                       (time.time(), error, orphan)).rowcount
+            if updated:
+                self.add_event(orphan, 'failed', {'error': error})
+        return orphans
+
+    def set_status(self, job_id, status, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated = ?, result = ?, error = ? WHERE id = ?",
+                         (status, time.time(), json.dumps(result) if result is not None else None,
+                          error, job_id))
+
+    def add_event(self, job_id, event, data=None):
+        with self._connect() as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?",
+                               (job_id,)).fetchone()[0]
+            conn.execute("INSERT INTO job_events VALUES (?, ?, ?, ?, ?)",
+                         (job_id, seq, time.time(), event, json.dumps(data or {})))
+            conn.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+        return seq
+
+    def get(self, job_id):
+        """Job as a dict (with the latest progress event), or None if unknown."""
+        row = self._connect().execute(
+            "SELECT id, filename, status, created, updated, result, error FROM jobs WHERE id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {'job_id': row[0], 'filename': row[1], 'status': row[2], 'created': row[3],
+               'updated': row[4], 'result': json.loads(row[5]) if row[5] else None, 'error': row[6]}
+        last = self._connect().execute(
+            "SELECT event, data FROM job_events WHERE job_id = ? AND event = 'frame_scored'"
+            " ORDER BY seq DESC LIMIT 1", (job_id,)).fetchone()
+        job['progress'] = json.loads(last[1]) if last else None
+        return job
+
+    def events_since(self, job_id, after_seq=0):
+        """[(seq, event, data)] for events with seq > after_seq, oldest first."""
+        rows = self._connect().execute(
+            "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after_seq)).fetchall()
+        return [(seq, event, json.loads(data)) for seq, event, data in rows]
+
+    def purge(self, older_than_seconds):
+        """Delete finished jobs (and their events) not updated for older_than_seconds."""
+        cutoff = time.time() - older_than_seconds
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_events WHERE job_id IN"
+                         " (SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated < ?)", (cutoff,))
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (cutoff,))
+
+
+class JobQueue:
+    def __init__(self, store, handler, max_workers=1, retention_seconds=3600):
+        """
+        store: JobStore.
+        handler: callable(filepath, progress) -> JSON-serialisable result, where
+          progress(event, data) records a progress event for the job.
+        max_workers: jobs analyzed concurrently by this process.
+        retention_seconds: finished jobs older than this are purged on submit.
+        """
+        self.store = store
+        self.handler = handler
+        self.retention_seconds = retention_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        orphans = self.store.fail_orphans()
+        if orphans:
+            print(f"Marked {len(orphans)} job(s) of exited processes as failed")
+
+    def submit(self, filepath, filename, cleanup=None):
+        """
+        Queue filepath for analysis and return the job ID right away.
+        cleanup: optional callable(filepath) run after the job finishes either way.
+        """
+        self.store.purge(self.retention_seconds)
+        self.store.fail_orphans()
+        job_id = self.store.create(filename)
+        self.store.add_event(job_id, 'queued', {'filename': filename})
+        self._pool.submit(self._run, job_id, filepath, cleanup)
+        return job_id
+
+    def _run(self, job_id, filepath, cleanup):
+        start = time.time()
+        self.store.set_status(job_id, 'running')
+        self.store.add_event(job_id, 'started')
+        try:
+            result = self.handler(filepath, lambda event, data=None: self.store.add_event(job_id, event, data))
+            self.store.set_status(job_id, 'done', result=result)
+            self.store.add_event(job_id, 'done', {'result': result, 'duration': round(time.time() - start, 2)})
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.store.set_status(job_id, 'failed', error=str(e))
+            self.store.add_event(job_id, 'failed', {'error': str(e)})
+        finally:
+            if cleanup is not None:
+                cleanup(filepath)
+
+
+def stream_job_events(store, job_id, after_seq=0, poll_interval=0.5, heartbeat_seconds=15):
+    """
+    Generator of Server-Sent Events text for a job: every stored event after
+    after_seq (a client's Last-Event-ID) as
+    "id: <seq>\\nevent: <name>\\ndata: <json>\\n\\n", ending after 'done' or
+    'failed'. Sends a comment line as heartbeat so proxies keep the stream open;
+    at each heartbeat the job is checked for a dead owner (JobStore.fail_orphans),
+    whose 'failed' event then ends the stream.
+    """
+    seq = after_seq
+    last_sent = time.time()
+    while True:
+        for seq, event, data in store.events_since(job_id, seq):
+            yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            last_sent = time.time()
+            if event in ('done', 'failed'):
+                return
+        if time.time() - last_sent > heartbeat_seconds:
+            if store.fail_orphans(job_id):
+                continue  # send the 'failed' event right away
+            yield ": keep-alive\n\n"
+            last_sent = time.time()
+        time.sleep(poll_interval)
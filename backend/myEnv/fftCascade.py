@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from instrumentation import Histogram
+from spectralOps import FFT_FEATURE_NAMES
+
+# ---------------------------
+# FFT-only first stage of a two-stage cascade in front of ImageClassifier.
+#
+# A logistic regression over the 15 FFT features (trained by trainCascade.py
+# and exported as JSON) scores every image before the VGG16 conv stack runs.
+# Images it is confident about, with max(p, 1 - p) >= threshold, are answered
+# with its probability straight away; the rest escalate to the full model.
+# The features are computed either way (the full model uses them too), so an
+# answered image skips only the VGG16 preprocessing and forward pass, which
+# is most of the cost of a small image.
+#
+# Every decision is recorded in the cascade_confidence histogram on /metrics
+# (label decision=answered|escalated): escalation rate =
+# escalated count / total count.
+#
+# Environment:
+#   CASCADE_MODEL      path of the JSON written by trainCascade.py; unset
+#                      (default) disables the cascade
+#   CASCADE_THRESHOLD  confidence needed to answer without VGG16, overriding
+#                      the threshold stored in the JSON; 1.0 escalates everything
+# ---------------------------
+
+CONFIDENCE = Histogram('cascade_confidence', 'FFT cascade confidence by decision.', ('decision',),
+                       buckets=(0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.975, 0.99))
+
+
+class FftCascade:
+    """Standardized logistic regression over prepared FFT features (prepare_fft_batch output)."""
+
+    def __init__(self, spec, threshold=None):
+        if list(spec['feature_names']) != FFT_FEATURE_NAMES:
+            raise ValueError("cascade was trained on a different FFT feature set")
+        self.mean = np.asarray(spec['mean'], dtype=np.float64)
+        self.scale = np.asarray(spec['scale'], dtype=np.float64)
+        self.coef = np.asarray(spec['coef'], dtype=np.float64)
+        self.intercept = float(spec['intercept'])
+        self.threshold = float(spec.get('threshold', 1.0) if threshold is None else threshold)
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        with open(path, 'r') as f:
+            return cls(json.load(f), threshold)
+
+    def probability(self, features):
+        """Real-probability for an [N,15] (or [15]) array of prepared features."""
+        z = ((np.asarray(features, dtype=np.float64) - self.mean) / self.scale) @ self.coef + self.intercept
+        return 1.0 / (1.0 + np.exp(-np.clip(z, -60, 60)))
+
+    def decide(self, features):
+        """
+        (probabilities, answered): answered[i] is True where the cascade is
+        confident enough to skip the full model. Records the decisions.
+        """
+        p = np.atleast_1d(self.probability(features))
+        confidence = np.maximum(p, 1.0 - p)
+        answered = confidence >= self.threshold
+        for c, a in zip(confidence, answered):
+            CONFIDENCE.observe(float(c), decision='answered' if a else 'escalated')
+        return p, answered
+
+
+_cascade = None
+_cascade_key = None
+_cascade_lock = threading.Lock()
+
+
+def load_cascade():
+    """The FftCascade configured by CASCADE_MODEL / CASCADE_THRESHOLD, or None when disabled."""
+    global _cascade, _cascade_key
+    path = os.environ.get('CASCADE_MODEL')
+    threshold = os.environ.get('CASCADE_THRESHOLD')
+    key = (path, threshold)
+    if not path:
+        return None
+    with _cascade_lock:
+        if key != _cascade_key:
+            try:
+                _cascade = FftCascade.load(path, None if threshold is None else float(threshold))
+                print(f"FFT cascade loaded from {path} (threshold {_cascade.threshold})")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not load FFT cascade from {path}: {e}; every image uses the full model")
+                _cascade = None
+            _cascade_key = key
+        return _cascade
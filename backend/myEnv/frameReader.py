@@ -0,0 +1,438 @@
+import os
+import time
+import cv2
+import numpy as np
+
+# ---------------------------
+# Frame extraction engine.
+#
+# cap.set(CAP_PROP_POS_FRAMES, i) makes the decoder restart from the keyframe
+# before i, so on long-GOP H.264 every seek re-decodes up to a whole GOP. When
+# the wanted frames are close together it is much cheaper to decode forward once:
+# grab() advances the decoder without the colour conversion/copy, and retrieve()
+# is only paid for the frames we keep. Seeking is still used for gaps long
+# enough that decoding through them costs more than a seek.
+# ---------------------------
+
+# Gap (in frames) above which read_frames seeks instead of grabbing through,
+# used when no measurement is available (roughly one GOP of 30fps H.264).
+DEFAULT_SEEK_THRESHOLD = 48
+
+# Frames grab()bed by measure_seek_threshold; videos shorter than 4x this are
+# not measured.
+SEEK_PROBE_FRAMES = 24
+
+# Measured thresholds per (fourcc, width, height), filled by measure_seek_threshold
+# the first time read_frames meets a format
+_seek_thresholds = {}
+
+
+def _format_key(cap):
+    return (int(cap.get(cv2.CAP_PROP_FOURCC) or 0),
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0))
+
+
+def count_frames(video_path, exact=False):
+    """
+    Number of frames in a video. By default this trusts the container's frame
+    count; exact=True decodes forward with grab() and counts, for files whose
+    header is missing or wrong. Returns 0 if the video cannot be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    if exact or count <= 0:
+        count = 0
+        while cap.grab():
+            count += 1
+    cap.release()
+    return count
+
+
+def measure_seek_threshold(video_path, probe_frames=SEEK_PROBE_FRAMES, probe_seeks=3):
+    """
+    Time grab() against a seek + read on this video and return the gap (in
+    frames) at which seeking becomes cheaper than decoding forward. The result
+    is remembered for the video's (codec, resolution), which is what the
+    trade-off depends on.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return DEFAULT_SEEK_THRESHOLD
+    key = _format_key(cap)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    if total < 4 * probe_frames:
+        # Too short to measure; sequential decoding is cheap anyway
+        cap.release()
+        return _seek_thresholds.get(key, DEFAULT_SEEK_THRESHOLD)
+
+    start = time.perf_counter()
+    grabbed = 0
+    while grabbed < probe_frames and cap.grab():
+        grabbed += 1
+    grab_cost = (time.perf_counter() - start) / max(grabbed, 1)
+
+    start = time.perf_counter()
+    for k in range(probe_seeks):
+        # Land mid-GOP in the back half of the clip, away from the probed frames
+        target = total // 2 + (k * total) // (2 * probe_seeks) + probe_frames // 2
+        cap.set(cv2.CAP_PROP_POS_FRAMES, min(target, total - 1))
+        cap.read()
+    seek_cost = (time.perf_counter() - start) / probe_seeks
+    cap.release()
+
+    threshold = max(1, int(round(seek_cost / max(grab_cost, 1e-6))))
+    _seek_thresholds[key] = threshold
+    return threshold
+
+
+def read_frames(video_path, indices, seek_threshold=None, transform=None):
+    """
+    Decode the frames at `indices` (any order, duplicates allowed) in one
+    forward pass over the video.
+    seek_threshold: gap in frames above which to seek rather than grab through.
+      None uses the threshold measured for this video's format, measuring it
+      on this video first if the format is new (see measure_seek_threshold).
+      Videos too short to measure use DEFAULT_SEEK_THRESHOLD.
+    transform: optional callable(frame) applied to each decoded frame; its
+      result is stored instead, so full frames need not be kept (see
+      frame_signatures).
+    Returns {frame_idx: BGR ndarray} for every index that could be decoded;
+    indices past the real end of the stream are simply missing.
+    """
+    targets = sorted(set(int(i) for i in indices))
+    frames = {}
+    if not targets:
+        return frames
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video: {video_path!r}")
+    if seek_threshold is None:
+        key = _format_key(cap)
+        if key not in _seek_thresholds and len(targets) > 1 and \
+                int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0) >= 4 * SEEK_PROBE_FRAMES:
+            measure_seek_threshold(video_path)
+        seek_threshold = _seek_thresholds.get(key, DEFAULT_SEEK_THRESHOLD)
+
+    pos = 0  # index of the next frame the decoder will produce
+    for target in targets:
+        gap = target - pos
+        if gap > seek_threshold:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            pos = target
+        else:
+            while pos < target and cap.grab():
+                pos += 1
+            if pos < target:
+                break  # stream ended early
+        if not cap.grab():
+            break
+        pos += 1
+        ret, frame = cap.retrieve()
+        if ret and frame is not None:
+            frames[target] = frame if transform is None else transform(frame)
+    cap.release()
+    return frames
+
+
+# ---------------------------
+# Cheap frame signatures for scene-aware sampling.
+#
+# One forward pass of read_frames computes a tiny signature per sampled frame
+# (a 16x16 grayscale thumbnail, values in [0,1]). Consecutive signatures that differ a lot mark a
+# shot boundary; near-identical signatures mark duplicate frames from a static
+# shot. select_diverse_frames then spends the frame budget on distinct content
+# instead of on evenly spaced timestamps.
+# ---------------------------
+
+def frame_signatures(video_path, size=16, max_signatures=512):
+    """
+    Decode the video once and return (frame_indices, signatures):
+      frame_indices: int array [N] of the frames that were signed
+      signatures:    float32 [N, size*size] grayscale thumbnails in [0,1]
+    Long videos are subsampled to at most max_signatures frames with a fixed
+    stride. The frames are read with read_frames, so frames in between are only
+    grab()bed, or skipped with a seek when the stride exceeds the seek threshold,
+    and only the thumbnails are kept.
+    """
+    total = count_frames(video_path)
+    stride = max(1, -(-total // max_signatures)) if total > 0 else 1
+
+    def signature(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        thumb = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+        return thumb.astype(np.float32).ravel() / 255.0
+
+    signed = read_frames(video_path, range(0, max(total, 1), stride), transform=signature)
+    if not signed:
+        return np.zeros(0, dtype=int), np.zeros((0, size * size), dtype=np.float32)
+    indices = sorted(signed)
+    return np.array(indices, dtype=int), np.stack([signed[i] for i in indices])
+
+
+def detect_shot_boundaries(signatures, min_jump=0.08, median_factor=4.0):
+    """
+    Positions (into signatures) where a new shot starts, always including 0.
+    A boundary is a jump in mean absolute difference between consecutive
+    signatures that exceeds both min_jump and median_factor times the
+    median jump (so camera motion within a shot does not count).
+    """
+    if len(signatures) == 0:
+        return []
+    jumps = np.abs(np.diff(signatures, axis=0)).mean(axis=1)
+    if jumps.size == 0:
+        return [0]
+    threshold = max(min_jump, median_factor * float(np.median(jumps)))
+    return [0] + [int(i) + 1 for i in np.nonzero(jumps > threshold)[0]]
+
+
+def select_diverse_frames(frame_indices, signatures, k, boundaries=None, temporal_weight=0.1):
+    """
+    Pick k representative frames (sorted frame indices).
+    First the middle frame of each shot, longest shots first; then farthest-point
+    sampling on signature distance, with a small temporal term
+    (temporal_weight * normalized time gap) so that a fully static video falls
+    back to evenly spread frames instead of arbitrary duplicates.
+    """
+    n = len(frame_indices)
+    if n == 0:
+        return []
+    if k >= n:
+        return [int(i) for i in frame_indices]
+    if boundaries is None:
+        boundaries = detect_shot_boundaries(signatures)
+
+    shots = list(zip(boundaries, boundaries[1:] + [n]))
+    shots.sort(key=lambda shot: shot[0] - shot[1])  # longest first
+    chosen = [(start + end - 1) // 2 for start, end in shots[:k]]
+
+    # RMS signature distance is in [0,1], like the normalized time axis
+    times = (np.asarray(frame_indices, dtype=np.float32) - frame_indices[0]) / max(frame_indices[-1] - frame_indices[0], 1)
+    def distance_to(j):
+        sig_dist = np.sqrt(((signatures - signatures[j]) ** 2).mean(axis=1))
+        return sig_dist + temporal_weight * np.abs(times - times[j])
+
+    min_dist = np.full(n, np.inf, dtype=np.float32)
+    for j in chosen:
+        min_dist = np.minimum(min_dist, distance_to(j))
+    while len(chosen) < k:
+        j = int(np.argmax(min_dist))
+        chosen.append(j)
+        min_dist = np.minimum(min_dist, distance_to(j))
+    return sorted(int(frame_indices[j]) for j in chosen)
+
+
+def sample_diverse_frames(video_path, k, max_signatures=512):
+    """Signature pre-pass + shot detection + select_diverse_frames for one video."""
+    frame_indices, signatures = frame_signatures(video_path, max_signatures=max_signatures)
+    return select_diverse_frames(frame_indices, signatures, k)
+
+
+# ---------------------------
+# Reduced-resolution decode backends.
+#
+# Most consumers resize frames to 224x224 right after decoding, so converting
+# and copying full-resolution (e.g. 4K) BGR frames is wasted work.
+# read_frames_scaled returns already-downscaled frames from one of:
+#   "pyav"    PyAV (optional dependency) with threaded decoding; only the
+#             wanted frames are converted, straight to the target size, then
+#             copied into the ring (to_ndarray allocates one small array each).
+#             keyframes_only=True also sets skip_frame="NONKEY", so the
+#             decoder skips all non-key frames.
+#   "ffmpeg"  an ffmpeg subprocess (binary from FFMPEG_BINARY or PATH) running
+#             select + scale filters and writing fixed-size rawvideo to a pipe,
+#             read straight into the ring buffer. If ffmpeg fails (e.g. a
+#             binary older than 5.1, without -fps_mode), the call falls back
+#             to opencv.
+#   "opencv"  read_frames with each frame cv2.resize()d into the ring buffer
+#             as it is decoded.
+# Frames land in a preallocated FrameRing, and the returned arrays are views
+# into it, so no full-size frames are kept.
+# ---------------------------
+
+class FrameRing:
+    """
+    Preallocated uint8 buffer of `capacity` BGR frames of one size. slot(i)
+    returns a view of frame i % capacity. Views are overwritten when the ring
+    wraps around or is reused for the next video.
+    """
+    def __init__(self, capacity, width, height):
+        self.buffer = np.empty((capacity, height, width, 3), dtype=np.uint8)
+
+    @property
+    def capacity(self):
+        return self.buffer.shape[0]
+
+    def fits(self, capacity, width, height):
+        return self.capacity >= capacity and self.buffer.shape[1:3] == (height, width)
+
+    def slot(self, i):
+        return self.buffer[i % self.capacity]
+
+
+def _pyav_available():
+    try:
+        import av  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _ffmpeg_binary():
+    import shutil
+    return os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+
+def resolve_decode_backend(backend=None):
+    """
+    backend: "pyav", "ffmpeg", "opencv", or None/"auto" for FRAME_DECODE_BACKEND
+    (environment) or else the first available of pyav, ffmpeg, opencv.
+    """
+    if backend in (None, "auto"):
+        backend = os.environ.get("FRAME_DECODE_BACKEND", "auto")
+    if backend == "auto":
+        if _pyav_available():
+            return "pyav"
+        if _ffmpeg_binary():
+            return "ffmpeg"
+        return "opencv"
+    if backend not in ("pyav", "ffmpeg", "opencv"):
+        raise ValueError(f"Unknown decode backend {backend!r}")
+    return backend
+
+
+def _read_scaled_opencv(video_path, targets, size, ring):
+    # Each frame is resized into its ring slot as it is decoded, so only one
+    # full-resolution frame is alive at a time (read_frames decodes in order)
+    slots = iter(range(len(targets)))
+
+    def to_slot(frame):
+        slot = ring.slot(next(slots))
+        cv2.resize(frame, size, dst=slot, interpolation=cv2.INTER_AREA)
+        return slot
+
+    return read_frames(video_path, targets, transform=to_slot)
+
+
+def _read_scaled_ffmpeg(video_path, targets, size, ring):
+    import subprocess
+    binary = _ffmpeg_binary()
+    if not binary:
+        raise RuntimeError("ffmpeg backend requested but no ffmpeg binary was found (set FFMPEG_BINARY)")
+    width, height = size
+    select = "+".join(f"eq(n\\,{i})" for i in targets)
+    cmd = [binary, "-v", "error", "-nostdin"]
+    if os.environ.get("FFMPEG_HWACCEL"):
+        cmd += ["-hwaccel", os.environ["FFMPEG_HWACCEL"]]
+    cmd += ["-threads", "0", "-i", video_path, "-an", "-sn",
+            "-vf", f"select={select},scale={width}:{height}:flags=area",
+            "-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frames = {}
+    frame_bytes = width * height * 3
+    try:
+        # select emits the wanted frames in stream order; missing ones are past the end
+        for k, idx in enumerate(targets):
+            view = memoryview(ring.slot(k)).cast("B")
+            got = 0
+            while got < frame_bytes:
+                n = proc.stdout.readinto(view[got:])
+                if not n:
+                    break
+                got += n
+            if got < frame_bytes:
+                break
+            frames[idx] = ring.slot(k)
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0 and not frames:
+        raise RuntimeError(f"ffmpeg failed on {video_path!r}: {stderr.decode(errors='replace')[-500:]}")
+    return frames
+
+
+def _read_scaled_pyav(video_path, targets, size, ring, keyframes_only=False):
+    import av
+    width, height = size
+    frames = {}
+    slots = [0]
+
+    def store(frame):
+        # Convert straight to the target size, then copy into the next ring slot
+        image = frame.reformat(width=width, height=height, format="bgr24",
+                               interpolation="AREA").to_ndarray()
+        slot = ring.slot(slots[0])
+        slots[0] += 1
+        np.copyto(slot, image)
+        return slot
+
+    try:
+        container = av.open(video_path)
+    except Exception as e:
+        raise RuntimeError(f"Could not open video: {video_path!r}") from e
+    with container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        if not keyframes_only:
+            wanted = set(targets)
+            for n, frame in enumerate(container.decode(stream)):
+                if n in wanted:
+                    frames[n] = store(frame)
+                if n >= targets[-1]:
+                    break
+            return frames
+
+        # Only keyframes come out of the decoder; index them by timestamp and
+        # give each wanted frame the latest keyframe at or before it
+        stream.codec_context.skip_frame = "NONKEY"
+        rate = float(stream.average_rate or stream.guessed_rate or 0)
+        start = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+        pending = list(targets)
+        prev_frame, prev_slot = None, None
+        for frame in container.decode(stream):
+            idx = int(round((float(frame.pts * stream.time_base) - start) * rate))
+            while pending and pending[0] < idx and prev_frame is not None:
+                if prev_slot is None:
+                    prev_slot = store(prev_frame)
+                frames[pending.pop(0)] = prev_slot
+            if not pending:
+                break
+            prev_frame, prev_slot = frame, None
+        if pending and prev_frame is not None:
+            prev_slot = prev_slot if prev_slot is not None else store(prev_frame)
+            for idx in pending:
+                frames[idx] = prev_slot
+    return frames
+
+
+def read_frames_scaled(video_path, indices, size=(224, 224), backend=None, ring=None,
+                       keyframes_only=False):
+    """
+    Like read_frames, but every frame comes back already resized to
+    size=(width, height) and decoded by a faster backend when one is available
+    (see resolve_decode_backend).
+    ring: FrameRing to decode into; one of the right size is allocated if
+      missing or too small. Returned arrays are views into the ring.
+    keyframes_only: PyAV only; decode just keyframes and return, for each
+      index, the latest keyframe at or before it (much cheaper, approximate).
+    Returns {frame_idx: BGR ndarray [height, width, 3]}.
+    """
+    targets = sorted(set(int(i) for i in indices))
+    if not targets:
+        return {}
+    width, height = size
+    if ring is None or not ring.fits(len(targets), width, height):
+        ring = FrameRing(len(targets), width, height)
+    backend = resolve_decode_backend(backend)
+    if backend == "pyav":
+        return _read_scaled_pyav(video_path, targets, size, ring, keyframes_only=keyframes_only)
+    if backend == "ffmpeg":
+        try:
+            return _read_scaled_ffmpeg(video_path, targets, size, ring)
+        except (RuntimeError, OSError) as e:
+            print(f"ffmpeg decode failed, falling back to OpenCV: {e}")
+    return _read_scaled_opencv(video_path, targets, size, ring)
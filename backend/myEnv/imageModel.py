@@ -1,22 +1,16 @@
 import torch
 import torch.nn as nn
 from torchvision import models
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, IterableDataset
 from torchvision import transforms
 from PIL import Image
 import numpy as np
 import os
-import pickle
-from sklearn.metrics import accuracy_score
 import time
-import scipy.ndimage
-from skimage.feature import peak_local_max
-from scipy.spatial.distance import pdist
-from scipy.stats import kurtosis, skew, pearsonr
-import matplotlib.pyplot as plt
 from tqdm import tqdm
 import cv2
-from sklearn.model_selection import train_test_split
+from spectralOps import (angular_histogram, find_peaks, pairwise_distance_std,
+                         batched_kurtosis_skew, batched_pearson)
 def compute_fft(img):
     """
     Compute the log-magnitude spectrum of the grayscale image `img`.
@@ -159,45 +153,46 @@ def fft_entropy(log_mag, bins=128):
     entropy = -np.sum(hist * np.log(hist))
     return entropy
 
-def fft_peak_features(log_mag, threshold_ratio=0.6, min_distance=10):
+def fft_peak_features(log_mag, threshold_ratio=0.6, min_distance=10, max_peaks=None,
+                      max_regularity_points=None):
     """
     Detect peaks in normalized log-magnitude spectrum and compute:
     - peak_count: number of peaks
     - regularity: stddev of pairwise distances among peaks
+    max_peaks: optional cap on the number of peaks kept (highest first).
+    max_regularity_points: optional cap on the peaks used for regularity; above
+      it, regularity is estimated from a fixed random subset. Either way the
+      distances are streamed, never materialised as a full pdist matrix.
     """
     norm_fft = (log_mag - log_mag.min()) / (log_mag.max() - log_mag.min() + 1e-8)
-    peaks = peak_local_max(norm_fft, min_distance=min_distance, threshold_abs=threshold_ratio)
+    peaks = find_peaks(norm_fft, min_distance=min_distance, threshold=threshold_ratio, max_peaks=max_peaks)
     peak_count = len(peaks)
     if peak_count > 1:
-        dists = pdist(peaks)
-        regularity = np.std(dists)
+        regularity = pairwise_distance_std(peaks, max_points=max_regularity_points)
     else:
         regularity = 0.0
     return peak_count, regularity
 
-def fft_angular_variance(log_mag, n_bins=36):
+def fft_angular_variance(log_mag, n_bins=36, return_spectrum=False):
     """
     Compute angular energy variance: split 0-360 degrees into bins, sum energy in each,
-    return variance.
+    return variance. Bin indices come from the shared spectrum geometry, so this is a
+    single bincount pass over the spectrum.
+    return_spectrum: if True, returns (variance, angular_energy) where angular_energy
+      is the per-sector energy (see spectralOps.directional_spectrum for orientation means).
     """
-    h, w = log_mag.shape
-    center = (h // 2, w // 2)
-    y, x = np.indices((h, w))
-    angles = np.arctan2(y - center[0], x - center[1])
-    angles = (angles + np.pi) * (180 / np.pi)  # 0 to 360
-    bins = np.linspace(0, 360, n_bins + 1)
-    angular_energy = np.zeros(n_bins)
-    for i in range(n_bins):
-        mask = (angles >= bins[i]) & (angles < bins[i+1])
-        angular_energy[i] = np.sum(log_mag[mask])
+    _, angular_energy, _ = angular_histogram(log_mag, n_bins)
+    if return_spectrum:
+        return np.var(angular_energy), angular_energy
     return np.var(angular_energy)
 
 def fft_kurtosis_skew(log_mag):
     """
-    Compute kurtosis and skew of log-magnitude values.
+    Compute kurtosis and skew of log-magnitude values
+    (Fisher kurtosis, biased estimators, same as scipy.stats defaults).
     """
-    flat = log_mag.flatten()
-    return kurtosis(flat), skew(flat)
+    k, s = batched_kurtosis_skew(log_mag.reshape(1, -1))
+    return k[0], s[0]
 
 def fft_rgb_cross_spectral_corr(img_color):
     """
@@ -205,17 +200,13 @@ def fft_rgb_cross_spectral_corr(img_color):
     img_color: HxWx3 array.
     Returns correlation coefficients between pairs (R-G, R-B, G-B).
     """
-    # Compute FFT magnitude for each channel
+    # Compute FFT magnitude for each channel once
+    spectra = [compute_fft(img_color[..., c]).reshape(1, -1) for c in range(3)]
     corrs = []
     for i in range(3):
         for j in range(i+1, 3):
-            ft_i = compute_fft(img_color[..., i])
-            ft_j = compute_fft(img_color[..., j])
-            # Flatten and compute Pearson correlation
-            flat_i = ft_i.flatten()
-            flat_j = ft_j.flatten()
-            corr, _ = pearsonr(flat_i, flat_j)
-            corrs.append(corr)
+            # Pearson correlation of the flattened spectra
+            corrs.append(batched_pearson(spectra[i], spectra[j])[0])
     # Return as tuple (R-G, R-B, G-B)
     return tuple(corrs)
 
@@ -528,11 +519,15 @@ def train_validate_test(
     - max_training_time_hours: training time limit in hours (e.g., 1.5 for 1.5 hours)
     - model_save_path: file path to save the best model state_dict
     """
+    from sklearn.metrics import accuracy_score
+
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
 
     # DataLoaders with smaller batch size
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=2, pin_memory=True)
+    # Sharded datasets shuffle through their own buffer; DataLoader shuffle is only for map-style datasets
+    train_shuffle = not isinstance(train_dataset, IterableDataset)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=train_shuffle, num_workers=2, pin_memory=True)
     val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=2, pin_memory=True)
     test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=2, pin_memory=True)
 
@@ -556,6 +551,8 @@ def train_validate_test(
 
     for epoch in range(1, num_epochs + 1):
         epoch_start = time.time()
+        if hasattr(train_dataset, "set_epoch"):
+            train_dataset.set_epoch(epoch)
         model.train()
         train_losses = []
         all_preds = []
@@ -669,7 +666,8 @@ def train_validate_test(
     return model
 
 def main():
-    
+    from sklearn.model_selection import train_test_split
+
     # Use a more powerful backbone with better initialization
     vgg16 = models.vgg16(pretrained=True)
 
@@ -684,6 +682,24 @@ def main():
     feature_extractor = vgg16.features
     
     script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # Prefer the sharded corpus (built by shardDataset.py) when it exists
+    shard_dir = os.path.join(script_dir, "shards")
+    if os.path.exists(os.path.join(shard_dir, "train-index.json")):
+        from shardDataset import ShardedImageDataset
+        train_dataset = ShardedImageDataset(os.path.join(shard_dir, "train-index.json"), shuffle_buffer=1000)
+        val_dataset   = ShardedImageDataset(os.path.join(shard_dir, "val-index.json"), shuffle_buffer=0)
+        test_dataset  = ShardedImageDataset(os.path.join(shard_dir, "test-index.json"), shuffle_buffer=0)
+        print(f"Using shards from {shard_dir}")
+        print(f"Train set: {len(train_dataset)} images")
+        print(f"Validation set: {len(val_dataset)} images")
+        print(f"Test set: {len(test_dataset)} images")
+
+        model=ImageClassifier(feature_extractor, len(train_dataset.fft_feature_names))
+        print(f"Model parameters: {sum(p.numel() for p in model.parameters() if p.requires_grad):,}")
+        train_validate_test(model,train_dataset,val_dataset,test_dataset)
+        return
+
     realData=os.path.join(script_dir, r"AI-Generated-vs-Real-Images-Datasets\RealArt\RealArt")
     fakeData=os.path.join(script_dir, r"AI-Generated-vs-Real-Images-Datasets\AiArtData\AiArtData")
 
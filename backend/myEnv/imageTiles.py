@@ -0,0 +1,100 @@
+import math
+import os
+
+import numpy as np
+
+# ---------------------------
+# Tiled multi-crop scoring for high-resolution images.
+#
+# runModel normally squashes the whole image to 224x224, which throws away
+# the high-frequency detail both the FFT features and VGG16 look at. In tiled
+# mode it scores up to IMAGE_TILES crops of TILE_SIZE x TILE_SIZE pixels taken
+# at native resolution (no resizing), spread over the image on an even grid,
+# in one batch (runModel.score_tiles), and reduces their scores to one.
+#
+# The work per tile is fixed (one 224x224 spectrum set and one VGG16 pass), so
+# after decoding, the cost depends on the tile budget and not on the image
+# size. Images smaller than a tile on either side use the resize path.
+#
+# This module only needs numpy so web processes that hand inference to
+# inferenceWorkers.py can cut the tiles themselves.
+#
+# Environment:
+#   IMAGE_TILES         tile budget K; 0 (default) disables tiled mode
+#   IMAGE_TILE_REDUCER  how tile scores are combined, one of REDUCERS (default mean)
+# ---------------------------
+
+TILE_SIZE = 224  # the classifier input size: tiles go to VGG16 without resizing
+
+
+def _trimmed_mean(scores, trim=0.2):
+    scores = np.sort(scores)
+    cut = int(len(scores) * trim)
+    return float(np.mean(scores[cut:len(scores) - cut] if len(scores) > 2 * cut else scores))
+
+
+# Scores are real-probabilities on the 0-100 scale, so "min" flags an image
+# as AI if any tile looks generated (e.g. an inpainted region)
+REDUCERS = {
+    'mean': lambda scores: float(np.mean(scores)),
+    'median': lambda scores: float(np.median(scores)),
+    'min': lambda scores: float(np.min(scores)),
+    'max': lambda scores: float(np.max(scores)),
+    'trimmed_mean': _trimmed_mean,
+}
+
+
+def tile_budget():
+    """IMAGE_TILES, the number of tiles tiled mode scores (0 = off)."""
+    try:
+        return max(0, int(os.environ.get('IMAGE_TILES', 0)))
+    except ValueError:
+        return 0
+
+
+def default_reducer():
+    reducer = os.environ.get('IMAGE_TILE_REDUCER', 'mean')
+    return reducer if reducer in REDUCERS else 'mean'
+
+
+def reduce_scores(scores, reducer=None):
+    """Combine tile scores with REDUCERS[reducer] (IMAGE_TILE_REDUCER by default); rounded like runModel."""
+    if reducer is None:
+        reducer = default_reducer()
+    if reducer not in REDUCERS:
+        raise ValueError(f"Unknown tile reducer {reducer!r}; expected one of {', '.join(REDUCERS)}")
+    return round(REDUCERS[reducer](np.asarray(scores, dtype=np.float64)), 1)
+
+
+def fits_tiles(height, width, tile_size=TILE_SIZE):
+    return height >= tile_size and width >= tile_size
+
+
+def tile_origins(height, width, max_tiles, tile_size=TILE_SIZE):
+    """
+    Top-left (y, x) corners of at most max_tiles tiles on a rows x cols grid
+    matching the image's aspect ratio, evenly spaced from edge to edge. Tiles
+    only overlap when the budget exceeds what fits side by side, and no more
+    rows or columns are used than the image has room for.
+    """
+    if max_tiles <= 0 or not fits_tiles(height, width, tile_size):
+        return []
+    max_rows, max_cols = math.ceil(height / tile_size), math.ceil(width / tile_size)
+    rows = min(max_rows, max_tiles, max(1, round(math.sqrt(max_tiles * height / width))))
+    cols = min(max_cols, max(1, max_tiles // rows))
+    ys = np.linspace(0, height - tile_size, rows).round().astype(int)
+    xs = np.linspace(0, width - tile_size, cols).round().astype(int)
+    return [(int(y), int(x)) for y in ys for x in xs]
+
+
+def extract_tiles(img, max_tiles, tile_size=TILE_SIZE):
+    """
+    Native-resolution tiles of a decoded [H,W,C] image.
+    Returns (origins, tiles): tiles is a contiguous [K,tile_size,tile_size,C]
+    array (K=0 if the image is smaller than a tile).
+    """
+    origins = tile_origins(img.shape[0], img.shape[1], max_tiles, tile_size)
+    tiles = np.empty((len(origins), tile_size, tile_size) + img.shape[2:], dtype=img.dtype)
+    for k, (y, x) in enumerate(origins):
+        tiles[k] = img[y:y + tile_size, x:x + tile_size]
+    return origins, tiles
@@ -0,0 +1,470 @@
+import argparse
+import gc
+import itertools
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing import get_context, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import cv2
+import numpy as np
+
+from frameReader import count_frames
+from imageTiles import extract_tiles, reduce_scores, tile_budget
+
+# ---------------------------
+# Dedicated inference worker processes.
+#
+# Web processes (gunicorn workers running app.py) do not import torch or load
+# any model. They decode uploads themselves and hand the pixels to a pool of
+# inference worker processes that own the models:
+#
+#   python myEnv/inferenceWorkers.py --address /tmp/chatisthisreal-inference --workers 2
+#   INFERENCE_WORKERS_ADDRESS=/tmp/chatisthisreal-inference gunicorn app:app ...
+#
+# Worker i listens on the unix socket <address>.<i> (multiprocessing.connection,
+# so messages are small pickled dicts). That socket is only the control
+# channel: decoded frames travel through shared memory. Each web process
+# owns a SharedRing, a few fixed-size slots in one
+# multiprocessing.shared_memory segment; a request copies its frames into a
+# free slot and sends only (segment name, offset, shape). The worker maps the
+# segment once per connection and scores the frames in place. Requests larger
+# than a slot get a one-off segment of their own, which the worker unmaps as
+# soon as the op is done. Frames are never pickled or copied through a pipe.
+# In tiled mode (IMAGE_TILES, see imageTiles.py) images are cut into tiles
+# here and only the tiles are sent.
+#
+# Each worker process runs one analysis at a time (it serves several
+# connections, one thread each, behind a lock). A client picks the first idle
+# worker connection of its own and otherwise waits for the next one in
+# round-robin order; clients in different web processes do not coordinate.
+# Progress events (frame_scored, cnn, embedded) are sent over the connection
+# before the final result, and a client that stops listening (cancelled
+# upload) makes the worker drop the analysis at the next event.
+#
+# Both sides must run on the same host. The server restarts workers that exit.
+#
+# Environment (both sides):
+#   INFERENCE_WORKERS_AUTHKEY  shared secret for the connections; unset means no
+#                              authentication (the sockets are created mode 0600)
+#   INFERENCE_RING_SLOTS       slots per web process ring, default 4
+#   INFERENCE_SLOT_MB          slot size, default 64 (8 full-HD frames fit)
+# ---------------------------
+
+FRAME_DTYPE = np.uint8
+
+
+def worker_address(address, index):
+    return f"{address}.{index}"
+
+
+def _authkey():
+    key = os.environ.get('INFERENCE_WORKERS_AUTHKEY')
+    return key.encode() if key else None
+
+
+def _attach(name):
+    """Map an existing shared memory segment without taking ownership of it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Older versions register attached segments with the resource tracker,
+        # which would unlink them when this process exits; the web process owns them
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+# ---------------------------
+# Web process side
+# ---------------------------
+
+class SharedRing:
+    """`slots` fixed-size slots in one shared memory segment, handed out to concurrent requests."""
+
+    def __init__(self, slots, slot_bytes):
+        self.slot_bytes = slot_bytes
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free = list(range(slots))
+        self._available = threading.Condition()
+
+    def put(self, frames):
+        """
+        Copy same-shape uint8 frames into a free slot (or a one-off segment if
+        they do not fit one). Returns (reference for the worker, release()).
+        """
+        shape = (len(frames),) + frames[0].shape
+        nbytes = int(np.prod(shape))
+        if nbytes > self.slot_bytes:
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            offset, slot = 0, None
+        else:
+            with self._available:
+                while not self._free:
+                    self._available.wait()
+                slot = self._free.pop()
+            shm, offset = self._shm, slot * self.slot_bytes
+        view = np.ndarray(shape, dtype=FRAME_DTYPE, buffer=shm.buf, offset=offset)
+        for i, frame in enumerate(frames):
+            view[i] = frame
+        del view
+
+        def release():
+            if slot is None:
+                shm.close()
+                shm.unlink()
+            else:
+                with self._available:
+                    self._free.append(slot)
+                    self._available.notify()
+        # oneoff: the worker unmaps the segment after the op instead of keeping it for the connection
+        return {'shm': shm.name, 'offset': offset, 'shape': shape, 'oneoff': slot is None}, release
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+class InferenceClient:
+    """
+    Connections from one web process to the inference workers at `address`.
+    Thread-safe; the methods mirror runModel / score_frames / analyze_video so
+    app.py can use them in place of the local model functions.
+    """
+
+    def __init__(self, address, slots=None, slot_mb=None):
+        self.address = address
+        self._authkey = _authkey()
+        if slots is None:
+            slots = int(os.environ.get('INFERENCE_RING_SLOTS', 4))
+        if slot_mb is None:
+            slot_mb = int(os.environ.get('INFERENCE_SLOT_MB', 64))
+        self._slots, self._slot_bytes = slots, slot_mb * 1024 * 1024
+        self._ring = None
+        self._lock = threading.Lock()
+        self._info = None
+        self._connections = []
+        self._connection_locks = []
+        self._next = itertools.count()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._info is not None:
+                return
+            connection = Client(worker_address(self.address, 0), family='AF_UNIX', authkey=self._authkey)
+            connection.send({'op': 'info'})
+            info = connection.recv()
+            self._connections = [connection] + [None] * (info['workers'] - 1)
+            self._connection_locks = [threading.Lock() for _ in range(info['workers'])]
+            # Created on first use: the segment belongs to the process that serves requests
+            self._ring = SharedRing(self._slots, self._slot_bytes)
+            self._info = info
+
+    def info(self):
+        """{'workers', 'image_model', 'video_model', 'video_frames'} as reported by worker 0."""
+        self._ensure_started()
+        return dict(self._info)
+
+    def _checkout(self):
+        """(index, connection) of an idle worker, waiting for one if all are busy."""
+        count = len(self._connection_locks)
+        first = next(self._next) % count
+        order = [(first + k) % count for k in range(count)]
+        for index in order:
+            if self._connection_locks[index].acquire(blocking=False):
+                break
+        else:
+            index = first
+            self._connection_locks[index].acquire()
+        try:
+            if self._connections[index] is None:
+                self._connections[index] = Client(worker_address(self.address, index), family='AF_UNIX',
+                                                  authkey=self._authkey)
+        except Exception:
+            self._connection_locks[index].release()
+            raise
+        return index, self._connections[index]
+
+    def _drop(self, index):
+        connection, self._connections[index] = self._connections[index], None
+        if connection is not None:
+            connection.close()
+
+    def _call(self, message, frames=None, progress=None):
+        self._ensure_started()
+        release = None
+        if frames is not None:
+            message['frames'], release = self._ring.put(frames)
+        index, connection = self._checkout()
+        try:
+            try:
+                connection.send(message)
+                while True:
+                    reply = connection.recv()
+                    if 'event' not in reply:
+                        break
+                    if progress is not None:
+                        progress(reply['event'], reply['data'])
+            except (EOFError, OSError) as e:
+                self._drop(index)
+                raise RuntimeError(f"Inference worker {index} unavailable: {e}")
+            except BaseException:
+                # The reply stream is abandoned mid-way (e.g. AnalysisCancelled from progress);
+                # closing the connection also tells the worker to stop
+                self._drop(index)
+                raise
+        finally:
+            self._connection_locks[index].release()
+            if release is not None:
+                release()
+        if not reply['ok']:
+            raise RuntimeError(f"Inference worker {index}: {reply['error']}")
+        return reply['result']
+
+    def score_frames(self, frames_bgr, cascade=False):
+        """runModel.score_frames in a worker: scores (0-100) of same-size BGR frames."""
+        return self._call({'op': 'score', 'cascade': cascade}, frames=frames_bgr)
+
+    def run_model(self, imagePath, progress=None, tiles=None, reducer=None):
+        """runModel in a worker: the image is decoded (and tiled) here and scored there."""
+        start = time.perf_counter()
+        img = cv2.imread(imagePath, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Unable to read image: {imagePath}")
+        origins, tile_stack = extract_tiles(img, tile_budget() if tiles is None else tiles)
+        if progress is not None:
+            decoded = {"seconds": round(time.perf_counter() - start, 4)}
+            if origins:
+                decoded["tiles"] = len(origins)
+            progress("decoded", decoded)
+            start = time.perf_counter()
+        if not origins:
+            # The workers' CASCADE_MODEL applies, as in runModel
+            score = self.score_frames([img], cascade=True)[0]
+            if progress is not None:
+                progress("cnn", {"seconds": round(time.perf_counter() - start, 4), "score": score})
+            return score
+        del img  # only the tiles cross to the worker
+        tile_scores = self._call({'op': 'score_tiles'}, frames=tile_stack)
+        score = reduce_scores(tile_scores, reducer)
+        if progress is not None:
+            progress("cnn", {"seconds": round(time.perf_counter() - start, 4), "score": score,
+                             "tiles": [{"y": y, "x": x, "score": s} for (y, x), s in zip(origins, tile_scores)]})
+        return score
+
+    def analyze_video(self, video_path, budget_seconds=None, top_k=None, progress=None, decode_size=None):
+        """videoService.analyze_video with the frames decoded here; None if the workers have no video model."""
+        from frameReader import read_frames, read_frames_scaled
+        start = time.perf_counter()
+        plan = self._call({'op': 'plan_video', 'total_frames': count_frames(video_path),
+                           'budget_seconds': budget_seconds, 'decode_size': decode_size})
+        if plan is None:
+            return None
+        indices, decode_size = plan
+        decoded = (read_frames_scaled(video_path, indices, size=(decode_size, decode_size)) if decode_size > 0
+                   else read_frames(video_path, indices))
+        indices = [i for i in indices if i in decoded]
+        if not indices:
+            raise RuntimeError(f"Could not read any frames from {video_path}")
+        decode_seconds = time.perf_counter() - start
+        if progress is not None:
+            progress("decoded", {"frames": len(indices), "seconds": round(decode_seconds, 4)})
+        # Same host: the worker can hash the file itself for VIDEO_EMBEDDING_CACHE
+        return self._call({'op': 'analyze_frames', 'indices': indices, 'top_k': top_k,
+                           'decode_seconds': decode_seconds,
+                           'video_path': os.path.abspath(video_path) if decode_size == 0 else None},
+                          frames=[decoded[i] for i in indices], progress=progress)
+
+    def close(self):
+        with self._lock:
+            for index in range(len(self._connections)):
+                self._drop(index)
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+            self._info = None
+
+# ---------------------------
+# Inference worker side
+# ---------------------------
+
+class _ClientGone(Exception):
+    """The client closed its connection while an analysis was running."""
+
+
+def _frames_from(ref, segments):
+    if ref['shm'] not in segments:
+        segments[ref['shm']] = _attach(ref['shm'])
+    array = np.ndarray(tuple(ref['shape']), dtype=FRAME_DTYPE, buffer=segments[ref['shm']].buf,
+                       offset=ref['offset'])
+    return [array[i] for i in range(array.shape[0])]
+
+
+def _release_oneoff(message, segments):
+    """Unmap the one-off segment of a finished op (the ring segment stays mapped for the connection)."""
+    ref = message.get('frames')
+    if not ref or not ref.get('oneoff'):
+        return
+    shm = segments.pop(ref['shm'], None)
+    if shm is None:
+        return
+    try:
+        shm.close()
+    except BufferError:
+        # A frame view survived the op (e.g. in a reference cycle); collect it and retry
+        gc.collect()
+        try:
+            shm.close()
+        except BufferError:
+            print(f"Inference worker: could not unmap segment {ref['shm']}; frame views still referenced")
+
+
+def _serve_connection(connection, models, workers, inference_lock):
+    import runModel
+    import videoService
+    segments = {}  # segment name -> SharedMemory, mapped once per connection
+
+    def progress(event, data=None):
+        try:
+            connection.send({'event': event, 'data': data or {}})
+        except OSError:
+            raise _ClientGone()
+
+    try:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                return
+            op = message.get('op')
+            try:
+                if op == 'info':
+                    # Answered directly, not as {'ok', 'result'}: the client reads it before anything else
+                    connection.send({'workers': workers, 'image_model': models['image'] is not None,
+                                     'video_model': models['video'] is not None,
+                                     'video_frames': models['video'].frames_per_clip if models['video'] is not None else 0,
+                                     'pid': os.getpid()})
+                    continue
+                with inference_lock:
+                    if op == 'score':
+                        result = runModel.score_frames(_frames_from(message['frames'], segments),
+                                                       cascade=message.get('cascade', False))
+                    elif op == 'score_tiles':
+                        result = runModel.score_tiles(_frames_from(message['frames'], segments))
+                    elif op == 'plan_video':
+                        result = videoService.plan_video(message['total_frames'], message.get('budget_seconds'),
+                                                         message.get('decode_size'))
+                    elif op == 'analyze_frames':
+                        result = videoService.analyze_frames(_frames_from(message['frames'], segments),
+                                                             message['indices'], top_k=message.get('top_k'),
+                                                             progress=progress,
+                                                             decode_seconds=message.get('decode_seconds', 0.0),
+                                                             video_path=message.get('video_path'))
+                    else:
+                        raise ValueError(f"Unknown op {op!r}")
+                reply = {'ok': True, 'result': result}
+            except _ClientGone:
+                return
+            except Exception as e:
+                reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            # Before replying: the client unlinks one-off segments as soon as it has the reply
+            _release_oneoff(message, segments)
+            try:
+                connection.send(reply)
+            except OSError:
+                return
+    finally:
+        connection.close()
+        for shm in segments.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass  # a frame view is still referenced; the mapping goes with the thread
+
+
+def _exit_with_parent(parent_pid):
+    # A supervisor killed without the chance to stop its workers would leave them serving
+    while os.getppid() == parent_pid:
+        time.sleep(2)
+    os._exit(0)
+
+
+def _worker_main(address, index, workers, threads):
+    threading.Thread(target=_exit_with_parent, args=(os.getppid(),), daemon=True).start()
+    import torch
+    torch.set_num_threads(threads)
+    import runModel
+    import videoService
+    device = torch.device("cpu")
+    models = {'image': runModel.load_image_classifier(device), 'video': videoService.load_video_model(device)}
+    path = worker_address(address, index)
+    if os.path.exists(path):
+        os.remove(path)
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(path, family='AF_UNIX', authkey=_authkey())
+    finally:
+        os.umask(old_umask)
+    print(f"Inference worker {index} (pid {os.getpid()}) listening on {path}; "
+          f"image model: {models['image'] is not None}, video model: {models['video'] is not None}")
+    inference_lock = threading.Lock()
+    while True:
+        try:
+            connection = listener.accept()
+        except Exception as e:
+            # Failed handshake (wrong authkey) or a client that went away mid-accept
+            print(f"Inference worker {index}: rejected a connection: {e}")
+            continue
+        threading.Thread(target=_serve_connection, args=(connection, models, workers, inference_lock),
+                         daemon=True).start()
+
+
+def serve(address, workers, threads=1):
+    """Start `workers` inference worker processes and restart any that exit; runs until SIGTERM/SIGINT."""
+    context = get_context('spawn')  # fresh interpreters: nothing inherited from this process
+    processes = {}
+
+    def start(index):
+        process = context.Process(target=_worker_main, args=(address, index, workers, threads),
+                                  name=f'inference-worker-{index}', daemon=True)
+        process.start()
+        processes[index] = process
+
+    def stop(signum, frame):
+        for process in processes.values():
+            process.terminate()
+        for index in processes:
+            path = worker_address(address, index)
+            if os.path.exists(path):
+                os.remove(path)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        start(index)
+    while True:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive():
+                print(f"Inference worker {index} exited with {process.exitcode}; restarting")
+                start(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the inference worker pool for app.py "
+                                                 "(INFERENCE_WORKERS_ADDRESS on the web side).")
+    parser.add_argument('--address', default=os.environ.get('INFERENCE_WORKERS_ADDRESS',
+                                                            '/tmp/chatisthisreal-inference'),
+                        help='socket path prefix; worker i listens on <address>.<i>')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('INFERENCE_WORKER_PROCESSES', 1)))
+    parser.add_argument('--threads', type=int, default=1, help='torch threads per worker')
+    args = parser.parse_args()
+    serve(args.address, args.workers, args.threads)
+
+
+if __name__ == '__main__':
+    main()
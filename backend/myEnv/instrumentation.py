@@ -0,0 +1,167 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# ---------------------------
+# Per-stage latency instrumentation.
+#
+#   with span("vgg_forward"):
+#       ...
+#
+# Every span is recorded in the analysis_stage_seconds histogram (label
+# stage=<name>), which app.py/asgi.py expose in Prometheus text format on
+# /metrics. When a request runs inside `with trace() as t:`, its spans are also
+# collected on t, and t.breakdown() lists them in start order with nesting
+# depth (returned in the JSON response with ?debug=1).
+#
+# The current trace and nesting depth live in context variables, so
+# concurrent requests on different threads never see each other's spans. New
+# threads do not inherit them; start worker threads with
+# contextvars.copy_context().run to keep spans on the caller's trace.
+#
+# Metrics are per process: with several gunicorn workers each worker serves
+# its own counts.
+# ---------------------------
+
+# Seconds; analysis stages range from sub-millisecond features to minute-long videos
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Prometheus-style histogram. label_names: label keys passed to observe().
+        buckets: sorted upper bounds in seconds (+Inf is implicit).
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """{label values: (cumulative bucket counts, sum, count)}"""
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self._series.items()]
+        snapshot = {}
+        for key, counts, total, n in items:
+            cumulative, running = [], 0
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            snapshot[key] = (cumulative, total, n)
+        return snapshot
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (cumulative, total, n) in sorted(self.snapshot().items()):
+            for bound, c in zip(self.buckets, cumulative):
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', repr(bound)))} {c}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', '+Inf'))} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return '\n'.join(lines)
+
+
+STAGE_SECONDS = Histogram('analysis_stage_seconds', 'Time spent in each analysis stage.', ('stage',))
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Request latency by endpoint and status.',
+                            ('endpoint', 'method', 'status'))
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Trace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._spans = []  # (name, start offset, seconds, depth)
+        self._lock = threading.Lock()
+
+    def add(self, name, start, seconds, depth):
+        with self._lock:
+            self._spans.append((name, start - self.start, seconds, depth))
+
+    def breakdown(self):
+        """[{"stage", "start", "seconds", "depth"}] in start order; start is relative to the trace."""
+        with self._lock:
+            spans = sorted(self._spans, key=lambda s: (s[1], s[3]))
+        return [{'stage': name, 'start': round(offset, 4), 'seconds': round(seconds, 4), 'depth': depth}
+                for name, offset, seconds, depth in spans]
+
+    def summary(self, max_depth=0):
+        """One-line "stage=1.234s ..." of the spans up to max_depth, for request logs."""
+        return ' '.join(f"{s['stage']}={s['seconds']:.3f}s" for s in self.breakdown()
+                        if s['depth'] <= max_depth) or '(no spans)'
+
+
+_current_trace = contextvars.ContextVar('instrumentation_trace', default=None)
+_span_depth = contextvars.ContextVar('instrumentation_span_depth', default=0)
+
+
+@contextmanager
+def trace():
+    """Collect the spans of everything run inside the block (and threads started with its context)."""
+    t = Trace()
+    token = _current_trace.set(t)
+    try:
+        yield t
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Time the block as stage `name`."""
+    depth = _span_depth.get()
+    token = _span_depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _span_depth.reset(token)
+        STAGE_SECONDS.observe(seconds, stage=name)
+        current = _current_trace.get()
+        if current is not None:
+            current.add(name, start, seconds, depth)
+
+
+def observe_request(endpoint, method, status, seconds):
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint, method=method, status=status)
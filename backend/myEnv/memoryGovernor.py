@@ -0,0 +1,290 @@
+import math
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+# ---------------------------
+# Memory governor for /upload.
+#
+# Before a file is decoded, its peak memory is estimated from the header alone
+# (image dimensions; video resolution and frame count) and compared with what
+# is left of the RSS budget:
+#
+#   admit      the estimate fits under MEMORY_BUDGET_MB as is
+#   downscale  it fits once the image is resized to max_side (the upload is
+#              rewritten smaller) or video frames are decoded at
+#              max_side x max_side (videoService / sigmaMethod decode_size)
+#   reject     it does not fit even at MEMORY_MIN_SIDE: status 503 while other
+#              analyses hold the memory, 413 if it would not fit in an idle process
+#
+# "Left of the budget" is budget - current RSS - the estimates of analyses
+# still running in this process. Their allocations are partly in the RSS
+# already, so this double counts on purpose and errs on the side of rejecting.
+# Before downscaling or rejecting, the governor drops the FFT geometry cache
+# (spectralOps.spectrum_geometry keeps grids for up to 16 image sizes, tens of
+# bytes per pixel each) and measures again.
+#
+# The estimates are linear in the number of pixels analyzed at full
+# resolution (in tiled mode: one decode plus a fixed cost per tile); the
+# constants below were measured as peak RSS increase (VmHWM) of runModel and
+# score_frames on CPU: the FFT features dominate (complex128 spectra,
+# per-channel spectra for the colour correlations, radial grids).
+#
+# Environment:
+#   MEMORY_BUDGET_MB   RSS budget per process; 0 (default) only reports RSS in
+#                      /health and admits everything. It must leave room for
+#                      the loaded models: set it to the instance memory minus
+#                      headroom, divided by the number of workers.
+#   MEMORY_MIN_SIDE    smallest max side the governor will downscale to,
+#                      default 224 (the classifier input size)
+# ---------------------------
+
+IMAGE_FIXED_MB = 20           # classifier activations and tensors of one image
+IMAGE_BYTES_PER_PIXEL = 110   # two decodes (PIL, cv2) + spectra of one image
+BATCH_BYTES_PER_PIXEL = 170   # per frame of a score_frames batch (batched spectra)
+FRAME_BYTES_PER_PIXEL = 3     # a decoded BGR frame kept for the whole analysis
+VIDEO_FIXED_MB = 60           # ViT frame encoder and classifier batch activations
+TILE_MB = 22                  # per tile in tiled mode (spectra and VGG16 activations of a 224x224 crop)
+SCORE_BATCH = 4               # score_frames / analyze_video classifier batch size
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """The file cannot be analyzed within the memory budget; carries the HTTP status to answer with."""
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+
+def _proc_status_mb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (None where /proc is unavailable)."""
+    return _proc_status_mb('VmRSS')
+
+
+def peak_rss_mb():
+    """Highest RSS this process has reached, in MB."""
+    peak = _proc_status_mb('VmHWM')
+    if peak is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+        except (ImportError, OSError):
+            return None
+    return peak
+
+
+def probe_media(path, is_video):
+    """(width, height, frame_count) from the file header, without decoding pixels."""
+    # Imported here so that app.py can import this module (for /health) before the ML stack
+    import cv2
+    from PIL import Image
+    if not is_video:
+        with Image.open(path) as img:
+            width, height = img.size
+        return width, height, 1
+    cap = cv2.VideoCapture(path)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+    return width, height, max(frames, 1)
+
+
+def reclaim_caches():
+    """Drop caches that keep memory between requests; True if anything was dropped."""
+    spectral = sys.modules.get('spectralOps')
+    if spectral is None or not spectral.spectrum_geometry.cache_info().currsize:
+        return False
+    spectral.spectrum_geometry.cache_clear()
+    return True
+
+
+def estimate_image_mb(pixels, tiles=0):
+    """tiles > 0: tiled mode (imageTiles.py), one decode plus a fixed cost per tile."""
+    if tiles > 0:
+        return IMAGE_FIXED_MB + pixels * FRAME_BYTES_PER_PIXEL / MB + tiles * TILE_MB
+    return IMAGE_FIXED_MB + pixels * IMAGE_BYTES_PER_PIXEL / MB
+
+
+def estimate_video_mb(pixels, frames):
+    """Peak of analyzing `frames` frames of `pixels` each (all kept, scored SCORE_BATCH at a time)."""
+    per_pixel = frames * FRAME_BYTES_PER_PIXEL + min(frames, SCORE_BATCH) * BATCH_BYTES_PER_PIXEL
+    return VIDEO_FIXED_MB + pixels * per_pixel / MB
+
+
+def downscale_image(path, max_side):
+    """Rewrite the image at path so that its longer side is max_side (aspect ratio kept)."""
+    import cv2
+    from PIL import Image
+    with Image.open(path) as img:
+        width, height = img.size
+    scale = max_side / max(width, height)
+    # Let the JPEG decoder skip detail we are about to throw away (1/2, 1/4, 1/8 scale decode)
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                            (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if scale * factor <= 1:
+            flag = reduced
+            break
+    img = cv2.imread(path, flag)
+    if img is None:
+        raise ValueError(f"Unable to read image: {path}")
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    if not cv2.imwrite(path, img):
+        raise ValueError(f"Unable to write downscaled image: {path}")
+
+
+class Admission:
+    """Outcome of MemoryGovernor.reserve: decision ('admit' or 'downscale'), estimate_mb and max_side."""
+    def __init__(self, decision, estimate_mb, max_side=None):
+        self.decision = decision
+        self.estimate_mb = estimate_mb
+        self.max_side = max_side
+
+    def as_dict(self):
+        return {'decision': self.decision, 'estimate_mb': round(self.estimate_mb, 1), 'max_side': self.max_side}
+
+
+class MemoryGovernor:
+    def __init__(self, budget_mb=None, min_side=None):
+        """budget_mb / min_side default to MEMORY_BUDGET_MB / MEMORY_MIN_SIDE; budget 0 disables admission control."""
+        if budget_mb is None:
+            budget_mb = float(os.environ.get('MEMORY_BUDGET_MB', 0))
+        if min_side is None:
+            min_side = int(os.environ.get('MEMORY_MIN_SIDE', 224))
+        self.budget_mb = budget_mb
+        self.min_side = min_side
+        self._lock = threading.Lock()
+        self._reserved_mb = 0.0
+        self._in_flight = 0
+        self._counts = {'admit': 0, 'downscale': 0, 'reject': 0}
+
+    def _estimator(self, path, is_video, max_frames, extra_mb):
+        """(width, height, estimate) for the file at path; estimate(pixels) gives the peak MB at that size."""
+        width, height, frame_count = probe_media(path, is_video)
+        frames = min(max_frames, frame_count)
+        if is_video:
+            def estimate(pixels):
+                return estimate_video_mb(pixels, frames) + extra_mb
+        else:
+            from imageTiles import tile_budget, tile_origins
+            tiles = len(tile_origins(height, width, tile_budget()))
+
+            def estimate(pixels):
+                return estimate_image_mb(pixels, tiles) + extra_mb
+        return width, height, estimate
+
+    def _decide(self, width, height, is_video, estimate):
+        """The admission decision against the current RSS and reservations; call with self._lock held."""
+        native = estimate(width * height)
+        if self.budget_mb <= 0:
+            return Admission('admit', native)
+
+        reserved = self._reserved_mb
+        rss = current_rss_mb() or 0.0
+        available = self.budget_mb - rss - reserved
+        idle_available = self.budget_mb - rss + reserved
+        if native > available and reclaim_caches():
+            rss = current_rss_mb() or 0.0
+            available = self.budget_mb - rss - reserved
+            idle_available = self.budget_mb - rss + reserved
+        if native <= available:
+            return Admission('admit', native)
+
+        # Largest max side that fits. Videos are decoded square (decode_size x decode_size)
+        fixed = estimate(0)
+        per_pixel_mb = estimate(1) - fixed
+        fit_pixels = (available - fixed) / per_pixel_mb if available > fixed else 0
+        if is_video:
+            max_side = int(math.sqrt(fit_pixels))
+            pixels_at = lambda side: side * side  # noqa: E731
+        else:
+            aspect = min(width, height) / max(width, height)
+            max_side = int(math.sqrt(fit_pixels / aspect))
+            pixels_at = lambda side: side * side * aspect  # noqa: E731
+        if max_side >= self.min_side:
+            return Admission('downscale', estimate(pixels_at(max_side)), max_side)
+
+        smallest = estimate(pixels_at(self.min_side))
+        self._counts['reject'] += 1
+        kind = 'video' if is_video else 'image'
+        if smallest > idle_available:
+            raise MemoryBudgetExceeded(
+                f"File too large to analyze: a {width}x{height} {kind} needs about {smallest:.0f} MB "
+                f"even downscaled, and only {max(idle_available, 0):.0f} MB of the {self.budget_mb:.0f} MB "
+                f"memory budget is free", 413)
+        raise MemoryBudgetExceeded(
+            f"Server is low on memory ({rss:.0f} MB in use, {reserved:.0f} MB reserved by running "
+            f"analyses); try again shortly", 503)
+
+    def plan(self, path, is_video, max_frames=8, extra_mb=0.0):
+        """
+        Admission for analyzing the file at path, without reserving anything.
+        max_frames: frames a video analysis keeps decoded at once. extra_mb:
+        one-off cost on top of the estimate (e.g. a model that is loaded on
+        first use).
+        Returns an Admission; raises MemoryBudgetExceeded when even
+        MEMORY_MIN_SIDE does not fit.
+        """
+        width, height, estimate = self._estimator(path, is_video, max_frames, extra_mb)
+        with self._lock:
+            return self._decide(width, height, is_video, estimate)
+
+    def reserve(self, path, is_video, max_frames=8, extra_mb=0.0):
+        """
+        Like plan(), then hold the estimate as reserved memory until
+        release(admission). The decision and the reservation are made under
+        one lock, so concurrent requests cannot both claim the same free memory.
+        """
+        width, height, estimate = self._estimator(path, is_video, max_frames, extra_mb)
+        with self._lock:
+            admission = self._decide(width, height, is_video, estimate)
+            self._reserved_mb += admission.estimate_mb
+            self._in_flight += 1
+            self._counts[admission.decision] += 1
+        return admission
+
+    def release(self, admission):
+        if admission is None:
+            return
+        with self._lock:
+            self._reserved_mb -= admission.estimate_mb
+            self._in_flight -= 1
+
+    @contextmanager
+    def admit(self, path, is_video, max_frames=8, extra_mb=0.0):
+        """reserve() for the duration of the block."""
+        admission = self.reserve(path, is_video, max_frames=max_frames, extra_mb=extra_mb)
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    def stats(self):
+        """Current and peak RSS plus the governor's state, for /health."""
+        rss, peak = current_rss_mb(), peak_rss_mb()
+        with self._lock:
+            return {
+                'rss_mb': None if rss is None else round(rss, 1),
+                'peak_rss_mb': None if peak is None else round(peak, 1),
+                'budget_mb': self.budget_mb or None,
+                'reserved_mb': round(self._reserved_mb, 1),
+                'in_flight': self._in_flight,
+                'decisions': dict(self._counts),
+            }
@@ -4,11 +4,17 @@ from torchvision import transforms
 import cv2
 from torchvision import models
 import numpy as np
-from skimage.feature import peak_local_max
-from scipy.spatial.distance import pdist
-from scipy.stats import kurtosis, skew, pearsonr
 import torch.nn as nn
 import os
+import time
+import threading
+from instrumentation import span
+from imageTiles import TILE_SIZE, tile_budget, extract_tiles, reduce_scores
+from fftCascade import load_cascade
+from spectralOps import (FFT_FEATURE_NAMES, spectrum_geometry, angular_histogram, find_peaks,
+                         pairwise_distance_std, batched_radial_profile,
+                         batched_linear_fit, batched_histogram_density,
+                         batched_kurtosis_skew, batched_pearson)
 
 def compute_fft(img):
     """
@@ -152,45 +158,46 @@ def fft_entropy(log_mag, bins=128):
     entropy = -np.sum(hist * np.log(hist))
     return entropy
 
-def fft_peak_features(log_mag, threshold_ratio=0.6, min_distance=10):
+def fft_peak_features(log_mag, threshold_ratio=0.6, min_distance=10, max_peaks=None,
+                      max_regularity_points=None):
     """
     Detect peaks in normalized log-magnitude spectrum and compute:
     - peak_count: number of peaks
     - regularity: stddev of pairwise distances among peaks
+    max_peaks: optional cap on the number of peaks kept (highest first).
+    max_regularity_points: optional cap on the peaks used for regularity; above
+      it, regularity is estimated from a fixed random subset. Either way the
+      distances are streamed, never materialised as a full pdist matrix.
     """
     norm_fft = (log_mag - log_mag.min()) / (log_mag.max() - log_mag.min() + 1e-8)
-    peaks = peak_local_max(norm_fft, min_distance=min_distance, threshold_abs=threshold_ratio)
+    peaks = find_peaks(norm_fft, min_distance=min_distance, threshold=threshold_ratio, max_peaks=max_peaks)
     peak_count = len(peaks)
     if peak_count > 1:
-        dists = pdist(peaks)
-        regularity = np.std(dists)
+        regularity = pairwise_distance_std(peaks, max_points=max_regularity_points)
     else:
         regularity = 0.0
     return peak_count, regularity
 
-def fft_angular_variance(log_mag, n_bins=36):
+def fft_angular_variance(log_mag, n_bins=36, return_spectrum=False):
     """
     Compute angular energy variance: split 0-360 degrees into bins, sum energy in each,
-    return variance.
+    return variance. Bin indices come from the shared spectrum geometry, so this is a
+    single bincount pass over the spectrum.
+    return_spectrum: if True, returns (variance, angular_energy) where angular_energy
+      is the per-sector energy (see spectralOps.directional_spectrum for orientation means).
     """
-    h, w = log_mag.shape
-    center = (h // 2, w // 2)
-    y, x = np.indices((h, w))
-    angles = np.arctan2(y - center[0], x - center[1])
-    angles = (angles + np.pi) * (180 / np.pi)  # 0 to 360
-    bins = np.linspace(0, 360, n_bins + 1)
-    angular_energy = np.zeros(n_bins)
-    for i in range(n_bins):
-        mask = (angles >= bins[i]) & (angles < bins[i+1])
-        angular_energy[i] = np.sum(log_mag[mask])
+    _, angular_energy, _ = angular_histogram(log_mag, n_bins)
+    if return_spectrum:
+        return np.var(angular_energy), angular_energy
     return np.var(angular_energy)
 
 def fft_kurtosis_skew(log_mag):
     """
-    Compute kurtosis and skew of log-magnitude values.
+    Compute kurtosis and skew of log-magnitude values
+    (Fisher kurtosis, biased estimators, same as scipy.stats defaults).
     """
-    flat = log_mag.flatten()
-    return kurtosis(flat), skew(flat)
+    k, s = batched_kurtosis_skew(log_mag.reshape(1, -1))
+    return k[0], s[0]
 
 def fft_rgb_cross_spectral_corr(img_color):
     """
@@ -198,17 +205,13 @@ def fft_rgb_cross_spectral_corr(img_color):
     img_color: HxWx3 array.
     Returns correlation coefficients between pairs (R-G, R-B, G-B).
     """
-    # Compute FFT magnitude for each channel
+    # Compute FFT magnitude for each channel once
+    spectra = [compute_fft(img_color[..., c]).reshape(1, -1) for c in range(3)]
     corrs = []
     for i in range(3):
         for j in range(i+1, 3):
-            ft_i = compute_fft(img_color[..., i])
-            ft_j = compute_fft(img_color[..., j])
-            # Flatten and compute Pearson correlation
-            flat_i = ft_i.flatten()
-            flat_j = ft_j.flatten()
-            corr, _ = pearsonr(flat_i, flat_j)
-            corrs.append(corr)
+            # Pearson correlation of the flattened spectra
+            corrs.append(batched_pearson(spectra[i], spectra[j])[0])
     # Return as tuple (R-G, R-B, G-B)
     return tuple(corrs)
 
@@ -219,7 +222,8 @@ def extract_fft_features(image_path):
     Returns a dict of feature_name: value.
     """
     # Read with cv2 to ensure consistent handling; supports many formats
-    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    with span("fft.decode"):
+        img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
     if img is None:
         raise ValueError(f"Unable to read image: {image_path}")
     # If image has alpha channel, drop it
@@ -228,55 +232,175 @@ def extract_fft_features(image_path):
         
     
         
-    # Convert to float grayscale for FFT
-    if img.ndim == 3:
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
-    else:
-        gray = img.astype(np.float32)
-    # Normalize grayscale to [0,1]
-    gray = gray - gray.min()
-    if gray.max() > 0:
-        gray = gray / gray.max()
-    log_mag = compute_fft(gray)
+    with span("fft.spectrum"):
+        # Convert to float grayscale for FFT
+        if img.ndim == 3:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        else:
+            gray = img.astype(np.float32)
+        # Normalize grayscale to [0,1]
+        gray = gray - gray.min()
+        if gray.max() > 0:
+            gray = gray / gray.max()
+        log_mag = compute_fft(gray)
     features = {}
     # Central cross
-    v_line, h_line = fft_line_energy(log_mag)
+    with span("fft.line_energy"):
+        v_line, h_line = fft_line_energy(log_mag)
     features['fft_vertical_line_ratio'] = v_line
     features['fft_horizontal_line_ratio'] = h_line
-    features['fft_central_cross_ratio'] = fft_central_cross_ratio(log_mag)
+    with span("fft.central_cross_ratio"):
+        features['fft_central_cross_ratio'] = fft_central_cross_ratio(log_mag)
     # Radial features
-    features['fft_radial_slope'] = fft_radial_slope(log_mag)
-    features['fft_high_low_freq_ratio'] = fft_high_low_freq_ratio(log_mag)
-    features['fft_mid_band_gap'] = fft_mid_band_gap(log_mag)
+    with span("fft.radial_slope"):
+        features['fft_radial_slope'] = fft_radial_slope(log_mag)
+    with span("fft.high_low_freq_ratio"):
+        features['fft_high_low_freq_ratio'] = fft_high_low_freq_ratio(log_mag)
+    with span("fft.mid_band_gap"):
+        features['fft_mid_band_gap'] = fft_mid_band_gap(log_mag)
     # Spectral entropy
-    features['fft_entropy'] = fft_entropy(log_mag)
+    with span("fft.entropy"):
+        features['fft_entropy'] = fft_entropy(log_mag)
     # Peak features
-    peak_count, peak_reg = fft_peak_features(log_mag)
+    with span("fft.peak_features"):
+        peak_count, peak_reg = fft_peak_features(log_mag)
     features['fft_peak_count'] = peak_count
     features['fft_peak_regularity'] = peak_reg
     # Angular
-    features['fft_angular_variance'] = fft_angular_variance(log_mag)
+    with span("fft.angular_variance"):
+        features['fft_angular_variance'] = fft_angular_variance(log_mag)
     # Kurtosis & skew
-    k, s = fft_kurtosis_skew(log_mag)
+    with span("fft.kurtosis_skew"):
+        k, s = fft_kurtosis_skew(log_mag)
     features['fft_kurtosis'] = k
     features['fft_skew'] = s
     # Cross-spectral correlations (if color)
     if img.ndim == 3 and img.shape[2] == 3:
-        # Convert BGR (cv2) to RGB order
-        img_rgb = img[..., ::-1].astype(np.float32)
-        # Normalize each channel to [0,1]
-        for c in range(3):
-            ch = img_rgb[..., c]
-            ch = ch - ch.min()
-            if ch.max() > 0:
-                img_rgb[..., c] = ch / ch.max()
-        corr_rg, corr_rb, corr_gb = fft_rgb_cross_spectral_corr(img_rgb)
+        with span("fft.rgb_cross_spectral_corr"):
+            # Convert BGR (cv2) to RGB order
+            img_rgb = img[..., ::-1].astype(np.float32)
+            # Normalize each channel to [0,1]
+            for c in range(3):
+                ch = img_rgb[..., c]
+                ch = ch - ch.min()
+                if ch.max() > 0:
+                    img_rgb[..., c] = ch / ch.max()
+            corr_rg, corr_rb, corr_gb = fft_rgb_cross_spectral_corr(img_rgb)
         features['fft_corr_rg'] = corr_rg
         features['fft_corr_rb'] = corr_rb
         features['fft_corr_gb'] = corr_gb
     return features
 
+def compute_fft_batch(imgs):
+    """
+    Batched compute_fft: log-magnitude spectrum over the last two axes of
+    `imgs` ([N,H,W] or [N,C,H,W]).
+    """
+    fft = np.fft.fft2(imgs, axes=(-2, -1))
+    fft_shift = np.fft.fftshift(fft, axes=(-2, -1))
+    return np.log1p(np.abs(fft_shift))
+
+def _normalize_batch(imgs):
+    """Min-max normalize each image (over its last two axes) to [0,1] in place."""
+    lo = imgs.min(axis=(-2, -1), keepdims=True)
+    imgs -= lo
+    hi = imgs.max(axis=(-2, -1), keepdims=True)
+    np.divide(imgs, hi, out=imgs, where=hi > 0)
+    return imgs
+
+def extract_fft_features_batch(images, fit_range=(0.05, 0.5), mid_range=(0.15, 0.35),
+                               nbins=200, n_angular_bins=36):
+    """
+    Compute the same 15 FFT features as extract_fft_features for a stack of
+    same-size images in one vectorized pass.
+    images: [N,H,W] grayscale or [N,H,W,3] (BGR, as returned by cv2; a 4th
+      alpha channel is dropped). uint8 or float.
+    Returns an [N,15] float32 matrix of raw features in FFT_FEATURE_NAMES order
+    (no NaN cleanup or log1p, same as the dict extract_fft_features returns).
+    Grayscale input has no colour channels, so the three fft_corr_* columns are NaN.
+    """
+    images = np.asarray(images)
+    if images.ndim == 4 and images.shape[3] == 4:
+        images = images[..., :3]
+    if images.ndim not in (3, 4):
+        raise ValueError(f"Expected [N,H,W] or [N,H,W,3] images, got shape {images.shape}")
+    n, h, w = images.shape[:3]
+    is_color = images.ndim == 4
+    if images.dtype not in (np.uint8, np.uint16, np.float32):
+        images = images.astype(np.float32)
+
+    # Grayscale conversion in one cv2 call over the stacked rows
+    with span("fft_batch.spectrum"):
+        if is_color:
+            gray = cv2.cvtColor(np.ascontiguousarray(images).reshape(n * h, w, 3),
+                                cv2.COLOR_BGR2GRAY).reshape(n, h, w).astype(np.float32)
+        else:
+            gray = images.astype(np.float32)
+        log_mag = compute_fft_batch(_normalize_batch(gray))  # [N,H,W]
+    flat = log_mag.reshape(n, -1)
+    geom = spectrum_geometry(h, w)
+    features = np.full((n, len(FFT_FEATURE_NAMES)), np.nan, dtype=np.float64)
+
+    # Central cross
+    with span("fft_batch.line_energy"):
+        total_energy = flat.sum(axis=1) + 1e-8
+        vertical_energy = log_mag[:, :, w // 2].sum(axis=1)
+        horizontal_energy = log_mag[:, h // 2, :].sum(axis=1)
+        features[:, 0] = vertical_energy / total_energy
+        features[:, 1] = horizontal_energy / total_energy
+        features[:, 2] = (vertical_energy + horizontal_energy - log_mag[:, h // 2, w // 2]) / total_energy
+
+    # Radial slope and mid-band gap share one profile and one fit
+    with span("fft_batch.radial_slope_mid_band_gap"):
+        bin_centers, profile = batched_radial_profile(log_mag, nbins=nbins)
+        norm_r = bin_centers / (np.max(bin_centers) + 1e-8)
+        in_fit = (norm_r >= fit_range[0]) & (norm_r <= fit_range[1])
+        mask_fit = in_fit[None, :] & (profile > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_r = np.where(in_fit, np.log(np.where(in_fit, norm_r, 1.0)), 0.0)
+            log_p = np.log(np.where(mask_fit, profile, 1.0))
+        alpha, intercept = batched_linear_fit(log_r, log_p, mask_fit)
+        features[:, 3] = alpha
+        mask_mid = (norm_r >= mid_range[0]) & (norm_r <= mid_range[1])
+        if np.any(mask_mid):
+            expected = np.exp(intercept)[:, None] * (norm_r[mask_mid][None, :] ** alpha[:, None])
+            rel_gap = (expected - profile[:, mask_mid]) / (expected + 1e-8)
+            features[:, 5] = rel_gap.mean(axis=1)
+
+    # High/low frequency ratio as two mask matmuls
+    with span("fft_batch.high_low_freq_ratio"):
+        low_mask, high_mask = geom.band_masks(0.1, 0.4)
+        features[:, 4] = (flat @ high_mask) / ((flat @ low_mask) + 1e-8)
 
+    # Spectral entropy
+    with span("fft_batch.entropy"):
+        hist = batched_histogram_density(flat, bins=128) + 1e-8
+        features[:, 6] = -np.sum(hist * np.log(hist), axis=1)
+
+    # Peak detection is inherently per-spectrum
+    with span("fft_batch.peak_features"):
+        for i in range(n):
+            features[i, 7], features[i, 8] = fft_peak_features(log_mag[i])
+
+    # Angular variance: one bincount over the shared angle bins
+    with span("fft_batch.angular_variance"):
+        _, angular_energy, _ = angular_histogram(log_mag, n_angular_bins)
+        features[:, 9] = np.var(angular_energy, axis=1)
+
+    # Kurtosis & skew
+    with span("fft_batch.kurtosis_skew"):
+        features[:, 10], features[:, 11] = batched_kurtosis_skew(flat)
+
+    # Cross-spectral correlations (if color)
+    if is_color:
+        with span("fft_batch.rgb_cross_spectral_corr"):
+            # BGR -> RGB, channels first, each channel normalized to [0,1]
+            img_rgb = np.ascontiguousarray(images[..., ::-1].transpose(0, 3, 1, 2)).astype(np.float32)
+            ch_mag = compute_fft_batch(_normalize_batch(img_rgb)).reshape(n, 3, -1)
+            for col, (i, j) in zip((12, 13, 14), ((0, 1), (0, 2), (1, 2))):
+                features[:, col] = batched_pearson(ch_mag[:, i], ch_mag[:, j])
+
+    return features.astype(np.float32)
 
 
 class ImageClassifier(nn.Module):
@@ -344,7 +468,10 @@ class ImageClassifier(nn.Module):
         
 
     def forward(self, image, metaData):
-        imgFeatures = self.features(image)
+        return self.head(self.features(image), metaData)
+
+    def head(self, imgFeatures, metaData):
+        """Everything after the VGG16 conv stack: both branches and the final classifier."""
         img = self.flatten(imgFeatures)
         img = self.imageBranch(img)
         
@@ -354,93 +481,293 @@ class ImageClassifier(nn.Module):
         out = self.finalClassifier(imgInfo)
         return out
 
-def runModel(imagePath):
-    img = Image.open(imagePath).convert('RGB')
-    processImage=transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225]
-            )
-        ])
-    # processImage converts PIL Image to PyTorch tensor
-    imgTensor = processImage(img)
-    
-    # Add batch dimension
-    imgTensor = imgTensor.unsqueeze(0)  # Shape: (1, 3, 224, 224)
+def resolve_model_path():
+    """
+    Path of image_classifier.pt: Render secret files when available,
+    otherwise the checkpoint next to this file (local development).
+    """
+    secret_files_dir = os.environ.get('RENDER_SECRET_FILES_DIR')
+    if secret_files_dir:
+        return os.path.join(secret_files_dir, 'image_classifier.pt')
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, "image_classifier.pt")
+
+# Loaded ImageClassifier per device, so VGG16 is built and the checkpoint read once per process
+_loaded_models = {}
+_load_lock = threading.Lock()
+
+def load_checkpoint(model_path, device):
+    """
+    torch.load a state dict, memory-mapped when possible (MODEL_MMAP=1, the
+    default). Mapped weights are file-backed pages: they are read on first use,
+    never written, and shared through the page cache by every process that
+    loads the same file (gunicorn workers), instead of a private copy each.
+    Returns (state_dict, mmapped); pass assign=mmapped to load_state_dict so
+    the model keeps the mapped tensors rather than copying them.
+    """
+    if os.environ.get('MODEL_MMAP', '1') == '1' and str(device) == 'cpu':
+        try:
+            return torch.load(model_path, map_location=device, mmap=True), True
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            # Legacy (non-zip) checkpoints cannot be mapped
+            print(f"Memory-mapped load of {model_path} failed ({e}), reading it into memory")
+    return torch.load(model_path, map_location=device), False
+
+def load_image_classifier(device=None):
+    """
+    Build ImageClassifier and load the checkpoint, once per process and device.
+    Returns the model in eval mode, or None if the checkpoint cannot be loaded
+    (callers fall back to a neutral score; a later call retries the load).
+    """
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    key = str(device)
+    if key in _loaded_models:
+        return _loaded_models[key]
+    with _load_lock:
+        # Threads that waited here use the model the first one built
+        if key in _loaded_models:
+            return _loaded_models[key]
+        return _build_image_classifier(device, key)
+
+def _build_image_classifier(device, key):
+    """load_image_classifier's load; runs with _load_lock held."""
+    # The checkpoint holds the VGG16 conv weights too, so no ImageNet download is needed
+    with span("image_model_load"):
+        vgg16 = models.vgg16(weights=None)
+        model = ImageClassifier(vgg16.features, len(FFT_FEATURE_NAMES))
+        model_path = resolve_model_path()
+        print(f"Loading model from: {model_path}")
+        try:
+            state, mmapped = load_checkpoint(model_path, device)
+            model.load_state_dict(state, assign=mmapped)
+            print(f"Model loaded successfully from {model_path}{' (memory-mapped)' if mmapped else ''}")
+        except FileNotFoundError:
+            print(f"Model file not found at {model_path}")
+            return None
+        except Exception as e:
+            print(f"Error loading model from {model_path}: {e}")
+            return None
+    model = model.to(device)
+    model.eval()  # Set to evaluation mode
+    _loaded_models[key] = model
+    return model
+
+def runModel(imagePath, progress=None, tiles=None, reducer=None):
+    """
+    Score one image file: the real-probability as a percentage (0-100).
+    progress: optional callable(event, data) called as each stage finishes:
+      "decoded", "fft_features" (with the raw feature values), "cascade" (when
+      CASCADE_MODEL is set, see fftCascade.py) and "cnn" (unless the cascade
+      answered).
+    tiles: tile budget for tiled mode (IMAGE_TILES by default, 0 = off): score
+      up to `tiles` native-resolution crops instead of the resized image and
+      combine them with `reducer` (see imageTiles.py). Images smaller than a
+      tile always use the resized path.
+    """
+    if tiles is None:
+        tiles = tile_budget()
+    if tiles > 0:
+        result = _runModelTiled(imagePath, tiles, reducer, progress)
+        if result is not None:
+            return result
+    stage_start = time.perf_counter()
+    with span("decode"):
+        img = Image.open(imagePath).convert('RGB')
+    if progress is not None:
+        progress("decoded", {"seconds": round(time.perf_counter() - stage_start, 4)})
+        stage_start = time.perf_counter()
     
-    signalFeatures=extract_fft_features(imagePath)
-    fft_feature_names = [
-            'fft_vertical_line_ratio',
-            'fft_horizontal_line_ratio',
-            'fft_central_cross_ratio',
-            'fft_radial_slope',
-            'fft_high_low_freq_ratio',
-            'fft_mid_band_gap',
-            'fft_entropy',
-            'fft_peak_count',
-            'fft_peak_regularity',
-            'fft_angular_variance',
-            'fft_kurtosis',
-            'fft_skew',
-            'fft_corr_rg',
-            'fft_corr_rb',
-            'fft_corr_gb'
-        ]
+    with span("fft_features"):
+        signalFeatures=extract_fft_features(imagePath)
+    if progress is not None:
+        progress("fft_features", {"seconds": round(time.perf_counter() - stage_start, 4),
+                                  "features": {k: float(v) for k, v in signalFeatures.items()}})
+        stage_start = time.perf_counter()
+    fft_feature_names = FFT_FEATURE_NAMES
     to_log = ['fft_angular_variance', 'fft_peak_regularity', 'fft_high_low_freq_ratio']
     
-    raw_vals = np.array([signalFeatures[name] for name in fft_feature_names], dtype=np.float32)
-    # Handle NaN
-    
-    if np.isnan(raw_vals).any():
-        raw_vals = np.nan_to_num(raw_vals, nan=0.0)
-    # Apply log1p to selected features
-    for i, name in enumerate(fft_feature_names):
-        if name in to_log:
-            v = raw_vals[i]
-            if v < 0:
-                v = 0.0
-            raw_vals[i] = np.log1p(v)
-    
+    with span("fft_prepare"):
+        raw_vals = np.array([signalFeatures[name] for name in fft_feature_names], dtype=np.float32)
+        # Handle NaN
+        
+        if np.isnan(raw_vals).any():
+            raw_vals = np.nan_to_num(raw_vals, nan=0.0)
+        # Apply log1p to selected features
+        for i, name in enumerate(fft_feature_names):
+            if name in to_log:
+                v = raw_vals[i]
+                if v < 0:
+                    v = 0.0
+                raw_vals[i] = np.log1p(v)
+        
+    # FFT-only first stage (CASCADE_MODEL): confident images never reach VGG16
+    cascade = load_cascade()
+    if cascade is not None:
+        with span("cascade"):
+            probabilities, answered = cascade.decide(raw_vals[None, :])
+        if progress is not None:
+            progress("cascade", {"seconds": round(time.perf_counter() - stage_start, 4),
+                                 "score": round(float(probabilities[0]) * 100, 1),
+                                 "escalated": not answered[0]})
+            stage_start = time.perf_counter()
+        if answered[0]:
+            return round(float(probabilities[0]) * 100, 1)
+
     device=torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    # Convert to tensor and add batch dimension
-    raw_vals = torch.tensor(raw_vals, dtype=torch.float32).unsqueeze(0)  # Shape: (1, 15)
-    
-    vgg16 = models.vgg16(pretrained=True)
-    feature_extractor = vgg16.features
-    model=ImageClassifier(feature_extractor,15)
-    model=model.to(device)
-    
-    # Use dynamic path for model file - check for secret files first
-    import os
-    secret_files_dir = os.environ.get('RENDER_SECRET_FILES_DIR')
-    if secret_files_dir:
-        print(f"Using secret files directory: {secret_files_dir}")
-        model_path = os.path.join(secret_files_dir, 'image_classifier.pt')
-    else:
-        # Local development - use local myEnv directory
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(current_dir, "image_classifier.pt")
-    
-    print(f"Loading model from: {model_path}")
+    with span("preprocess"):
+        # Convert to tensor and add batch dimension
+        raw_vals = torch.tensor(raw_vals, dtype=torch.float32).unsqueeze(0)  # Shape: (1, 15)
+        # _processImage converts PIL Image to PyTorch tensor
+        imgTensor = _processImage(img)
+        
+        # Add batch dimension
+        imgTensor = imgTensor.unsqueeze(0)  # Shape: (1, 3, 224, 224)
     
-    try:
-        model.load_state_dict(torch.load(model_path, map_location=device))
-        print(f"Model loaded successfully from {model_path}")
-    except FileNotFoundError:
-        print(f"Model file not found at {model_path}")
+    model = load_image_classifier(device)
+    if model is None:
         # Return a fallback value if model is not available
         return 50.0  # Return 50.0% as neutral value (already rounded to 1 decimal)
-    except Exception as e:
-        print(f"Error loading model from {model_path}: {e}")
-        return 50.0  # Return 50.0% as neutral value
 
-    model.eval()  # Set to evaluation mode
     with torch.no_grad():
-        outputs=model(imgTensor,raw_vals)
+        with span("vgg_forward"):
+            imgFeatures = model.features(imgTensor.to(device))
+        with span("head_forward"):
+            outputs = model.head(imgFeatures, raw_vals.to(device))
         probability = outputs.item()
+        if progress is not None:
+            progress("cnn", {"seconds": round(time.perf_counter() - stage_start, 4),
+                             "score": round(probability * 100, 1)})
         return round(probability * 100, 1)  # Convert to percentage (0-100) and round to 1 decimal
 
 
-# runModel(r"FirstImmigrant.jpg")
\ No newline at end of file
+def _runModelTiled(imagePath, tiles, reducer, progress):
+    """runModel in tiled mode; None if the image is smaller than a tile."""
+    stage_start = time.perf_counter()
+    with span("decode"):
+        img = cv2.imread(imagePath, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Unable to read image: {imagePath}")
+    with span("tile_extract"):
+        origins, tile_stack = extract_tiles(img, tiles)
+    del img
+    if not origins:
+        return None
+    if progress is not None:
+        progress("decoded", {"seconds": round(time.perf_counter() - stage_start, 4), "tiles": len(origins)})
+        stage_start = time.perf_counter()
+    tile_scores = score_tiles(tile_stack)
+    score = reduce_scores(tile_scores, reducer)
+    if progress is not None:
+        progress("cnn", {"seconds": round(time.perf_counter() - stage_start, 4), "score": score,
+                         "tiles": [{"y": y, "x": x, "score": s} for (y, x), s in zip(origins, tile_scores)]})
+    return score
+
+# runModel(r"FirstImmigrant.jpg")
+
+_processImage = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(
+        mean=[0.485, 0.456, 0.406],
+        std=[0.229, 0.224, 0.225]
+    )
+])
+
+def prepare_fft_batch(raw_vals):
+    """
+    Batched version of runModel's feature cleanup: NaN -> 0, then log1p on the
+    heavy-tailed features (negative values clamped to 0 first).
+    raw_vals: [N,15] array in FFT_FEATURE_NAMES order. Returns a float32 copy.
+    """
+    vals = np.nan_to_num(np.asarray(raw_vals, dtype=np.float32), nan=0.0)
+    to_log = ['fft_angular_variance', 'fft_peak_regularity', 'fft_high_low_freq_ratio']
+    for i, name in enumerate(FFT_FEATURE_NAMES):
+        if name in to_log:
+            vals[:, i] = np.log1p(np.maximum(vals[:, i], 0.0))
+    return vals
+
+def score_frames(frames_bgr, batch_size=4, device=None, cascade=False):
+    """
+    runModel for a list of same-size BGR frames (e.g. decoded video frames),
+    without the temp-file round trip: FFT features are computed with
+    extract_fft_features_batch and the classifier runs once per batch.
+    batch_size bounds peak memory, since full-resolution spectra are large.
+    cascade: answer confident frames with the FFT cascade (fftCascade.py) as
+      runModel does; only the others go through VGG16.
+    Returns a list of scores on runModel's 0-100 scale (50.0 each if the
+    checkpoint is unavailable).
+    """
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_image_classifier(device)
+    if model is None:
+        return [50.0] * len(frames_bgr)
+    fft_cascade = load_cascade() if cascade else None
+
+    scores = []
+    for start in range(0, len(frames_bgr), batch_size):
+        chunk = frames_bgr[start:start + batch_size]
+        with span("fft_features_batch"):
+            raw_vals = prepare_fft_batch(extract_fft_features_batch(np.stack(chunk)))
+        if fft_cascade is not None:
+            with span("cascade"):
+                probabilities, answered = fft_cascade.decide(raw_vals)
+            chunk_scores = [round(float(p) * 100, 1) for p in probabilities]
+            escalated = np.flatnonzero(~answered)
+            if len(escalated):
+                escalated_scores = _score_chunk(model, [chunk[i] for i in escalated], raw_vals[escalated], device)
+                for i, score in zip(escalated, escalated_scores):
+                    chunk_scores[i] = score
+            scores.extend(chunk_scores)
+            continue
+        scores.extend(_score_chunk(model, chunk, raw_vals, device))
+    return scores
+
+def _score_chunk(model, chunk, raw_vals, device):
+    """score_frames' classifier pass over one batch of frames and their prepared FFT features."""
+    with span("preprocess_batch"):
+        imgTensor = torch.stack([
+            _processImage(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))) for frame in chunk
+        ])
+    with torch.no_grad():
+        with span("vgg_forward_batch"):
+            imgFeatures = model.features(imgTensor.to(device))
+        with span("head_forward_batch"):
+            outputs = model.head(imgFeatures, torch.from_numpy(np.ascontiguousarray(raw_vals)).to(device))
+    return [round(p * 100, 1) for p in outputs.view(-1).tolist()]
+
+_tileMean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+_tileStd = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+def score_tiles(tiles_bgr, device=None):
+    """
+    Score a [K,224,224,3] stack of BGR tiles in one batch: FFT features with
+    extract_fft_features_batch and a single VGG16 + head forward pass. The
+    tiles are already classifier-sized, so nothing is resized (same
+    normalization as _processImage).
+    Returns a list of K scores on runModel's 0-100 scale (50.0 each if the
+    checkpoint is unavailable).
+    """
+    tiles_bgr = np.asarray(tiles_bgr)
+    if tiles_bgr.shape[1:3] != (TILE_SIZE, TILE_SIZE):
+        raise ValueError(f"Expected {TILE_SIZE}x{TILE_SIZE} tiles, got shape {tiles_bgr.shape}")
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_image_classifier(device)
+    if model is None:
+        return [50.0] * len(tiles_bgr)
+
+    with span("fft_features_tiles"):
+        raw_vals = prepare_fft_batch(extract_fft_features_batch(tiles_bgr))
+    with span("preprocess_tiles"):
+        imgTensor = torch.from_numpy(np.ascontiguousarray(tiles_bgr[..., ::-1])).permute(0, 3, 1, 2)
+        imgTensor = (imgTensor.float().div_(255) - _tileMean) / _tileStd
+    with torch.no_grad():
+        with span("vgg_forward_tiles"):
+            imgFeatures = model.features(imgTensor.to(device))
+        with span("head_forward_tiles"):
+            outputs = model.head(imgFeatures, torch.from_numpy(raw_vals).to(device))
+    return [round(p * 100, 1) for p in outputs.view(-1).tolist()]
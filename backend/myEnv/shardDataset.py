@@ -0,0 +1,235 @@
+import io
+import os
+import json
+import random
+import tarfile
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision import transforms
+from spectralOps import FFT_FEATURE_NAMES
+
+# ---------------------------
+# Sharded storage for the AI-vs-real image corpus.
+#
+# Each shard is a plain tar archive in the WebDataset layout: every sample is a
+# group of consecutive members sharing one key, e.g.
+#   000000042.img      raw encoded image bytes (exactly as they were on disk)
+#   000000042.cls      label as text ("1.0" real, "0.0" AI)
+#   000000042.fft.npy  float32 vector of the raw FFT features (FFT_FEATURE_NAMES order)
+# Next to the shards, <split>-index.json records the shard file names and
+# sample counts so a split can be opened without listing or scanning anything.
+# Shards are read strictly sequentially, so a cold-cache epoch is a handful of
+# large streaming reads instead of one random small-file read per image.
+# ---------------------------
+
+TO_LOG = ['fft_angular_variance', 'fft_peak_regularity', 'fft_high_low_freq_ratio']
+
+
+def prepare_fft_vector(raw_vals):
+    """
+    Apply the same cleanup imageLoader uses: NaN -> 0, then log1p on the
+    heavy-tailed features (negative values clamped to 0 first).
+    raw_vals: float array in FFT_FEATURE_NAMES order. Returns a float32 copy.
+    """
+    vals = np.nan_to_num(np.asarray(raw_vals, dtype=np.float32), nan=0.0)
+    for i, name in enumerate(FFT_FEATURE_NAMES):
+        if name in TO_LOG:
+            vals[i] = np.log1p(max(vals[i], 0.0))
+    return vals
+
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(samples, out_dir, split="train", shard_size=1000, feature_fn=None):
+    """
+    Pack (image_path, label) samples into tar shards under out_dir.
+    samples: list of (path, label) tuples, written in the given order.
+    split: prefix for the shard names (train-000000.tar, ...) and the index file.
+    shard_size: number of samples per shard.
+    feature_fn: callable(path) -> dict of FFT features. Defaults to
+      imageModel.extract_fft_features without augmentation.
+    Returns the path of the written index file.
+    """
+    if feature_fn is None:
+        from imageModel import extract_fft_features
+        feature_fn = lambda path: extract_fft_features(path, False)
+
+    os.makedirs(out_dir, exist_ok=True)
+    shards = []
+    tar = None
+    for i, (path, label) in enumerate(samples):
+        if i % shard_size == 0:
+            if tar is not None:
+                tar.close()
+            shard_name = f"{split}-{len(shards):06d}.tar"
+            tar = tarfile.open(os.path.join(out_dir, shard_name), "w")
+            shards.append({"name": shard_name, "count": 0})
+        try:
+            feats = feature_fn(path)
+        except Exception as e:
+            print(f"Warning: FFT features failed for {path}: {e}. Filling with NaN.")
+            feats = {}
+        raw_vals = np.array([feats.get(name, np.nan) for name in FFT_FEATURE_NAMES], dtype=np.float32)
+        with open(path, 'rb') as f:
+            img_bytes = f.read()
+
+        key = f"{i:09d}"
+        fft_buf = io.BytesIO()
+        np.save(fft_buf, raw_vals)
+        _add_member(tar, f"{key}.img", img_bytes)
+        _add_member(tar, f"{key}.cls", str(float(label)).encode())
+        _add_member(tar, f"{key}.fft.npy", fft_buf.getvalue())
+        shards[-1]["count"] += 1
+    if tar is not None:
+        tar.close()
+
+    index_path = os.path.join(out_dir, f"{split}-index.json")
+    with open(index_path, 'w') as f:
+        json.dump({"split": split, "feature_names": FFT_FEATURE_NAMES, "shards": shards}, f, indent=2)
+    return index_path
+
+
+def iter_shard(shard_path):
+    """
+    Stream one shard and yield raw samples as dicts
+    {"key", "img" (bytes), "label" (float), "fft" (float32 array)}.
+    Uses tarfile's streaming mode, so the file is read front to back once.
+    """
+    sample = {}
+    with tarfile.open(shard_path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, ext = member.name.split('.', 1)
+            if sample and sample["key"] != key:
+                yield sample
+                sample = {}
+            sample["key"] = key
+            data = tar.extractfile(member).read()
+            if ext == "img":
+                sample["img"] = data
+            elif ext == "cls":
+                sample["label"] = float(data.decode())
+            elif ext == "fft.npy":
+                sample["fft"] = np.load(io.BytesIO(data))
+    if sample:
+        yield sample
+
+
+class ShardedImageDataset(IterableDataset):
+    """
+    Streams (imgTensor, fft_vals, label) triples from tar shards, the same
+    triples imageLoader returns, so train_validate_test can consume either.
+    Shards are split across DataLoader workers; within a worker, samples pass
+    through a shuffle buffer of `shuffle_buffer` entries (0 disables shuffling,
+    which is what validation/test splits want).
+    """
+    def __init__(self, index_path, shuffle_buffer=1000, seed=0):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get("feature_names", FFT_FEATURE_NAMES) != FFT_FEATURE_NAMES:
+            raise ValueError(f"Shard index {index_path} was written with a different FFT feature set")
+        shard_dir = os.path.dirname(os.path.abspath(index_path))
+        self.shard_paths = [os.path.join(shard_dir, s["name"]) for s in index["shards"]]
+        self.num_samples = sum(s["count"] for s in index["shards"])
+        self.fft_feature_names = FFT_FEATURE_NAMES
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        # Image preprocessing to match VGG16 (same as imageLoader)
+        self.processImage = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(
+                mean=[0.485, 0.456, 0.406],
+                std=[0.229, 0.224, 0.225]
+            )
+        ])
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        """Reseed shard order and the shuffle buffer so each epoch sees a new order."""
+        self.epoch = epoch
+
+    def _decode(self, sample):
+        img = Image.open(io.BytesIO(sample["img"])).convert('RGB')
+        imgTensor = self.processImage(img)
+        raw_vals = prepare_fft_vector(sample["fft"])
+        return imgTensor, raw_vals, torch.tensor(sample["label"], dtype=torch.float32)
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id = worker.id if worker is not None else 0
+        num_workers = worker.num_workers if worker is not None else 1
+        rng = random.Random(self.seed + self.epoch * 1000 + worker_id)
+
+        shard_paths = list(self.shard_paths)
+        if self.shuffle_buffer > 0:
+            random.Random(self.seed + self.epoch).shuffle(shard_paths)
+        # Every worker sees the same shard order, then takes every num_workers-th shard
+        shard_paths = shard_paths[worker_id::num_workers]
+
+        buffer = []
+        for shard_path in shard_paths:
+            for sample in iter_shard(shard_path):
+                if self.shuffle_buffer <= 0:
+                    yield self._decode(sample)
+                    continue
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                # Buffer full: emit a random entry and put the new sample in its place
+                j = rng.randrange(len(buffer))
+                out, buffer[j] = buffer[j], sample
+                yield self._decode(out)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._decode(sample)
+
+
+def main():
+    """
+    Build train/val/test shards from the RealArt/AiArtData folders, using the
+    same stratified split (and random_state) as imageModel.main().
+    """
+    from sklearn.model_selection import train_test_split
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    realData = os.path.join(script_dir, r"AI-Generated-vs-Real-Images-Datasets\RealArt\RealArt")
+    fakeData = os.path.join(script_dir, r"AI-Generated-vs-Real-Images-Datasets\AiArtData\AiArtData")
+    out_dir = os.path.join(script_dir, "shards")
+
+    filePaths = []
+    for file in os.listdir(realData):
+        filePaths.append((os.path.join(realData, file), 1.0))
+    for file in os.listdir(fakeData):
+        filePaths.append((os.path.join(fakeData, file), 0.0))
+    paths, labels = zip(*filePaths)
+    paths = list(paths)
+    labels = list(labels)
+
+    train_paths, test_paths, train_labels, test_labels = train_test_split(
+        paths, labels, test_size=0.15, stratify=labels, random_state=42
+    )
+    val_frac = 0.15 / 0.85
+    train_paths, val_paths, train_labels, val_labels = train_test_split(
+        train_paths, train_labels, test_size=val_frac, stratify=train_labels, random_state=42
+    )
+
+    for split, split_paths, split_labels in [("train", train_paths, train_labels),
+                                             ("val", val_paths, val_labels),
+                                             ("test", test_paths, test_labels)]:
+        index_path = write_shards(list(zip(split_paths, split_labels)), out_dir, split=split)
+        print(f"Wrote {len(split_paths)} {split} samples -> {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,126 @@
-import cv2
-from runModel import runModel
+from frameReader import read_frames, read_frames_scaled, count_frames
 import random
 from tqdm import tqdm
 
-def runVideo(videoPath,numFrames):
-    frames=[]
-    capture=cv2.VideoCapture(videoPath)
-    while True:
-        ret, frame = capture.read()#ret is True if a frame was read
-        if not ret:
-            break#No more frames, exit the loop
-        frames.append(frame)#Save the frame in our list
-    capture.release()
-    randomFrames=random.sample(frames,numFrames)
+# runModel (and with it torch) is imported inside the functions that use it, so
+# that a process scoring frames elsewhere (inferenceWorkers.py) can use
+# runVideoAdaptive without loading the model stack
+
+def runVideo(videoPath,numFrames,progress=None,batchSize=4):
+    from runModel import score_frames
+    totalFrames=count_frames(videoPath)
+    # Pick the random frames first, then decode only those in one forward pass
+    randomIndices=random.sample(range(totalFrames),min(numFrames,totalFrames))
+    randomFrames=read_frames(videoPath,randomIndices)
+    if not randomFrames:
+        raise RuntimeError(f"Could not read any frames from {videoPath}")
     
+    # Score the decoded frames directly, batchSize at a time (no temp image file,
+    # so concurrent requests in one process do not overwrite each other's frames)
+    items=list(randomFrames.items())
     avgAiScore=0
-    for frame in tqdm(randomFrames):
-        cv2.imwrite("tempFrame.png",frame)
-        avgAiScore+=runModel("tempFrame.png")
-    return avgAiScore/numFrames
\ No newline at end of file
+    done=0
+    for start in tqdm(range(0,len(items),batchSize)):
+        batch=items[start:start+batchSize]
+        for (idx,_),score in zip(batch,score_frames([frame for _,frame in batch],cascade=True)):
+            avgAiScore+=score
+            done+=1
+            # progress: optional callable(event, data), called once per scored frame
+            if progress is not None:
+                progress("frame_scored",{"frame_index":idx,"score":score,"frames_done":done,"frames_total":len(items)})
+    return avgAiScore/len(items)
+
+def coarseToFineLevels(totalFrames,maxFrames):
+    """
+    Frame indices in coarse-to-fine order across the timeline, grouped by level:
+    [[middle], [1/4, 3/4], [1/8, 3/8, 5/8, 7/8], ...], each frame taken at the
+    centre of its segment. Every prefix covers the whole clip as evenly as
+    possible. Duplicates (short clips) are dropped; at most maxFrames in total.
+    """
+    levels=[]
+    seen=set()
+    count=0
+    segments=1
+    while count<min(maxFrames,totalFrames):
+        level=[]
+        for k in range(1,2*segments,2):
+            idx=min(int(k*totalFrames/(2*segments)),totalFrames-1)
+            if idx not in seen and count<maxFrames:
+                seen.add(idx)
+                level.append(idx)
+                count+=1
+        if level:
+            levels.append(level)
+        segments*=2
+    return levels
+
+def scoreIsDecisive(scores,z=1.96,sdFloor=10.0,boundary=50.0):
+    """
+    Stop rule for runVideoAdaptive: True once the normal confidence interval
+    mean +/- z*sd/sqrt(n) of the frame scores (0-100) excludes the 50% decision
+    boundary. The per-frame sd is floored at sdFloor points, so two agreeing
+    frames only stop the scan when they are far from 50.
+    """
+    n=len(scores)
+    if n<2:
+        return False
+    avg=sum(scores)/n
+    sd=(sum((s-avg)**2 for s in scores)/(n-1))**0.5
+    halfWidth=z*max(sd,sdFloor)/n**0.5
+    return abs(avg-boundary)>halfWidth
+
+def runVideoAdaptive(videoPath,maxFrames=16,minFrames=2,z=1.96,sdFloor=10.0,returnDetails=False,progress=None,
+                     decodeSize=None,scoreFrames=None):
+    """
+    Like runVideo, but scores frames progressively in coarse-to-fine order and
+    stops as soon as scoreIsDecisive says the mean score is clearly on one side
+    of 50, or after maxFrames frames (the hard cap on cost). Each level is
+    scored as one batch and the stop rule is checked after it, so clearly real
+    or clearly AI videos finish after the first two levels (3 frames);
+    ambiguous ones get more.
+    All candidate frames (at most maxFrames, the count the memory governor
+    budgets for) are decoded in one read_frames pass up front, so the levels do
+    not each decode the video from the start again; early exit saves the
+    scoring, which dominates. Frames are scored with score_frames (no temp files).
+    progress: optional callable(event, data), called with "frame_scored" for
+    every frame (frames_total is the cap, since the exit point is not known).
+    decodeSize: if set, frames are decoded at decodeSize x decodeSize with
+    read_frames_scaled (the memory governor's downscale) instead of full size.
+    scoreFrames: callable(list of BGR frames) -> scores, default
+    runModel.score_frames (InferenceClient.score_frames scores them remotely).
+    Returns the mean score (0-100), or (score, details) if returnDetails.
+    """
+    if scoreFrames is None:
+        from runModel import score_frames as scoreFrames
+    totalFrames=count_frames(videoPath)
+    if totalFrames<=0:
+        raise RuntimeError(f"Could not read any frames from {videoPath}")
+    scores=[]
+    indices=[]
+    stopped=False
+    levels=coarseToFineLevels(totalFrames,maxFrames)
+    candidates=[idx for level in levels for idx in level]
+    if decodeSize:
+        frames=read_frames_scaled(videoPath,candidates,size=(decodeSize,decodeSize))
+    else:
+        frames=read_frames(videoPath,candidates)
+    for level in levels:
+        level=[idx for idx in level if idx in frames]
+        if not level:
+            continue
+        for idx,score in zip(level,scoreFrames([frames[idx] for idx in level])):
+            scores.append(score)
+            indices.append(idx)
+            if progress is not None:
+                progress("frame_scored",{"frame_index":idx,"score":score,"frames_done":len(scores),
+                                         "frames_total":min(maxFrames,totalFrames)})
+        if len(scores)>=minFrames and scoreIsDecisive(scores,z,sdFloor):
+            stopped=True
+            break
+    if not scores:
+        raise RuntimeError(f"Could not read any frames from {videoPath}")
+    avgAiScore=sum(scores)/len(scores)
+    if returnDetails:
+        return avgAiScore,{"frames_scored":len(scores),"frame_indices":indices,
+                           "scores":scores,"early_exit":stopped}
+    return avgAiScore
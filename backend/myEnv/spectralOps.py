@@ -0,0 +1,357 @@
+import numpy as np
+from functools import lru_cache
+
+# ---------------------------
+# Numpy-only building blocks for the FFT features.
+#
+# Everything that depends only on the spectrum shape (radius/angle maps, bin
+# indices, band masks) lives in SpectrumGeometry and is built once per (h, w),
+# so repeated calls on same-size spectra (video frames, resized training
+# images) skip the np.indices/sqrt/arctan2 passes entirely.
+# The batched_* helpers reduce a stack of spectra [N, H, W] in one call.
+# ---------------------------
+
+FFT_FEATURE_NAMES = [
+    'fft_vertical_line_ratio',
+    'fft_horizontal_line_ratio',
+    'fft_central_cross_ratio',
+    'fft_radial_slope',
+    'fft_high_low_freq_ratio',
+    'fft_mid_band_gap',
+    'fft_entropy',
+    'fft_peak_count',
+    'fft_peak_regularity',
+    'fft_angular_variance',
+    'fft_kurtosis',
+    'fft_skew',
+    'fft_corr_rg',
+    'fft_corr_rb',
+    'fft_corr_gb'
+]
+
+
+def _readonly(arr):
+    arr.setflags(write=False)
+    return arr
+
+
+class SpectrumGeometry:
+    """
+    Shape-only constants for a shifted spectrum of size (h, w), centred on
+    (h // 2, w // 2) like the feature functions expect. Do not construct
+    directly; use spectrum_geometry(h, w) so instances are shared.
+    """
+    def __init__(self, h, w):
+        self.h = h
+        self.w = w
+        self.center = (h // 2, w // 2)
+        y, x = np.indices((h, w))
+        dy = y - self.center[0]
+        dx = x - self.center[1]
+        self.r = _readonly(np.sqrt(dx ** 2 + dy ** 2).ravel())
+        self.max_r = float(np.max(self.r))
+        self._angles = None
+        self._radial = {}
+        self._angular = {}
+        self._band = {}
+
+    @property
+    def angles(self):
+        """Flat angle map in degrees, 0 to 360, same convention as fft_angular_variance."""
+        if self._angles is None:
+            y, x = np.indices((self.h, self.w))
+            angles = np.arctan2(y - self.center[0], x - self.center[1])
+            self._angles = _readonly(((angles + np.pi) * (180 / np.pi)).ravel())
+        return self._angles
+
+    def radial_bins(self, nbins):
+        """
+        Radial binning used by radial_profile.
+        Returns (bin_idx, counts, bin_centers): bin_idx is the flat bin index per
+        pixel (nbins for pixels outside every bin, i.e. exactly at max_r),
+        counts the pixels per bin, bin_centers the centre radius of each bin.
+        """
+        if nbins not in self._radial:
+            bins = np.linspace(0, self.max_r, nbins + 1)
+            bin_idx = np.digitize(self.r, bins) - 1
+            bin_idx[(bin_idx < 0) | (bin_idx >= nbins)] = nbins
+            counts = np.bincount(bin_idx, minlength=nbins + 1)[:nbins]
+            bin_centers = (bins[:-1] + bins[1:]) / 2
+            self._radial[nbins] = (_readonly(bin_idx), _readonly(counts), _readonly(bin_centers))
+        return self._radial[nbins]
+
+    def angle_bins(self, n_bins):
+        """
+        Angular binning used by fft_angular_variance: n_bins equal sectors over
+        0-360 degrees. Returns (bin_idx, counts, bin_centers) like radial_bins;
+        bin_idx is n_bins for pixels at exactly 360 degrees, which the half-open
+        sectors [lo, hi) exclude.
+        """
+        if n_bins not in self._angular:
+            bins = np.linspace(0, 360, n_bins + 1)
+            bin_idx = np.digitize(self.angles, bins) - 1
+            bin_idx[(bin_idx < 0) | (bin_idx >= n_bins)] = n_bins
+            counts = np.bincount(bin_idx, minlength=n_bins + 1)[:n_bins]
+            bin_centers = (bins[:-1] + bins[1:]) / 2
+            self._angular[n_bins] = (_readonly(bin_idx), _readonly(counts), _readonly(bin_centers))
+        return self._angular[n_bins]
+
+    def band_masks(self, low_frac, high_frac):
+        """Float masks (flat) for r < max_r*low_frac and r > max_r*high_frac."""
+        key = (low_frac, high_frac)
+        if key not in self._band:
+            low = (self.r < self.max_r * low_frac).astype(np.float64)
+            high = (self.r > self.max_r * high_frac).astype(np.float64)
+            self._band[key] = (_readonly(low), _readonly(high))
+        return self._band[key]
+
+
+@lru_cache(maxsize=16)
+def spectrum_geometry(h, w):
+    return SpectrumGeometry(h, w)
+
+
+def batched_radial_profile(log_mags, nbins=100):
+    """
+    Radial profile of every spectrum in `log_mags` [N, H, W] with a single
+    bincount. Matches radial_profile: returns (bin_centers [K], profile [N, K])
+    for the K bins that contain at least one pixel.
+    """
+    n, h, w = log_mags.shape
+    geom = spectrum_geometry(h, w)
+    bin_idx, counts, bin_centers = geom.radial_bins(nbins)
+    # Offset each image's bins so one bincount covers the whole batch
+    offsets = (np.arange(n) * (nbins + 1))[:, None] + bin_idx[None, :]
+    sums = np.bincount(offsets.ravel(), weights=log_mags.reshape(n, -1).ravel().astype(np.float64),
+                       minlength=n * (nbins + 1)).reshape(n, nbins + 1)[:, :nbins]
+    nonzero = counts > 0
+    profile = sums[:, nonzero] / counts[nonzero]
+    return bin_centers[nonzero], profile
+
+
+def angular_histogram(log_mags, n_bins=36):
+    """
+    Energy per angular sector in a single bincount pass.
+    log_mags: [H, W] or [N, H, W]. Returns (bin_centers [n_bins] in degrees,
+    energy [n_bins] or [N, n_bins], counts [n_bins] pixels per sector).
+    """
+    single = log_mags.ndim == 2
+    if single:
+        log_mags = log_mags[None]
+    n, h, w = log_mags.shape
+    bin_idx, counts, bin_centers = spectrum_geometry(h, w).angle_bins(n_bins)
+    offsets = (np.arange(n) * (n_bins + 1))[:, None] + bin_idx[None, :]
+    energy = np.bincount(offsets.ravel(), weights=log_mags.reshape(n, -1).ravel().astype(np.float64),
+                         minlength=n * (n_bins + 1)).reshape(n, n_bins + 1)[:, :n_bins]
+    return bin_centers, (energy[0] if single else energy), counts
+
+
+def directional_spectrum(log_mags, n_bins=36, fold=True):
+    """
+    Directional energy spectrum: mean log-magnitude per orientation sector.
+    With fold=True, opposite sectors (theta and theta+180) are merged, since the
+    spectrum of a real image is point-symmetric; n_bins must then be even and
+    the result covers 0-180 degrees in n_bins // 2 sectors.
+    Returns (bin_centers, mean_energy) shaped like angular_histogram's output.
+    """
+    bin_centers, energy, counts = angular_histogram(log_mags, n_bins)
+    if fold:
+        if n_bins % 2:
+            raise ValueError("fold=True needs an even n_bins")
+        half = n_bins // 2
+        energy = energy[..., :half] + energy[..., half:]
+        counts = counts[:half] + counts[half:]
+        bin_centers = bin_centers[:half]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return bin_centers, energy / counts
+
+
+def max_filter_1d(a, size, axis):
+    """
+    Running maximum over a centred window of `size` along `axis`, with edge
+    replication at the borders (scipy.ndimage mode='nearest'). Uses the
+    doubling trick, so it costs O(log size) array passes instead of O(size).
+    """
+    a = np.moveaxis(a, axis, 0)
+    n = a.shape[0]
+    before = size // 2
+    padded = np.concatenate([np.repeat(a[:1], before, axis=0), a,
+                             np.repeat(a[-1:], size - 1 - before, axis=0)], axis=0)
+    m = padded
+    width = 1
+    while width * 2 <= size:
+        m = np.maximum(m[:-width], m[width:])
+        width *= 2
+    out = np.maximum(m[:n], m[size - width:size - width + n])
+    return np.moveaxis(out, 0, axis)
+
+
+def find_peaks(image, min_distance=10, threshold=0.0, max_peaks=None):
+    """
+    Local maxima of a 2D image, equivalent to
+    skimage.feature.peak_local_max(image, min_distance, threshold_abs=threshold,
+    num_peaks=max_peaks) but built from a separable max filter.
+    Returns an int array [P, 2] of (row, col), highest intensity first.
+    """
+    size = 2 * min_distance + 1
+    if size == 1:
+        peak_mask = image > threshold
+    else:
+        image_max = max_filter_1d(max_filter_1d(image, size, 0), size, 1)
+        peak_mask = image == image_max
+        if np.all(peak_mask):
+            # no peak for a trivial image
+            return np.empty((0, 2), dtype=np.intp)
+        peak_mask &= image > threshold
+    if min_distance > 0:
+        peak_mask[:min_distance] = False
+        peak_mask[-min_distance:] = False
+        peak_mask[:, :min_distance] = False
+        peak_mask[:, -min_distance:] = False
+
+    coords = np.argwhere(peak_mask)
+    order = np.argsort(-image[peak_mask], kind="stable")
+    coords = coords[order]
+
+    if min_distance > 1 and len(coords) > 1:
+        # Two survivors of the max filter closer than min_distance must share a
+        # plateau value. Only those contested peaks need the greedy spacing pass:
+        # count candidates in each candidate's (2*min_distance-1)^2 box.
+        counts = peak_mask.astype(np.int32)
+        counts = np.cumsum(np.cumsum(np.pad(counts, ((1, 0), (1, 0))), axis=0), axis=1)
+        r = min_distance - 1
+        h, w = image.shape
+        y0 = np.clip(coords[:, 0] - r, 0, h)
+        y1 = np.clip(coords[:, 0] + r + 1, 0, h)
+        x0 = np.clip(coords[:, 1] - r, 0, w)
+        x1 = np.clip(coords[:, 1] + r + 1, 0, w)
+        in_box = counts[y1, x1] - counts[y0, x1] - counts[y1, x0] + counts[y0, x0]
+        contested = np.flatnonzero(in_box > 1)
+        if len(contested):
+            keep = np.ones(len(coords), dtype=bool)
+            accepted = []
+            for i in contested:
+                for j in accepted:
+                    if np.max(np.abs(coords[i] - coords[j])) < min_distance:
+                        keep[i] = False
+                        break
+                else:
+                    accepted.append(i)
+            coords = coords[keep]
+
+    if max_peaks is not None:
+        coords = coords[:max_peaks]
+    return coords
+
+
+def pairwise_distance_std(points, max_points=None, block_size=1024, seed=0):
+    """
+    Standard deviation of all pairwise Euclidean distances between `points`
+    [P, D], i.e. np.std(scipy.spatial.distance.pdist(points)), without ever
+    holding the P*(P-1)/2 distances: rows are processed in blocks and merged
+    into a running (count, mean, M2) with Chan's parallel variance update, so
+    memory is O(block_size * P).
+    max_points: if set and P exceeds it, estimate from a fixed random subset of
+      that many points (deterministic for a given seed).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if max_points is not None and len(points) > max_points:
+        rng = np.random.default_rng(seed)
+        points = points[np.sort(rng.choice(len(points), size=max_points, replace=False))]
+    p = len(points)
+    if p < 2:
+        return 0.0
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+    for start in range(0, p - 1, block_size):
+        stop = min(start + block_size, p - 1)
+        block = points[start:stop]
+        diff = block[:, None, :] - points[None, start + 1:, :]
+        dists = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+        # keep only pairs (i, j) with j > i
+        rows = np.arange(start, stop)[:, None]
+        cols = np.arange(start + 1, p)[None, :]
+        d = dists[cols > rows]
+        n_b = d.size
+        mean_b = d.mean()
+        m2_b = np.sum((d - mean_b) ** 2)
+        delta = mean_b - mean
+        total = count + n_b
+        mean += delta * n_b / total
+        m2 += m2_b + delta * delta * count * n_b / total
+        count = total
+    return float(np.sqrt(m2 / count))
+
+
+def batched_linear_fit(x, y, mask):
+    """
+    Least-squares line y = a*x + b fitted independently per row, using only the
+    entries where mask is True (np.polyfit(x[m], y[m], 1) for every row).
+    x: [K]; y, mask: [N, K]. Returns (a, b), NaN where fewer than 2 points.
+    """
+    m = mask.astype(np.float64)
+    x = np.broadcast_to(x, y.shape)
+    y = np.where(mask, y, 0.0)
+    n = m.sum(axis=1)
+    sx = (m * x).sum(axis=1)
+    sy = y.sum(axis=1)
+    sxx = (m * x * x).sum(axis=1)
+    sxy = (y * x).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = n * sxx - sx * sx
+        a = (n * sxy - sx * sy) / denom
+        b = (sy - a * sx) / n
+    a[n < 2] = np.nan
+    b[n < 2] = np.nan
+    return a, b
+
+
+def batched_histogram_density(values, bins=128):
+    """
+    np.histogram(row, bins=bins, density=True)[0] for every row of `values`
+    [N, P], with each row's own [min, max] range, using one bincount.
+    """
+    n, p = values.shape
+    lo = values.min(axis=1).astype(np.float64)
+    hi = values.max(axis=1).astype(np.float64)
+    flat = hi == lo
+    lo[flat] -= 0.5
+    hi[flat] += 0.5
+    edges = np.linspace(lo, hi, bins + 1, axis=1)
+    idx = np.floor((values - lo[:, None]) * (bins / (hi - lo))[:, None]).astype(np.int64)
+    idx = np.clip(idx, 0, bins - 1)
+    # Same edge corrections np.histogram applies after the linear estimate
+    idx -= values < np.take_along_axis(edges, idx, axis=1)
+    idx += (values >= np.take_along_axis(edges, idx + 1, axis=1)) & (idx != bins - 1)
+    offsets = (np.arange(n) * bins)[:, None] + idx
+    counts = np.bincount(offsets.ravel(), minlength=n * bins).reshape(n, bins)
+    return counts / (p * np.diff(edges, axis=1))
+
+
+def batched_kurtosis_skew(values):
+    """
+    Fisher kurtosis and skew (biased, like scipy.stats defaults) per row of [N, P].
+    """
+    values = values.astype(np.float64)
+    d = values - values.mean(axis=1, keepdims=True)
+    d2 = d * d
+    m2 = d2.mean(axis=1)
+    m3 = (d2 * d).mean(axis=1)
+    m4 = (d2 * d2).mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kurt = m4 / m2 ** 2 - 3.0
+        skw = m3 / m2 ** 1.5
+    return kurt, skw
+
+
+def batched_pearson(a, b):
+    """Pearson correlation per row of a, b [N, P]."""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    num = np.einsum('ij,ij->i', a, b)
+    den = np.sqrt(np.einsum('ij,ij->i', a, a) * np.einsum('ij,ij->i', b, b))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.clip(num / den, -1.0, 1.0)
@@ -0,0 +1,198 @@
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from spectralOps import FFT_FEATURE_NAMES
+from shardDataset import iter_shard, prepare_fft_vector
+
+# ---------------------------
+# Train the FFT-only first stage of the cascade (see fftCascade.py).
+#
+# Reads the FFT features stored in the train/val/test shards (shardDataset.py;
+# images are not decoded), fits a logistic regression on the standardized
+# features of the train split and exports it as JSON for CASCADE_MODEL.
+#
+# The confidence threshold trades escalations to ImageClassifier for
+# accuracy. For every candidate threshold the validation split gives:
+#   escalation_rate    fraction of images that still need VGG16
+#   answered_accuracy  accuracy of the cascade on the images it answers
+#   accuracy           accuracy of the whole cascade (answered images plus
+#                      ImageClassifier on the escalated ones; --with-model only)
+# The lowest threshold that meets the target is stored in the JSON: overall
+# accuracy within --max-accuracy-drop of ImageClassifier alone when the full
+# model is evaluated (--with-model, which runs it over the val/test images),
+# otherwise answered_accuracy >= --min-answered-accuracy. The test split is
+# reported at that threshold. CASCADE_THRESHOLD overrides it at serving time.
+#
+# Usage (from backend/myEnv):
+#   python trainCascade.py
+#   python trainCascade.py --with-model --max-accuracy-drop 0.005 --out fft_cascade.json
+# ---------------------------
+
+THRESHOLDS = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0]
+
+
+def load_split(shard_dir, split, with_images=False):
+    """(features [N,15] prepared like runModel, labels [N], encoded images or None) of one split."""
+    index_path = os.path.join(shard_dir, f"{split}-index.json")
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    if index.get("feature_names", FFT_FEATURE_NAMES) != FFT_FEATURE_NAMES:
+        raise ValueError(f"Shard index {index_path} was written with a different FFT feature set")
+    features, labels, images = [], [], []
+    for shard in index["shards"]:
+        for sample in iter_shard(os.path.join(shard_dir, shard["name"])):
+            features.append(prepare_fft_vector(sample["fft"]))
+            labels.append(sample["label"])
+            if with_images:
+                images.append(sample["img"])
+    return np.array(features, dtype=np.float32), np.array(labels), images if with_images else None
+
+
+def fit_cascade(features, labels, C=1.0):
+    """Logistic regression on standardized features; returns the JSON spec fftCascade.FftCascade loads."""
+    from sklearn.linear_model import LogisticRegression
+
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0)
+    scale[scale == 0] = 1.0
+    model = LogisticRegression(C=C, max_iter=1000)
+    model.fit((features - mean) / scale, labels >= 0.5)
+    return {
+        "feature_names": FFT_FEATURE_NAMES,
+        "mean": mean.tolist(),
+        "scale": scale.tolist(),
+        "coef": model.coef_[0].tolist(),
+        "intercept": float(model.intercept_[0]),
+    }
+
+
+def full_model_probabilities(images, features, batch_size=16):
+    """ImageClassifier real-probabilities for encoded images and their prepared FFT features."""
+    import torch
+    from PIL import Image
+    from runModel import load_image_classifier, _processImage
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_image_classifier(device)
+    if model is None:
+        raise RuntimeError("ImageClassifier checkpoint unavailable; cannot evaluate the full model")
+    probabilities = []
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            batch = torch.stack([_processImage(Image.open(io.BytesIO(data)).convert('RGB'))
+                                 for data in images[start:start + batch_size]])
+            metas = torch.from_numpy(features[start:start + batch_size])
+            probabilities.extend(model(batch.to(device), metas.to(device)).view(-1).tolist())
+    return np.array(probabilities)
+
+
+def tradeoff(cascade_p, labels, full_p=None, thresholds=THRESHOLDS):
+    """One row per threshold: escalation rate and accuracies (see the header)."""
+    truth = labels >= 0.5
+    confidence = np.maximum(cascade_p, 1 - cascade_p)
+    cascade_correct = (cascade_p >= 0.5) == truth
+    full_correct = None if full_p is None else (full_p >= 0.5) == truth
+    rows = []
+    for threshold in thresholds:
+        answered = confidence >= threshold
+        row = {
+            "threshold": threshold,
+            "escalation_rate": float(1 - answered.mean()),
+            "answered_accuracy": float(cascade_correct[answered].mean()) if answered.any() else None,
+        }
+        if full_correct is not None:
+            row["accuracy"] = float(np.where(answered, cascade_correct, full_correct).mean())
+        rows.append(row)
+    return rows
+
+
+def choose_threshold(rows, full_accuracy=None, max_accuracy_drop=0.01, min_answered_accuracy=0.95):
+    """Lowest threshold meeting the target (fewest escalations); 1.0, i.e. always escalate, if none does."""
+    for row in rows:
+        if full_accuracy is not None:
+            if row["accuracy"] >= full_accuracy - max_accuracy_drop:
+                return row["threshold"]
+        elif row["answered_accuracy"] is not None and row["answered_accuracy"] >= min_answered_accuracy:
+            return row["threshold"]
+    return 1.0
+
+
+def print_tradeoff(rows, full_accuracy=None):
+    def pct(value):
+        return '-' if value is None else f"{value * 100:.1f}%"
+    header = f"{'threshold':>10}{'escalated':>11}{'answered acc':>14}"
+    if full_accuracy is not None:
+        header += f"{'cascade acc':>13}   (ImageClassifier alone: {full_accuracy * 100:.1f}%)"
+    print(header)
+    for row in rows:
+        line = f"{row['threshold']:>10.3f}{pct(row['escalation_rate']):>11}{pct(row['answered_accuracy']):>14}"
+        if full_accuracy is not None:
+            line += f"{pct(row['accuracy']):>13}"
+        print(line)
+
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Train the FFT-only cascade stage in front of ImageClassifier.")
+    parser.add_argument('--shards', default=os.path.join(script_dir, "shards"),
+                        help='directory with the train/val/test shards from shardDataset.py')
+    parser.add_argument('--out', default=os.path.join(script_dir, "fft_cascade.json"))
+    parser.add_argument('--C', type=float, default=1.0, help='inverse L2 regularization strength')
+    parser.add_argument('--with-model', action='store_true',
+                        help='also run ImageClassifier on val/test to report the overall accuracy trade-off')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                        help='with --with-model: accuracy the cascade may lose against ImageClassifier alone')
+    parser.add_argument('--min-answered-accuracy', type=float, default=0.95,
+                        help='without --with-model: accuracy required on the images the cascade answers')
+    parser.add_argument('--threshold', type=float, help='store this threshold instead of choosing one')
+    args = parser.parse_args()
+
+    start = time.time()
+    train_x, train_y, _ = load_split(args.shards, "train")
+    val_x, val_y, val_images = load_split(args.shards, "val", with_images=args.with_model)
+    test_x, test_y, test_images = load_split(args.shards, "test", with_images=args.with_model)
+    print(f"Loaded {len(train_y)} train, {len(val_y)} val, {len(test_y)} test feature vectors "
+          f"in {time.time() - start:.1f}s")
+
+    from fftCascade import FftCascade
+    spec = fit_cascade(train_x, train_y, C=args.C)
+    cascade = FftCascade(spec)
+    val_full = test_full = None
+    if args.with_model:
+        start = time.time()
+        val_full = full_model_probabilities(val_images, val_x)
+        test_full = full_model_probabilities(test_images, test_x)
+        print(f"ImageClassifier evaluated on val/test in {time.time() - start:.1f}s")
+    val_full_accuracy = None if val_full is None else float(((val_full >= 0.5) == (val_y >= 0.5)).mean())
+
+    print("\nValidation trade-off:")
+    val_rows = tradeoff(cascade.probability(val_x), val_y, val_full)
+    print_tradeoff(val_rows, val_full_accuracy)
+    threshold = args.threshold if args.threshold is not None else choose_threshold(
+        val_rows, val_full_accuracy, args.max_accuracy_drop, args.min_answered_accuracy)
+
+    test_row = tradeoff(cascade.probability(test_x), test_y, test_full, thresholds=[threshold])[0]
+    test_full_accuracy = None if test_full is None else float(((test_full >= 0.5) == (test_y >= 0.5)).mean())
+    print(f"\nTest at threshold {threshold}:")
+    print_tradeoff([test_row], test_full_accuracy)
+
+    spec["threshold"] = threshold
+    spec["report"] = {
+        "train_samples": len(train_y),
+        "validation": val_rows,
+        "validation_full_accuracy": val_full_accuracy,
+        "test": test_row,
+        "test_full_accuracy": test_full_accuracy,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(spec, f, indent=2)
+    print(f"\nCascade written to {args.out} (threshold {threshold}); serve it with CASCADE_MODEL={args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@ import os
 import cv2
 import torch
 import random
-import tempfile
+import json
+import sqlite3
+import hashlib
 import numpy as np
 from PIL import Image
 from statistics import mean, median
@@ -10,94 +12,301 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torchvision
 import torchvision.transforms as T
-from sklearn.model_selection import train_test_split
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
 import torch.optim as optim
-from runModel import runModel
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from runModel import score_frames, load_image_classifier, resolve_model_path
+from frameReader import read_frames, count_frames, sample_diverse_frames, read_frames_scaled, FrameRing
 # ---------------------------
 # User-provided image classifier runner.
 # ---------------------------
+def score_decoded_frames(frames):
+    """
+    Score decoded BGR frames ({frame_idx: frame}, all the same size) the way
+    videoService does when serving: runModel.score_frames on the raw frames,
+    without the FFT cascade, so training sees the confidences inference sees.
+    Returns {frame_idx: confidence}, empty if the classifier is unavailable or
+    scoring fails (callers use 0.0 for that clip but must not cache it, so the
+    frames are retried next time).
+    """
+    if not frames or load_image_classifier() is None:
+        return {}
+    order = sorted(frames)
+    try:
+        scores = score_frames([frames[i] for i in order], cascade=False)
+    except Exception as e:
+        print(f"Warning: score_frames failed on {len(order)} frames: {e}")
+        return {}
+    return dict(zip(order, scores))
+
+def sample_frame_indices(total_frames, frames_per_clip, pad=False):
+    """
+    Frame indices VideoDataset samples: uniform over the clip, or every frame
+    when the clip is shorter than frames_per_clip. The model takes variable-length
+    clips, so short clips are not padded unless pad=True (repeat the last frame
+    up to frames_per_clip, the old fixed-length behaviour).
+    """
+    if total_frames <= 0:
+        total_frames = 1  # fallback
+    if total_frames >= frames_per_clip:
+        # uniform sampling
+        return np.linspace(0, total_frames - 1, num=frames_per_clip, dtype=int)
+    # take all frames, optionally padding by repeating the last
+    indices = list(range(total_frames))
+    while pad and len(indices) < frames_per_clip:
+        indices.append(total_frames - 1)
+    return np.array(indices, dtype=int)
+
+_diverse_memo = {}
+
+def clip_frame_indices(video_path, frames_per_clip, sampling="uniform"):
+    """
+    Frame indices to use for one video.
+    sampling: "uniform" (sample_frame_indices) or "diverse" (one signature
+      pre-pass, then one frame per shot and farthest-point sampling over
+      near-duplicates; see frameReader.sample_diverse_frames). Diverse picks
+      are memoized per file and frames_per_clip, so each epoch and both caches
+      see the same frames.
+    """
+    if sampling == "uniform":
+        return sample_frame_indices(count_frames(video_path), frames_per_clip)
+    if sampling != "diverse":
+        raise ValueError(f"Unknown frame sampling {sampling!r}")
+    st = os.stat(video_path)
+    memo_key = (os.path.abspath(video_path), st.st_size, st.st_mtime_ns, frames_per_clip)
+    if memo_key not in _diverse_memo:
+        _diverse_memo[memo_key] = np.array(sample_diverse_frames(video_path, frames_per_clip), dtype=int)
+    return _diverse_memo[memo_key]
+
+def clip_length(video_path, frames_per_clip):
+    """Number of frames VideoDataset samples from this video (0 if it cannot be opened)."""
+    return min(count_frames(video_path), frames_per_clip)
+
+# ---------------------------
+# Persistent per-frame confidence cache.
+# Frame scores (score_decoded_frames) depend only on the frame pixels and the
+# classifier weights, so they are keyed by (video content hash, frame index,
+# checkpoint hash, decode size) and stored in a small SQLite file that survives across epochs and
+# training runs. decode_size is the square size frames were decoded to before
+# scoring (VideoDataset decode_size), 0 for full resolution.
+# ---------------------------
+_sha1_memo = {}
+
+def file_sha1(path, chunk_size=1 << 20):
+    """SHA-1 of a file's contents, memoized per (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _sha1_memo:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        _sha1_memo[memo_key] = h.hexdigest()
+    return _sha1_memo[memo_key]
+
+class ConfidenceCache:
+    def __init__(self, db_path, checkpoint_path=None):
+        """
+        db_path: SQLite file holding the cache (created if missing).
+        checkpoint_path: image classifier checkpoint the scores come from;
+          defaults to the one runModel loads. Its hash is part of every key, so
+          retraining the classifier invalidates old entries automatically.
+        """
+        self.db_path = db_path
+        if checkpoint_path is None:
+            checkpoint_path = resolve_model_path()
+        self.checkpoint_hash = file_sha1(checkpoint_path)
+        self._conn = None
+        self._conn_pid = None
+        with self._connect() as conn:
+            if conn.execute("SELECT name FROM sqlite_master WHERE name = 'frame_confidence'").fetchone():
+                # Scored through runModel (JPEG round trip, FFT cascade), unlike serving
+                print(f"Confidence cache {db_path!r} predates score_decoded_frames; starting it afresh")
+                conn.execute("DROP TABLE frame_confidence")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS frame_scores ("
+                " video_hash TEXT, frame_idx INTEGER, checkpoint_hash TEXT, decode_size INTEGER,"
+                " confidence REAL,"
+                " PRIMARY KEY (video_hash, frame_idx, checkpoint_hash, decode_size))"
+            )
+        self.close()
+
+    def _connect(self):
+        # Opened lazily and per process: a SQLite connection must not be shared
+        # across fork, which is how DataLoader workers start on Linux
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        """Close this process's connection; the next call reopens it."""
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._conn_pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_conn_pid"] = None
+        return state
+
+    def get_many(self, video_hash, frame_indices, decode_size=0):
+        """Returns {frame_idx: confidence} for the indices already cached at this decode_size."""
+        wanted = sorted({int(i) for i in frame_indices})
+        if not wanted:
+            return {}
+        placeholders = ",".join("?" * len(wanted))
+        rows = self._connect().execute(
+            f"SELECT frame_idx, confidence FROM frame_scores"
+            f" WHERE video_hash = ? AND checkpoint_hash = ? AND decode_size = ?"
+            f" AND frame_idx IN ({placeholders})",
+            [video_hash, self.checkpoint_hash, int(decode_size or 0)] + wanted,
+        ).fetchall()
+        return dict(rows)
+
+    def put_many(self, video_hash, confidences, decode_size=0):
+        """confidences: {frame_idx: confidence}, scored from frames decoded at decode_size (0 = full)."""
+        decode_size = int(decode_size or 0)
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO frame_scores"
+                " (video_hash, frame_idx, checkpoint_hash, decode_size, confidence) VALUES (?, ?, ?, ?, ?)",
+                [(video_hash, int(i), self.checkpoint_hash, decode_size, float(c))
+                 for i, c in confidences.items()],
+            )
+
+def _score_video_frames(video_path, frame_indices, decode_size=None):
+    """
+    Worker task for precompute_confidences: decode (at decode_size x decode_size
+    if set) and score the given frames of one video. Frames that fail to score
+    are left out so they are not cached.
+    """
+    if decode_size:
+        frames = read_frames_scaled(video_path, frame_indices, size=(decode_size, decode_size))
+    else:
+        frames = read_frames(video_path, frame_indices)
+    return score_decoded_frames(frames)
+
+def precompute_confidences(video_paths, frames_per_clip, cache, num_workers=4, sampling="uniform",
+                           decode_size=None):
+    """
+    Fill `cache` (a ConfidenceCache) with score_decoded_frames scores for every frame
+    VideoDataset will sample, scoring videos in parallel worker processes.
+    Frames already in the cache are skipped, so re-running is cheap.
+    decode_size: the VideoDataset decode_size the scores are for (None = full resolution).
+    """
+    jobs = {}
+    for video_path in video_paths:
+        total_frames = count_frames(video_path)
+        if total_frames <= 0:
+            print(f"Warning: could not open {video_path!r}, skipping")
+            continue
+        video_hash = file_sha1(video_path)
+        indices = set(int(i) for i in clip_frame_indices(video_path, frames_per_clip, sampling))
+        missing = indices - set(cache.get_many(video_hash, indices, decode_size))
+        if missing:
+            jobs[video_path] = (video_hash, sorted(missing))
+    print(f"Confidence cache: {len(video_paths) - len(jobs)} videos complete, {len(jobs)} to score")
+    if not jobs:
+        return
 
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(_score_video_frames, path, missing, decode_size): path
+                   for path, (_, missing) in jobs.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                cache.put_many(jobs[path][0], future.result(), decode_size)
+            except Exception as e:
+                print(f"Warning: scoring failed for {path!r}: {e}")
+            print(f"  scored {done}/{len(jobs)}: {path}")
 
 # ---------------------------
-# VideoDataset: samples frames_per_clip frames uniformly (or pads if shorter),
-# calls runModel per frame, returns:
-#   - frames tensor [T, 3, H, W]
+# VideoDataset: samples frames_per_clip frames uniformly (or every frame if the
+# clip is shorter), scores them with score_decoded_frames, returns:
+#   - frames tensor [T, 3, H, W], T <= frames_per_clip
 #   - confidences tensor [T]
 #   - label tensor scalar
 #   - sampled_indices: numpy array of original frame indices (length T)
+# Batch clips of different lengths with collate_video_clips (and preferably
+# LengthBucketBatchSampler over dataset.clip_lengths()).
 # ---------------------------
 class VideoDataset(Dataset):
-    def __init__(self, video_paths, labels, frames_per_clip=16, transform=None):
+    def __init__(self, video_paths, labels, frames_per_clip=16, transform=None, confidence_cache=None,
+                 sampling="uniform", decode_size=None):
         """
         video_paths: list of strings, paths to video files.
         labels: list of floats (e.g. 1.0 for real, 0.0 for AI).
         frames_per_clip: number of frames to sample per video.
         transform: torchvision transform applied to each frame (PIL Image -> Tensor normalized).
+        confidence_cache: optional ConfidenceCache; cached frames are not rescored,
+          and frames scored here are added to it.
+        sampling: "uniform" or "diverse" frame selection (see clip_frame_indices).
+        decode_size: if set (e.g. 224), frames are decoded straight to
+          decode_size x decode_size with frameReader.read_frames_scaled (PyAV or
+          ffmpeg when available) instead of at full resolution. Frames that
+          miss the confidence cache are then scored at this size too, and
+          cached under it (pass the same decode_size to precompute_confidences).
         """
         assert len(video_paths) == len(labels), "Paths and labels must align"
         self.video_paths = video_paths
         self.labels = labels
         self.frames_per_clip = frames_per_clip
         self.transform = transform
+        self.confidence_cache = confidence_cache
+        self.sampling = sampling
+        self.decode_size = decode_size
+        self._ring = None
 
     def __len__(self):
         return len(self.video_paths)
 
+    def clip_lengths(self):
+        """Number of frames each sample will have, for LengthBucketBatchSampler."""
+        return [max(clip_length(vp, self.frames_per_clip), 1) for vp in self.video_paths]
+
+    def _decode(self, video_path, indices):
+        if not self.decode_size:
+            return read_frames(video_path, indices)
+        if self._ring is None:
+            # One preallocated buffer per dataset (and per DataLoader worker)
+            self._ring = FrameRing(self.frames_per_clip, self.decode_size, self.decode_size)
+        return read_frames_scaled(video_path, indices, size=(self.decode_size, self.decode_size),
+                                  ring=self._ring)
+
     def __getitem__(self, idx):
         video_path = self.video_paths[idx]
         label = float(self.labels[idx])
 
-        # Open video
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise RuntimeError(f"Could not open video: {video_path!r}")
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-        if total_frames <= 0:
-            total_frames = 1  # fallback
-
         # Determine which frame indices to sample
-        if total_frames >= self.frames_per_clip:
-            # uniform sampling
-            indices = np.linspace(0, total_frames - 1, num=self.frames_per_clip, dtype=int)
-        else:
-            # take all frames then pad by repeating last
-            indices = list(range(total_frames))
-            while len(indices) < self.frames_per_clip:
-                indices.append(total_frames - 1)
-            indices = np.array(indices, dtype=int)
+        indices = clip_frame_indices(video_path, self.frames_per_clip, self.sampling)
+        # Decode all sampled frames in one forward pass (raises if the video cannot be opened)
+        decoded = self._decode(video_path, indices)
+
+        cached = {}
+        if self.confidence_cache is not None:
+            video_hash = file_sha1(video_path)
+            cached = self.confidence_cache.get_many(video_hash, indices, self.decode_size)
+        # Score the uncached frames in one batch, as videoService does
+        new_scores = score_decoded_frames({int(i): decoded[int(i)] for i in indices
+                                           if int(i) not in cached and int(i) in decoded})
 
         frames = []
         confidences = []
         for frame_idx in indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_idx))
-            ret, frame_bgr = cap.read()
-            if not ret or frame_bgr is None:
+            frame_bgr = decoded.get(int(frame_idx))
+            if frame_bgr is None:
                 # fallback to black image
                 frame_rgb = None
             else:
                 frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
 
-            # Get confidence via runModel
-            if frame_rgb is not None:
-                # Write to temp file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmpf:
-                    temp_path = tmpf.name
-                # Write BGR directly
-                cv2.imwrite(temp_path, frame_bgr)
-                try:
-                    conf = runModel(temp_path)
-                    conf = float(conf)
-                except Exception as e:
-                    print(f"Warning: runModel failed on {temp_path}: {e}")
-                    conf = 0.0
-                # Remove temp file
-                try:
-                    os.remove(temp_path)
-                except OSError:
-                    pass
-            else:
-                conf = 0.0
+            # Confidence from the cache, else from this clip's batch; 0.0 for
+            # undecodable frames and failed scoring (retried next time)
+            conf = cached.get(int(frame_idx), new_scores.get(int(frame_idx), 0.0))
             confidences.append(conf)
 
             # Prepare PIL Image for transform
@@ -112,7 +321,8 @@ class VideoDataset(Dataset):
                 frame_t = T.ToTensor()(pil)
             frames.append(frame_t)
 
-        cap.release()
+        if self.confidence_cache is not None and new_scores:
+            self.confidence_cache.put_many(video_hash, new_scores, self.decode_size)
 
         # Stack frames: [T,3,H,W]
         frames_tensor = torch.stack(frames, dim=0)
@@ -130,6 +340,287 @@ class VideoDataset(Dataset):
             "video_path": video_path  # so we know which video this came from
         }
 
+# ---------------------------
+# Frozen-backbone embedding cache.
+# With the ViT frame encoder frozen, its output for a frame depends only on the
+# frame pixels, so each sampled frame is encoded once and the 768-d embedding is
+# appended to a float16 file that is memory-mapped for reading. Training then
+# only runs conf_proj, the temporal transformer and the classifier.
+# Layout of cache_dir:
+#   embeddings.f16   rows of hidden_dim float16 values, append-only
+#   index.json       {"encoder_id", "hidden_dim", "rows": {"<video_hash>:<frame_idx>": row}}
+# ---------------------------
+class EmbeddingCache:
+    def __init__(self, cache_dir, hidden_dim=768, encoder_id="vit_b_16"):
+        """
+        cache_dir: directory holding embeddings.f16 and index.json (created if missing).
+        hidden_dim: embedding width of the frame encoder.
+        encoder_id: identifies the frozen encoder weights (and frame transform);
+          a cache written for a different encoder_id is rejected.
+        """
+        self.cache_dir = cache_dir
+        self.hidden_dim = hidden_dim
+        self.encoder_id = encoder_id
+        self.data_path = os.path.join(cache_dir, "embeddings.f16")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.rows = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get("encoder_id") != encoder_id or index.get("hidden_dim") != hidden_dim:
+                raise ValueError(f"Embedding cache {cache_dir!r} was written for "
+                                 f"{index.get('encoder_id')!r} (dim {index.get('hidden_dim')})")
+            self.rows = index["rows"]
+        self._mmap = None
+
+    def __getstate__(self):
+        # The memmap is reopened lazily in DataLoader worker processes
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        return state
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def _key(video_hash, frame_idx):
+        return f"{video_hash}:{int(frame_idx)}"
+
+    def _array(self):
+        num_rows = len(self.rows)
+        if self._mmap is None or self._mmap.shape[0] != num_rows:
+            self._mmap = np.memmap(self.data_path, dtype=np.float16, mode='r',
+                                   shape=(num_rows, self.hidden_dim)) if num_rows else None
+        return self._mmap
+
+    def missing(self, video_hash, frame_indices):
+        """Sorted frame indices of this video that have no cached embedding."""
+        return sorted({int(i) for i in frame_indices if self._key(video_hash, i) not in self.rows})
+
+    def get(self, video_hash, frame_indices):
+        """
+        Embeddings for frame_indices (in order, duplicates allowed) as a float16
+        array [len(frame_indices), hidden_dim], or None if any frame is missing.
+        """
+        keys = [self._key(video_hash, i) for i in frame_indices]
+        if any(key not in self.rows for key in keys):
+            return None
+        return np.asarray(self._array()[[self.rows[key] for key in keys]])
+
+    def put(self, video_hash, embeddings, flush=True):
+        """
+        embeddings: {frame_idx: array [hidden_dim]}. Appends new rows; with
+        flush=False the index is only rewritten by a later flush() (rows past
+        the last flushed index are overwritten if the process dies first).
+        """
+        new = {self._key(video_hash, i): e for i, e in embeddings.items()
+               if self._key(video_hash, i) not in self.rows}
+        if not new:
+            return
+        block = np.stack([np.asarray(e, dtype=np.float16).reshape(self.hidden_dim)
+                          for e in new.values()])
+        # Rows past the last indexed one (left by an interrupted write) are overwritten
+        with open(self.data_path, 'ab') as f:
+            f.truncate(len(self.rows) * self.hidden_dim * 2)
+            f.seek(0, os.SEEK_END)
+            f.write(block.tobytes())
+        for key in new:
+            self.rows[key] = len(self.rows)
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Write the index; atomically, so readers never see a half-written file."""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"encoder_id": self.encoder_id, "hidden_dim": self.hidden_dim,
+                       "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+
+def frames_to_tensor(frames_bgr, transform):
+    """List of BGR frames -> [N, 3, H, W] tensor through `transform` (PIL -> Tensor)."""
+    tensors = []
+    for frame_bgr in frames_bgr:
+        pil = Image.fromarray(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+        tensors.append(transform(pil) if transform is not None else T.ToTensor()(pil))
+    return torch.stack(tensors, dim=0)
+
+@torch.no_grad()
+def embed_video(model, video_path, indices, cache, transform, device, batch_size=32, flush=True):
+    """
+    ViT embeddings [len(indices), hidden_dim] for the given frames of one video.
+    Frames already in `cache` (an EmbeddingCache, may be None) are not decoded;
+    the rest are decoded in one pass, encoded in batches and added to the cache
+    (flush: see EmbeddingCache.put).
+    Frames that cannot be decoded are encoded as black frames, like VideoDataset.
+    """
+    video_hash = file_sha1(video_path) if cache is not None else None
+    if cache is not None:
+        missing = cache.missing(video_hash, indices)
+    else:
+        missing = sorted({int(i) for i in indices})
+    computed = {}
+    if missing:
+        decoded = read_frames(video_path, missing)
+        black = np.zeros((224, 224, 3), dtype=np.uint8)
+        model.frame_encoder.eval()
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            batch = frames_to_tensor([decoded.get(i, black) for i in chunk], transform).to(device)
+            feats = model.frame_encoder(batch).float().cpu().numpy()  # [n, hidden_dim]
+            computed.update(zip(chunk, feats))
+        if cache is not None:
+            cache.put(video_hash, computed, flush=flush)
+    if cache is not None:
+        return torch.from_numpy(cache.get(video_hash, indices).astype(np.float32))
+    return torch.from_numpy(np.stack([computed[int(i)] for i in indices]).astype(np.float32))
+
+def precompute_embeddings(model, video_paths, frames_per_clip, cache, transform, device, batch_size=32,
+                          sampling="uniform", flush_every=256):
+    """
+    Fill `cache` (an EmbeddingCache) with frozen-encoder embeddings for every
+    frame VideoDataset would sample. Videos already complete are skipped.
+    The index is written every flush_every encoded videos and at the end,
+    not after every video.
+    """
+    model.to(device)
+    done = 0
+    try:
+        for video_path in video_paths:
+            total_frames = count_frames(video_path)
+            if total_frames <= 0:
+                print(f"Warning: could not open {video_path!r}, skipping")
+                continue
+            indices = clip_frame_indices(video_path, frames_per_clip, sampling)
+            if not cache.missing(file_sha1(video_path), indices):
+                continue
+            try:
+                embed_video(model, video_path, indices, cache, transform, device, batch_size=batch_size,
+                            flush=False)
+            except Exception as e:
+                print(f"Warning: embedding failed for {video_path!r}: {e}")
+                continue
+            done += 1
+            if done % flush_every == 0:
+                cache.flush()
+            print(f"  embedded {done}: {video_path}")
+    finally:
+        if done:
+            cache.flush()
+    print(f"Embedding cache: {len(cache)} frames cached, {done} videos encoded this run")
+
+class CachedEmbeddingDataset(Dataset):
+    def __init__(self, video_paths, labels, embedding_cache, confidence_cache, frames_per_clip=16,
+                 sampling="uniform", decode_size=None):
+        """
+        Same samples as VideoDataset, but "embeddings" [T, hidden_dim] (float16)
+        from the EmbeddingCache replace "frames". Run precompute_embeddings and
+        precompute_confidences first (with the same sampling, and decode_size
+        for the confidences); videos with missing entries are an error.
+        """
+        assert len(video_paths) == len(labels), "Paths and labels must align"
+        self.video_paths = video_paths
+        self.labels = labels
+        self.embedding_cache = embedding_cache
+        self.confidence_cache = confidence_cache
+        self.frames_per_clip = frames_per_clip
+        self.sampling = sampling
+        self.decode_size = decode_size
+
+    def __len__(self):
+        return len(self.video_paths)
+
+    def clip_lengths(self):
+        """Number of frames each sample will have, for LengthBucketBatchSampler."""
+        return [max(clip_length(vp, self.frames_per_clip), 1) for vp in self.video_paths]
+
+    def __getitem__(self, idx):
+        video_path = self.video_paths[idx]
+        indices = clip_frame_indices(video_path, self.frames_per_clip, self.sampling)
+        video_hash = file_sha1(video_path)
+        embeddings = self.embedding_cache.get(video_hash, indices)
+        if embeddings is None:
+            raise KeyError(f"No cached embeddings for {video_path!r}; run precompute_embeddings first")
+        cached = self.confidence_cache.get_many(video_hash, indices, self.decode_size)
+        missing = sorted({int(i) for i in indices} - set(cached))
+        if missing:
+            raise KeyError(f"No cached confidences for frames {missing} of {video_path!r}; "
+                           f"run precompute_confidences first")
+        confidences = [cached[int(i)] for i in indices]
+        return {
+            "embeddings": torch.from_numpy(embeddings),  # [T, hidden_dim] float16
+            "confidences": torch.tensor(confidences, dtype=torch.float32),
+            "label": torch.tensor(float(self.labels[idx]), dtype=torch.float32),
+            "indices": indices,
+            "video_path": video_path
+        }
+
+# ---------------------------
+# Variable-length batching: pad clips to the longest in the batch and mark the
+# padding, and group clips of similar length so little padding is needed.
+# ---------------------------
+def collate_video_clips(batch):
+    """
+    DataLoader collate_fn for VideoDataset / CachedEmbeddingDataset samples of
+    different lengths. Pads "frames" or "embeddings" and "confidences" with zeros
+    up to the longest clip and adds:
+      - "padding_mask": bool tensor [B, T_max], True where a position is padding
+      - "lengths": long tensor [B]
+    "indices" and "video_path" stay per-sample lists.
+    """
+    lengths = [len(sample["confidences"]) for sample in batch]
+    max_len = max(lengths)
+    out = {
+        "confidences": torch.zeros(len(batch), max_len, dtype=torch.float32),
+        "padding_mask": torch.ones(len(batch), max_len, dtype=torch.bool),
+        "lengths": torch.tensor(lengths, dtype=torch.long),
+        "label": torch.stack([sample["label"] for sample in batch]),
+        "indices": [sample["indices"] for sample in batch],
+        "video_path": [sample["video_path"] for sample in batch],
+    }
+    key = "embeddings" if "embeddings" in batch[0] else "frames"
+    first = batch[0][key]
+    out[key] = first.new_zeros((len(batch), max_len) + tuple(first.shape[1:]))
+    for b, (sample, length) in enumerate(zip(batch, lengths)):
+        out[key][b, :length] = sample[key]
+        out["confidences"][b, :length] = sample["confidences"]
+        out["padding_mask"][b, :length] = False
+    return out
+
+class LengthBucketBatchSampler(Sampler):
+    def __init__(self, lengths, batch_size, shuffle=True, seed=0):
+        """
+        Batches of dataset indices whose clips have similar lengths.
+        lengths: clip length per sample (e.g. dataset.clip_lengths()).
+        shuffle: if True, samples of equal length are shuffled and the batch order
+          is randomised each epoch (call set_epoch); otherwise batches follow
+          length order, which is what evaluation wants.
+        """
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        order = list(range(len(self.lengths)))
+        rng = random.Random(self.seed + self.epoch)
+        if self.shuffle:
+            rng.shuffle(order)
+        # Stable sort: equal-length clips keep their shuffled order
+        order.sort(key=lambda i: self.lengths[i])
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.shuffle:
+            rng.shuffle(batches)
+        return iter(batches)
+
 # ---------------------------
 # Custom Temporal Transformer Layer that returns attention weights
 # ---------------------------
@@ -152,16 +643,20 @@ class TemporalEncoderLayerWithAttn(nn.Module):
         self.dropout1 = nn.Dropout(dropout)
         self.dropout2 = nn.Dropout(dropout)
 
-    def forward(self, src):
+    def forward(self, src, key_padding_mask=None):
         """
         src: [seq_len, batch, hidden_dim]
+        key_padding_mask: optional bool [batch, seq_len], True for padded positions
+          (they are never attended to, so get zero attention weight)
         Returns:
           src_out: [seq_len, batch, hidden_dim]
           attn_weights: [batch, seq_len, seq_len] (averaged over heads)
         """
         # Self-attention
-        attn_output, attn_output_weights = self.self_attn(src, src, src, need_weights=True)
-        # attn_output_weights: [batch_size * nhead, tgt_len, src_len]
+        attn_output, attn_output_weights = self.self_attn(src, src, src, need_weights=True,
+                                                          key_padding_mask=key_padding_mask,
+                                                          average_attn_weights=False)
+        # attn_output_weights: [batch_size, nhead, tgt_len, src_len]
         batch_size = src.shape[1]
         tgt_len, src_len = attn_output_weights.shape[-2], attn_output_weights.shape[-1]
         # reshape to [batch_size, nhead, tgt_len, src_len]
@@ -187,9 +682,10 @@ class TemporalTransformerWithAttn(nn.Module):
             layers.append(TemporalEncoderLayerWithAttn(hidden_dim, nhead, dim_feedforward, dropout))
         self.layers = nn.ModuleList(layers)
 
-    def forward(self, src):
+    def forward(self, src, key_padding_mask=None):
         """
         src: [seq_len, batch, hidden_dim]
+        key_padding_mask: optional bool [batch, seq_len], True for padded positions
         Returns:
           out: [seq_len, batch, hidden_dim]
           all_attn_weights: list of length num_layers, each [batch, seq_len, seq_len]
@@ -197,7 +693,7 @@ class TemporalTransformerWithAttn(nn.Module):
         all_attn = []
         x = src
         for layer in self.layers:
-            x, attn_w = layer(x)
+            x, attn_w = layer(x, key_padding_mask=key_padding_mask)
             all_attn.append(attn_w)
         return x, all_attn
 
@@ -205,19 +701,22 @@ class TemporalTransformerWithAttn(nn.Module):
 # Video model with CLS token, temporal attention, and exposure of attention weights
 # ---------------------------
 class VideoTransformerWithFrameAttention(nn.Module):
-    def __init__(self, frames_per_clip=16, hidden_dim=768, nhead=8, num_layers=2, dropout=0.1):
+    def __init__(self, frames_per_clip=16, hidden_dim=768, nhead=8, num_layers=2, dropout=0.1,
+                 pretrained_backbone=True):
         """
         frames_per_clip: number of sampled frames per video
         hidden_dim: embedding dimension from ViT backbone (e.g., 768 for vit_b_16)
         nhead: number of heads in temporal attention
         num_layers: number of temporal transformer layers
+        pretrained_backbone: start the ViT from ImageNet weights (downloaded on first
+          use); pass False when a full checkpoint is loaded right after, as in serving.
         """
         super().__init__()
         self.frames_per_clip = frames_per_clip
         self.hidden_dim = hidden_dim
 
         # 1) Pretrained ViT backbone (spatial attention inside)
-        vit = torchvision.models.vit_b_16(pretrained=True)
+        vit = torchvision.models.vit_b_16(pretrained=pretrained_backbone)
         # Remove classification head; keep backbone up to embedding
         vit.heads = nn.Identity()
         self.frame_encoder = vit  # takes [B*T,3,224,224] → [B*T, hidden_dim]
@@ -239,24 +738,81 @@ class VideoTransformerWithFrameAttention(nn.Module):
             dim_feedforward=hidden_dim * 4,
             dropout=dropout
         )
+        # Saved with the weights: the head count cannot be recovered from their shapes
+        self.register_buffer("temporal_nhead", torch.tensor(nhead))
 
         # 5) Classification head from CLS output
         self.classifier = nn.Linear(hidden_dim, 1)
 
-    def forward(self, frames, confidences, return_attn=False):
+    def freeze_frame_encoder(self):
         """
-        frames: tensor [B, T, 3, H, W], e.g. H=W=224 after transform
+        Freeze the ViT backbone (no gradients, kept in eval mode). Only conf_proj,
+        the temporal transformer and the classifier train, which is what allows
+        training from cached frame embeddings (see EmbeddingCache).
+        """
+        for param in self.frame_encoder.parameters():
+            param.requires_grad = False
+        self.frame_encoder.eval()
+        self.frame_encoder_frozen = True
+        return self
+
+    def train(self, mode=True):
+        super().train(mode)
+        # A frozen backbone stays in eval mode so its embeddings match the cached ones
+        if getattr(self, "frame_encoder_frozen", False):
+            self.frame_encoder.eval()
+        return self
+
+    def encode_frames(self, frames, padding_mask=None):
+        """
+        frames: tensor [B, T, 3, H, W]
+        padding_mask: optional bool [B, T], True for padded frames; those are not
+          run through the ViT and get zero embeddings.
+        Returns per-frame ViT embeddings [B, T, hidden_dim].
+        """
+        B, T, C, H, W = frames.shape
+        # Frame encoding: flatten batch/time, keeping only real frames
+        frames_flat = frames.reshape(B * T, C, H, W)  # [B*T, 3, H, W]
+        if padding_mask is not None:
+            valid = ~padding_mask.reshape(B * T)
+            frames_flat = frames_flat[valid]
+        if getattr(self, "frame_encoder_frozen", False):
+            with torch.no_grad():
+                feats_flat = self.frame_encoder(frames_flat)  # [N, hidden_dim]
+        else:
+            feats_flat = self.frame_encoder(frames_flat)
+        if padding_mask is not None:
+            feats_full = feats_flat.new_zeros(B * T, self.hidden_dim)
+            feats_full[valid] = feats_flat
+            feats_flat = feats_full
+        return feats_flat.view(B, T, self.hidden_dim)  # [B, T, hidden_dim]
+
+    def forward(self, frames, confidences, return_attn=False, padding_mask=None):
+        """
+        frames: tensor [B, T, 3, H, W], e.g. H=W=224 after transform, T <= frames_per_clip
         confidences: tensor [B, T]
         return_attn: if True, returns (logits, attn_data), else returns logits
+        padding_mask: optional bool [B, T], True where a clip is padded (see collate_video_clips)
         """
         B, T, C, H, W = frames.shape
-        assert T == self.frames_per_clip, f"Expected {self.frames_per_clip} frames, got {T}"
-        device = frames.device
+        assert T <= self.frames_per_clip, f"Expected at most {self.frames_per_clip} frames, got {T}"
 
-        # 1) Frame encoding: flatten batch/time
-        frames_flat = frames.view(B * T, C, H, W)  # [B*T, 3, H, W]
-        feats_flat = self.frame_encoder(frames_flat)  # [B*T, hidden_dim]
-        feats = feats_flat.view(B, T, self.hidden_dim)  # [B, T, hidden_dim]
+        # 1) Frame encoding
+        feats = self.encode_frames(frames, padding_mask=padding_mask)  # [B, T, hidden_dim]
+        return self.forward_embeddings(feats, confidences, return_attn=return_attn,
+                                       padding_mask=padding_mask)
+
+    def forward_embeddings(self, feats, confidences, return_attn=False, padding_mask=None):
+        """
+        Everything after the ViT backbone, for precomputed frame embeddings.
+        feats: tensor [B, T, hidden_dim] (float16 cached embeddings are upcast)
+        confidences: tensor [B, T]
+        return_attn: if True, returns (logits, attn_data), else returns logits
+        padding_mask: optional bool [B, T], True where a clip is padded
+        """
+        B, T, _ = feats.shape
+        assert T <= self.frames_per_clip, f"Expected at most {self.frames_per_clip} frames, got {T}"
+        feats = feats.to(self.cls_token.dtype)
 
         # 2) Confidence projection and fusion
         conf = confidences.view(B, T, 1)  # [B, T, 1]
@@ -267,14 +823,18 @@ class VideoTransformerWithFrameAttention(nn.Module):
         cls_tokens = self.cls_token.expand(B, -1, -1)  # [B, 1, hidden_dim]
         seq = torch.cat([cls_tokens, fused], dim=1)  # [B, T+1, hidden_dim]
 
-        # 4) Add positional embedding
-        seq = seq + self.pos_embed.unsqueeze(0)  # [B, T+1, hidden_dim]
+        # 4) Add positional embedding (shorter clips use the first T+1 positions)
+        seq = seq + self.pos_embed[:T + 1].unsqueeze(0)  # [B, T+1, hidden_dim]
 
         # 5) Permute for transformer: [seq_len, B, hidden_dim]
         seq = seq.permute(1, 0, 2)  # [T+1, B, hidden_dim]
 
-        # 6) Temporal transformer
-        out, all_attn_weights = self.temporal_transformer(seq)  # out: [T+1, B, hidden_dim]; attn: list of [B, T+1, T+1]
+        # 6) Temporal transformer; the CLS position is never padding
+        key_padding_mask = None
+        if padding_mask is not None:
+            cls_pad = padding_mask.new_zeros(B, 1)
+            key_padding_mask = torch.cat([cls_pad, padding_mask.to(torch.bool)], dim=1)  # [B, T+1]
+        out, all_attn_weights = self.temporal_transformer(seq, key_padding_mask=key_padding_mask)  # out: [T+1, B, hidden_dim]; attn: list of [B, T+1, T+1]
 
         # 7) Classification from CLS token
         out = out.permute(1, 0, 2)  # [B, T+1, hidden_dim]
@@ -314,20 +874,34 @@ def compute_attention_rollout(attn_weights_list):
 # ---------------------------
 # Training and evaluation loops
 # ---------------------------
+def forward_batch(model, batch, device, return_attn=False):
+    """
+    Run the model on a batch from VideoDataset (raw frames) or
+    CachedEmbeddingDataset (precomputed frame embeddings).
+    """
+    confidences = batch["confidences"].to(device) # [B, T]
+    padding_mask = batch.get("padding_mask")      # [B, T] from collate_video_clips
+    if padding_mask is not None:
+        padding_mask = padding_mask.to(device)
+    if "embeddings" in batch:
+        embeddings = batch["embeddings"].to(device)   # [B, T, hidden_dim]
+        return model.forward_embeddings(embeddings, confidences, return_attn=return_attn,
+                                        padding_mask=padding_mask)
+    frames = batch["frames"].to(device)           # [B, T, 3, H, W]
+    return model(frames, confidences, return_attn=return_attn, padding_mask=padding_mask)
+
 def train_one_epoch(model, dataloader, optimizer, device):
     model.train()
     total_loss = 0.0
     total_samples = 0
     for batch in dataloader:
-        frames = batch["frames"].to(device)           # [B, T, 3, H, W]
-        confidences = batch["confidences"].to(device) # [B, T]
         labels = batch["label"].to(device)            # [B]
         optimizer.zero_grad()
-        logits = model(frames, confidences)           # [B]
+        logits = forward_batch(model, batch, device)  # [B]
         loss = F.binary_cross_entropy_with_logits(logits, labels)
         loss.backward()
         optimizer.step()
-        b = frames.size(0)
+        b = labels.size(0)
         total_loss += loss.item() * b
         total_samples += b
     return total_loss / total_samples
@@ -340,13 +914,11 @@ def evaluate(model, dataloader, device):
     all_probs = []
     all_labels = []
     for batch in dataloader:
-        frames = batch["frames"].to(device)
-        confidences = batch["confidences"].to(device)
         labels = batch["label"].to(device)
-        logits = model(frames, confidences)
+        logits = forward_batch(model, batch, device)
         loss = F.binary_cross_entropy_with_logits(logits, labels)
         probs = torch.sigmoid(logits)
-        b = frames.size(0)
+        b = labels.size(0)
         total_loss += loss.item() * b
         total_samples += b
         all_probs.append(probs.cpu())
@@ -362,15 +934,22 @@ def train_model(model, train_dataset, val_dataset,
                 device, batch_size=1, lr=1e-4, num_epochs=5, num_workers=0):
     """
     Train the model, saving the best by validation loss.
-    - batch_size: likely small (1 or 2) because each sample loads multiple frames.
+    - batch_size: clips per batch; clips of different lengths are bucketed by
+      length and padded (see LengthBucketBatchSampler / collate_video_clips).
     - num_workers: 0 for simplicity; increase if using __main__ guard and want parallel loading.
     """
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    train_sampler = LengthBucketBatchSampler(train_dataset.clip_lengths(), batch_size, shuffle=True)
+    val_sampler = LengthBucketBatchSampler(val_dataset.clip_lengths(), batch_size, shuffle=False)
+    train_loader = DataLoader(train_dataset, batch_sampler=train_sampler,
+                              collate_fn=collate_video_clips, num_workers=num_workers)
+    val_loader = DataLoader(val_dataset, batch_sampler=val_sampler,
+                            collate_fn=collate_video_clips, num_workers=num_workers)
     model = model.to(device)
-    optimizer = optim.Adam(model.parameters(), lr=lr)
+    # A frozen frame encoder has no trainable parameters to hand the optimizer
+    optimizer = optim.Adam([p for p in model.parameters() if p.requires_grad], lr=lr)
     best_val_loss = float('inf')
     for epoch in range(1, num_epochs + 1):
+        train_sampler.set_epoch(epoch)
         train_loss = train_one_epoch(model, train_loader, optimizer, device)
         val_loss, val_acc = evaluate(model, val_loader, device)
         print(f"Epoch {epoch}/{num_epochs} | Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}")
@@ -386,20 +965,21 @@ def train_model(model, train_dataset, val_dataset,
 @torch.no_grad()
 def analyze_video_sample(model, sample_dict, device, top_k=5):
     """
-    Given a single-sample batch (batch_size=1) from VideoDataset (i.e., one video),
+    Given a single sample from VideoDataset or CachedEmbeddingDataset (i.e., one video),
     runs forward(return_attn=True), computes both last-layer CLS attention and rollout,
     and prints top_k important frames (by original frame index).
-    sample_dict: dict with keys "frames", "confidences", "label", "indices", "video_path"
+    sample_dict: dict with keys "frames" (or "embeddings"), "confidences", "label", "indices", "video_path"
     Returns a dict with probabilities and attention scores.
     """
     model.eval()
-    frames = sample_dict["frames"].unsqueeze(0).to(device)         # [1, T, 3, H, W]
-    confidences = sample_dict["confidences"].unsqueeze(0).to(device)  # [1, T]
+    # Add the batch dimension; "embeddings" samples (CachedEmbeddingDataset) skip the ViT
+    batch = {key: sample_dict[key].unsqueeze(0)
+             for key in ("frames", "embeddings", "confidences") if key in sample_dict}
     indices = sample_dict["indices"]  # numpy array length T
     video_path = sample_dict.get("video_path", None)
     label = sample_dict["label"].item()
 
-    logits, attn_data = model(frames, confidences, return_attn=True)
+    logits, attn_data = forward_batch(model, batch, device, return_attn=True)
     prob = torch.sigmoid(logits)[0].item()
     print(f"Video: {video_path} | True label: {label} | Predicted real-prob: {prob:.4f}")
 
@@ -454,14 +1034,11 @@ def analyze_video_sample(model, sample_dict, device, top_k=5):
 # ---------------------------
 # Utility: analyze dataset frame counts distribution (optional)
 # ---------------------------
-def analyze_frame_counts(video_paths):
+def analyze_frame_counts(video_paths, exact=False):
+    """exact=True counts frames by decoding instead of trusting container headers."""
     counts = []
     for vp in video_paths:
-        cap = cv2.VideoCapture(vp)
-        if not cap.isOpened():
-            continue
-        cnt = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-        cap.release()
+        cnt = count_frames(vp, exact=exact)
         if cnt > 0:
             counts.append(cnt)
     if not counts:
@@ -476,6 +1053,8 @@ def analyze_frame_counts(video_paths):
 # Main: prepare datasets, model, train, and optionally analyze some videos
 # ---------------------------
 def main():
+    from sklearn.model_selection import train_test_split
+
     # 1) Prepare your lists of video paths and labels.
     # Example: read from a CSV or define manually.
     # For demonstration, placeholders:
@@ -513,7 +1092,11 @@ def main():
 
     # 2) Hyperparameters
     frames_per_clip = 16  # try 8, 16, 32 based on dataset and resources
-    batch_size = 1       # small, because each sample loads T frames
+    # "uniform" spaces frames evenly, like serving (videoService.plan_video); "diverse"
+    # skips near-duplicate frames but then trains on frames serving never picks
+    sampling = "uniform"
+    freeze_encoder = True  # train from cached ViT embeddings instead of running the backbone every step
+    batch_size = 16 if freeze_encoder else 2  # clips are length-bucketed and padded, so >1 is fine
     num_epochs = 5       # adjust
     lr = 1e-4
     num_workers = 0      # set >0 if you want parallel loading and have guarded entrypoint
@@ -526,13 +1109,11 @@ def main():
                     std=[0.229, 0.224, 0.225]),
     ])
 
-    # 4) Create datasets
-    train_dataset = VideoDataset(train_paths, train_labels,
-                                 frames_per_clip=frames_per_clip,
-                                 transform=transform)
-    val_dataset = VideoDataset(val_paths, val_labels,
-                               frames_per_clip=frames_per_clip,
-                               transform=transform)
+    # 4) Score every sampled frame once up front; epochs then read confidences from the cache
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    confidence_cache = ConfidenceCache(os.path.join(script_dir, "confidence_cache.sqlite"))
+    precompute_confidences(train_paths + val_paths, frames_per_clip, confidence_cache, num_workers=4,
+                           sampling=sampling)
 
     # 5) Device
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -547,6 +1128,31 @@ def main():
         dropout=0.1
     )
 
+    # Create datasets
+    if freeze_encoder:
+        # Encode every sampled frame once with the frozen ViT; epochs read the memmapped cache
+        model.freeze_frame_encoder()
+        embedding_cache = EmbeddingCache(os.path.join(script_dir, "embedding_cache"), hidden_dim=768)
+        precompute_embeddings(model, train_paths + val_paths, frames_per_clip,
+                              embedding_cache, transform, device, sampling=sampling)
+        train_dataset = CachedEmbeddingDataset(train_paths, train_labels, embedding_cache,
+                                               confidence_cache, frames_per_clip=frames_per_clip,
+                                               sampling=sampling)
+        val_dataset = CachedEmbeddingDataset(val_paths, val_labels, embedding_cache,
+                                             confidence_cache, frames_per_clip=frames_per_clip,
+                                             sampling=sampling)
+    else:
+        train_dataset = VideoDataset(train_paths, train_labels,
+                                     frames_per_clip=frames_per_clip,
+                                     transform=transform,
+                                     confidence_cache=confidence_cache,
+                                     sampling=sampling)
+        val_dataset = VideoDataset(val_paths, val_labels,
+                                   frames_per_clip=frames_per_clip,
+                                   transform=transform,
+                                   confidence_cache=confidence_cache,
+                                   sampling=sampling)
+
     # 7) Train
     train_model(model, train_dataset, val_dataset,
                 device, batch_size=batch_size,
@@ -559,14 +1165,12 @@ def main():
     model.eval()
 
     # 9) Example: analyze a few validation videos for attention
-    val_loader = DataLoader(val_dataset, batch_size=1, shuffle=False, num_workers=0)
     print("\n--- Analyzing some validation videos for frame importance ---")
-    # Iterate a few samples
-    for i, sample in enumerate(val_loader):
+    # Iterate a few samples (unbatched: analyze_video_sample adds the batch dimension)
+    for i in range(min(5, len(val_dataset))):  # analyze first 5 videos only
+        sample = val_dataset[i]
         print(f"\nSample {i+1}:")
         analyze_video_sample(model, sample, device, top_k=5)
-        if i >= 4:
-            break  # analyze first 5 videos only
 
 if __name__ == "__main__":
     # For Windows multiprocessing support if num_workers>0
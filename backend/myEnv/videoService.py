@@ -0,0 +1,318 @@
+import os
+import time
+import threading
+import torch
+import torchvision.transforms as T
+from videoModel import (VideoTransformerWithFrameAttention, compute_attention_rollout,
+                        sample_frame_indices, frames_to_tensor, EmbeddingCache, file_sha1)
+from frameReader import read_frames, count_frames, read_frames_scaled
+from runModel import score_frames, load_checkpoint
+from instrumentation import span
+
+# ---------------------------
+# Video inference for the /upload endpoint.
+#
+# Loads the VideoTransformerWithFrameAttention checkpoint once per process,
+# decodes T uniformly sampled frames in one pass, scores them with the image
+# classifier in batches (the per-frame confidences the model was trained on),
+# encodes them with the ViT in batches, and reports the real-probability plus
+# the frames that the attention rollout ranks highest.
+#
+# T is chosen per request to fit a latency budget: the service keeps a running
+# estimate of the per-frame cost (decode + classifier + ViT) and picks the
+# largest T <= frames_per_clip whose estimated cost fits, never fewer than
+# VIDEO_MIN_FRAMES. The model accepts any T up to frames_per_clip.
+#
+# With VIDEO_EMBEDDING_CACHE pointing at the EmbeddingCache the checkpoint was
+# trained from (frozen encoder, videoModel.precompute_embeddings), videos seen
+# in training skip the ViT: their embeddings are looked up by file hash and
+# frame index. Only full-resolution decodes use it, since the cache was
+# encoded from full-resolution frames. The cache is read-only here and its
+# index is loaded once per process.
+#
+# Environment:
+#   VIDEO_MODEL_PATH          checkpoint (default: best_video_detector.pth in the
+#                             Render secret files dir, else next to this file)
+#   VIDEO_LATENCY_BUDGET      seconds per video, default 20
+#   VIDEO_MIN_FRAMES          lower bound on T, default 4
+#   VIDEO_FRAME_COST          initial per-frame cost estimate in seconds, default 0.5
+#   VIDEO_TOP_K               frames returned in top_frames, default 3
+#   VIDEO_ENCODE_BATCH        frames per ViT forward pass, default 8
+#   VIDEO_DECODE_SIZE         if > 0, decode frames straight to this square size
+#                             with read_frames_scaled (PyAV/ffmpeg when available,
+#                             see FRAME_DECODE_BACKEND); the classifier then scores
+#                             the downscaled frames. Default 0: full resolution.
+#   VIDEO_EMBEDDING_CACHE     EmbeddingCache directory to reuse (see above); unset: off
+# ---------------------------
+
+VIDEO_NHEAD = 8  # for checkpoints saved before temporal_nhead; what videoModel.main() trained
+
+_model_lock = threading.Lock()
+_loaded_video_models = {}
+_embedding_caches = {}
+# Exponential moving average of the measured per-frame cost, in seconds
+_frame_cost = {"seconds": float(os.environ.get("VIDEO_FRAME_COST", 0.5))}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def resolve_video_model_path():
+    """Path of the video transformer checkpoint (see VIDEO_MODEL_PATH above)."""
+    if os.environ.get("VIDEO_MODEL_PATH"):
+        return os.environ["VIDEO_MODEL_PATH"]
+    secret_files_dir = os.environ.get('RENDER_SECRET_FILES_DIR')
+    if secret_files_dir:
+        return os.path.join(secret_files_dir, 'best_video_detector.pth')
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'best_video_detector.pth')
+
+
+def pending_model_mb():
+    """Size of the checkpoint load_video_model() would still have to load, in MB (0 once loaded)."""
+    with _model_lock:
+        if _loaded_video_models:
+            return 0.0
+    model_path = resolve_video_model_path()
+    return os.path.getsize(model_path) / (1024 * 1024) if os.path.exists(model_path) else 0.0
+
+
+_clip_frames_memo = {}
+
+def clip_frames():
+    """
+    Most frames analyze_video keeps decoded at once (the model's
+    frames_per_clip), for the memory governor; 0 without a checkpoint. Before
+    the model is loaded it is read from the checkpoint's pos_embed shape.
+    """
+    with _model_lock:
+        for model in _loaded_video_models.values():
+            return model.frames_per_clip
+    model_path = resolve_video_model_path()
+    if not os.path.exists(model_path):
+        return 0
+    if model_path not in _clip_frames_memo:
+        state, _ = load_checkpoint(model_path, torch.device("cpu"))
+        _clip_frames_memo[model_path] = state["pos_embed"].shape[0] - 1
+    return _clip_frames_memo[model_path]
+
+
+def load_video_model(device=None):
+    """
+    Build VideoTransformerWithFrameAttention from the checkpoint, once per
+    process and device. frames_per_clip, hidden_dim and the number of temporal
+    layers are read from the checkpoint's shapes, the head count from its
+    temporal_nhead buffer. Returns the model in eval
+    mode, or None if there is no usable checkpoint (callers fall back to runVideo).
+    """
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    key = str(device)
+    with _model_lock:
+        if key in _loaded_video_models:
+            return _loaded_video_models[key]
+        model_path = resolve_video_model_path()
+        if not os.path.exists(model_path):
+            print(f"Video model file not found at {model_path}")
+            return None
+        try:
+            state, mmapped = load_checkpoint(model_path, device)
+            frames_per_clip = state["pos_embed"].shape[0] - 1
+            hidden_dim = state["pos_embed"].shape[1]
+            num_layers = len({k.split('.')[2] for k in state if k.startswith("temporal_transformer.layers.")})
+            if "temporal_nhead" not in state:
+                state["temporal_nhead"] = torch.tensor(VIDEO_NHEAD)
+            nhead = int(state["temporal_nhead"])
+            # The checkpoint holds the ViT weights too, so skip the ImageNet download
+            model = VideoTransformerWithFrameAttention(frames_per_clip=frames_per_clip,
+                                                       hidden_dim=hidden_dim, nhead=nhead,
+                                                       num_layers=num_layers, dropout=0.0,
+                                                       pretrained_backbone=False)
+            model.load_state_dict(state, assign=mmapped)
+        except Exception as e:
+            print(f"Error loading video model from {model_path}: {e}")
+            return None
+        model = model.to(device)
+        model.eval()
+        print(f"Video model loaded from {model_path} (frames_per_clip={frames_per_clip}, nhead={nhead})")
+        _loaded_video_models[key] = model
+        return model
+
+
+def load_embedding_cache(hidden_dim):
+    """The EmbeddingCache at VIDEO_EMBEDDING_CACHE, opened once per process; None if unset or unusable."""
+    cache_dir = os.environ.get("VIDEO_EMBEDDING_CACHE")
+    if not cache_dir:
+        return None
+    with _model_lock:
+        if cache_dir not in _embedding_caches:
+            cache = None
+            if not os.path.exists(os.path.join(cache_dir, "index.json")):
+                print(f"Embedding cache {cache_dir!r} not found; encoding every frame")
+            else:
+                try:
+                    cache = EmbeddingCache(cache_dir, hidden_dim=hidden_dim)
+                    print(f"Embedding cache {cache_dir!r} loaded ({len(cache)} frames)")
+                except ValueError as e:
+                    print(f"Embedding cache unusable, encoding every frame: {e}")
+            _embedding_caches[cache_dir] = cache
+        return _embedding_caches[cache_dir]
+
+
+def choose_num_frames(total_frames, max_frames, budget_seconds):
+    """Largest T that fits the latency budget at the current per-frame cost estimate."""
+    min_frames = _env_int("VIDEO_MIN_FRAMES", 4)
+    affordable = int(budget_seconds / max(_frame_cost["seconds"], 1e-3))
+    num_frames = max(min(affordable, max_frames), min(min_frames, max_frames))
+    return max(1, min(num_frames, total_frames))
+
+
+def _record_frame_cost(seconds, num_frames, alpha=0.3):
+    if num_frames > 0:
+        per_frame = seconds / num_frames
+        _frame_cost["seconds"] = (1 - alpha) * _frame_cost["seconds"] + alpha * per_frame
+
+
+_transform = T.Compose([
+    T.Resize((224, 224)),
+    T.ToTensor(),
+    T.Normalize(mean=[0.485, 0.456, 0.406],
+                std=[0.229, 0.224, 0.225]),
+])
+
+
+def plan_video(total_frames, budget_seconds=None, decode_size=None):
+    """
+    Frames analyze_video would decode for a video of total_frames frames:
+    returns (indices, decode_size), decode_size 0 meaning full resolution, or
+    None if the video model is unavailable. decode_size is capped by
+    VIDEO_DECODE_SIZE when that is set.
+    """
+    model = load_video_model()
+    if model is None:
+        return None
+    if budget_seconds is None:
+        budget_seconds = float(os.environ.get("VIDEO_LATENCY_BUDGET", 20))
+    num_frames = choose_num_frames(total_frames, model.frames_per_clip, budget_seconds)
+    indices = [int(i) for i in sample_frame_indices(total_frames, num_frames)]
+    configured_size = _env_int("VIDEO_DECODE_SIZE", 0)
+    if decode_size is None or 0 < configured_size < decode_size:
+        decode_size = configured_size
+    return indices, decode_size
+
+
+def decode_planned_frames(video_path, indices, decode_size):
+    """(indices that decoded, their BGR frames) for a plan_video plan."""
+    with span("video.decode"):
+        if decode_size > 0:
+            decoded = read_frames_scaled(video_path, indices, size=(decode_size, decode_size))
+        else:
+            decoded = read_frames(video_path, indices)
+    indices = [i for i in indices if i in decoded]
+    return indices, [decoded[i] for i in indices]
+
+
+@torch.no_grad()
+def analyze_video(video_path, budget_seconds=None, top_k=None, progress=None, decode_size=None):
+    """
+    Score one video with the temporal transformer.
+    decode_size: decode frames at decode_size x decode_size, or smaller if
+      VIDEO_DECODE_SIZE says so (the memory governor uses it to downscale).
+    progress: optional callable(event, data) called with "decoded" once the
+      frames are read, "frame_scored" for every classifier-scored frame
+      ({"frame_index", "score", "frames_done", "frames_total"}), "cnn" once all
+      frames are scored and "embedded" after the ViT pass.
+    Returns a dict:
+      probability  real-probability in [0, 1]
+      percentage   same on the 0-100 scale runModel/runVideo use
+      num_frames   T actually used
+      top_frames   [{"frame_index", "score"}] ranked by attention rollout
+    or None if the video model is unavailable.
+    Raises RuntimeError if no frame of the video can be decoded.
+    """
+    start = time.perf_counter()
+    plan = plan_video(count_frames(video_path), budget_seconds, decode_size)
+    if plan is None:
+        return None
+    indices, frames_bgr = decode_planned_frames(video_path, *plan)
+    if not indices:
+        raise RuntimeError(f"Could not read any frames from {video_path}")
+    decode_seconds = time.perf_counter() - start
+    if progress is not None:
+        progress("decoded", {"frames": len(indices), "seconds": round(decode_seconds, 4)})
+    return analyze_frames(frames_bgr, indices, top_k=top_k, progress=progress, decode_seconds=decode_seconds,
+                          video_path=video_path if plan[1] == 0 else None)
+
+
+@torch.no_grad()
+def analyze_frames(frames_bgr, indices, top_k=None, progress=None, decode_seconds=0.0, video_path=None):
+    """
+    The model half of analyze_video, for frames decoded elsewhere (e.g. by a
+    web process, see inferenceWorkers.py): frames_bgr are the decoded frames
+    of video frame numbers `indices`. decode_seconds is added to the measured
+    cost when updating the per-frame cost estimate. Same progress events
+    (except "decoded") and return value as analyze_video.
+    video_path: the file the frames were decoded from at full resolution, to
+      look its embeddings up in VIDEO_EMBEDDING_CACHE (None: always encode).
+    """
+    start = time.perf_counter()
+    model = load_video_model()
+    if model is None:
+        return None
+    device = next(model.parameters()).device
+    if top_k is None:
+        top_k = _env_int("VIDEO_TOP_K", 3)
+    stage_start = time.perf_counter()
+
+    # Per-frame classifier confidences, then ViT embeddings, both batched
+    scores = []
+    for s in range(0, len(frames_bgr), 4):
+        for score in score_frames(frames_bgr[s:s + 4]):
+            scores.append(score)
+            if progress is not None:
+                progress("frame_scored", {"frame_index": indices[len(scores) - 1], "score": score,
+                                          "frames_done": len(scores), "frames_total": len(indices)})
+    confidences = torch.tensor(scores, dtype=torch.float32, device=device)
+    if progress is not None:
+        progress("cnn", {"seconds": round(time.perf_counter() - stage_start, 4)})
+    stage_start = time.perf_counter()
+    encode_batch = _env_int("VIDEO_ENCODE_BATCH", 8)
+    cached = None
+    embedding_cache = load_embedding_cache(model.hidden_dim) if video_path is not None else None
+    if embedding_cache is not None:
+        cached = embedding_cache.get(file_sha1(video_path), indices)
+    with span("video.embed"):
+        if cached is not None:
+            feats = torch.from_numpy(cached.astype("float32")).to(device).unsqueeze(0)  # [1, T, hidden_dim]
+        else:
+            feats = []
+            for s in range(0, len(frames_bgr), encode_batch):
+                batch = frames_to_tensor(frames_bgr[s:s + encode_batch], _transform).to(device)
+                feats.append(model.frame_encoder(batch))
+            feats = torch.cat(feats, dim=0).unsqueeze(0)  # [1, T, hidden_dim]
+    if progress is not None:
+        progress("embedded", {"seconds": round(time.perf_counter() - stage_start, 4),
+                              "cached": cached is not None})
+
+    with span("video.temporal_forward"):
+        logits, attn_data = model.forward_embeddings(feats, confidences.unsqueeze(0), return_attn=True)
+        probability = torch.sigmoid(logits)[0].item()
+
+    attn_list = [layer_attn[0] for layer_attn in attn_data["temporal_attn_weights"]]
+    rollout_scores = compute_attention_rollout(attn_list)[0, 1:]
+    if rollout_scores.sum() > 0:
+        rollout_scores = rollout_scores / rollout_scores.sum()
+    topk = torch.topk(rollout_scores, k=min(top_k, len(indices)))
+    top_frames = [{"frame_index": indices[idx], "score": round(rollout_scores[idx].item(), 4)}
+                  for idx in topk.indices.tolist()]
+
+    _record_frame_cost(time.perf_counter() - start + decode_seconds, len(indices))
+    return {
+        "probability": probability,
+        "percentage": round(probability * 100, 1),
+        "num_frames": len(indices),
+        "top_frames": top_frames,
+    }
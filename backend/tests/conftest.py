@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend modules import each other by bare name from myEnv/ (they are run
+# from that directory), so put it on the path for the tests too.
+MYENV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "myEnv")
+if MYENV not in sys.path:
+    sys.path.insert(0, MYENV)
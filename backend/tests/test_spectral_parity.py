@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from spectralOps import angular_histogram
+from runModel import fft_angular_variance
+
+# ---------------------------
+# fft_angular_variance used to build one full-image mask per sector. The
+# single-bincount version (spectralOps.angular_histogram) must give the same
+# per-sector energies and variance for any bin count and spectrum shape.
+# ---------------------------
+
+SHAPES = [(64, 64), (65, 63), (3, 200), (200, 3), (1, 17)]
+BINS = [10, 36, 72]
+
+
+def masked_angular_energy(log_mag, n_bins=36):
+    """The original fft_angular_variance loop: one boolean mask per sector."""
+    h, w = log_mag.shape
+    center = (h // 2, w // 2)
+    y, x = np.indices((h, w))
+    angles = np.arctan2(y - center[0], x - center[1])
+    angles = (angles + np.pi) * (180 / np.pi)  # 0 to 360
+    bins = np.linspace(0, 360, n_bins + 1)
+    angular_energy = np.zeros(n_bins)
+    for i in range(n_bins):
+        mask = (angles >= bins[i]) & (angles < bins[i+1])
+        angular_energy[i] = np.sum(log_mag[mask])
+    return angular_energy
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("n_bins", BINS)
+def test_angular_energy_matches_mask_loop(shape, n_bins):
+    log_mag = np.random.default_rng(0).random(shape) * 10
+    expected = masked_angular_energy(log_mag, n_bins)
+
+    _, energy, counts = angular_histogram(log_mag, n_bins)
+    np.testing.assert_allclose(energy, expected, rtol=1e-9, atol=1e-9)
+    assert counts.sum() <= log_mag.size
+
+    variance, spectrum = fft_angular_variance(log_mag, n_bins, return_spectrum=True)
+    np.testing.assert_allclose(spectrum, expected, rtol=1e-9, atol=1e-9)
+    assert variance == pytest.approx(np.var(expected), rel=1e-9, abs=1e-9)
+    assert fft_angular_variance(log_mag, n_bins) == pytest.approx(variance, rel=1e-12, abs=1e-12)
+
+
+@pytest.mark.parametrize("n_bins", BINS)
+def test_batched_angular_energy_matches_mask_loop(n_bins):
+    log_mags = np.random.default_rng(1).random((3, 33, 47)) * 10
+    _, energy, _ = angular_histogram(log_mags, n_bins)
+    for i in range(len(log_mags)):
+        np.testing.assert_allclose(energy[i], masked_angular_energy(log_mags[i], n_bins), rtol=1e-9, atol=1e-9)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from spectralOps import batched_kurtosis_skew, batched_pearson, find_peaks, pairwise_distance_std
+
+# ---------------------------
+# The numpy-only FFT feature helpers replaced scipy.stats, scipy.spatial and
+# skimage calls; check them against the originals (skipped if not installed).
+# ---------------------------
+
+
+def test_kurtosis_skew_match_scipy():
+    stats = pytest.importorskip("scipy.stats")
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(size=(2, 500)), rng.exponential(size=(2, 500)),
+                             rng.random((1, 500)).astype(np.float32)])
+    kurt, skw = batched_kurtosis_skew(values)
+    for i, row in enumerate(values):
+        assert kurt[i] == pytest.approx(stats.kurtosis(row), rel=1e-6, abs=1e-9)
+        assert skw[i] == pytest.approx(stats.skew(row), rel=1e-6, abs=1e-9)
+
+
+def test_pearson_matches_scipy():
+    stats = pytest.importorskip("scipy.stats")
+    rng = np.random.default_rng(1)
+    a = rng.random((4, 300))
+    b = np.stack([a[0] * 2 + 1, -a[1], a[2] + rng.random(300), rng.random(300)])
+    r = batched_pearson(a, b)
+    for i in range(len(a)):
+        assert r[i] == pytest.approx(stats.pearsonr(a[i], b[i])[0], rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize("min_distance", [1, 3, 10])
+@pytest.mark.parametrize("levels", [None, 8])
+def test_find_peaks_matches_peak_local_max(min_distance, levels):
+    feature = pytest.importorskip("skimage.feature")
+    ndimage = pytest.importorskip("scipy.ndimage")
+    rng = np.random.default_rng(2)
+    image = ndimage.gaussian_filter(rng.random((96, 80)), 2)
+    image = (image - image.min()) / (image.max() - image.min())
+    if levels is not None:
+        # Quantize to create plateaus, which exercise the greedy spacing pass
+        image = np.round(image * levels) / levels
+    threshold = 0.3
+    expected = feature.peak_local_max(image, min_distance=min_distance, threshold_abs=threshold)
+    peaks = find_peaks(image, min_distance=min_distance, threshold=threshold)
+    assert len(peaks) == len(expected)
+    assert sorted(map(tuple, peaks)) == sorted(map(tuple, expected))
+    # highest intensity first
+    assert np.all(np.diff(image[peaks[:, 0], peaks[:, 1]]) <= 0)
+
+
+def test_find_peaks_max_peaks_keeps_strongest():
+    rng = np.random.default_rng(3)
+    image = rng.random((60, 60))
+    everything = find_peaks(image, min_distance=2, threshold=0.0)
+    top = find_peaks(image, min_distance=2, threshold=0.0, max_peaks=5)
+    np.testing.assert_array_equal(top, everything[:5])
+
+
+@pytest.mark.parametrize("n_points", [2, 3, 50, 301])
+def test_pairwise_distance_std_matches_pdist(n_points):
+    distance = pytest.importorskip("scipy.spatial.distance")
+    points = np.random.default_rng(4).random((n_points, 2)) * 100
+    expected = np.std(distance.pdist(points))
+    # small blocks so the running variance merge is exercised
+    assert pairwise_distance_std(points, block_size=7) == pytest.approx(expected, rel=1e-9, abs=1e-9)
+    assert pairwise_distance_std(points) == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_pairwise_distance_std_degenerate():
+    assert pairwise_distance_std(np.zeros((0, 2))) == 0.0
+    assert pairwise_distance_std(np.ones((1, 2))) == 0.0
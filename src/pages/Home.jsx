@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { API_BASE_URL } from '../config';
 import './Pages.css';
 import './DarkMode.css';
@@ -13,6 +13,23 @@ function Home({ isDarkMode, onToggleDarkMode }) {
   const [isLoading, setIsLoading] = useState(false);
   const [percentage, setPercentage] = useState(0);
   const [isDragOver, setIsDragOver] = useState(false);
+  const [stageMessage, setStageMessage] = useState('');
+  const abortControllerRef = useRef(null);
+
+  // Human-readable text for the progress events streamed by /upload?stream=ndjson
+  const describeStage = (event) => {
+    switch (event.event) {
+      case 'saved': return 'Upload received...';
+      case 'model_loaded': return 'Model ready, analyzing...';
+      case 'decoded': return event.frames ? `Decoded ${event.frames} frames...` : 'Image decoded...';
+      case 'fft_features': return 'Frequency features computed...';
+      case 'cascade': return event.escalated ? 'Frequency check inconclusive, running the neural network...' : 'Frequency check conclusive...';
+      case 'frame_scored': return `Scored frame ${event.frames_done} of up to ${event.frames_total}...`;
+      case 'cnn': return 'Neural network finished...';
+      case 'embedded': return 'Combining frames...';
+      default: return null;
+    }
+  };
 
   // Auto-scroll to bottom when analysis result is displayed
   useEffect(() => {
@@ -80,62 +97,103 @@ function Home({ isDarkMode, onToggleDarkMode }) {
         console.log('Creating fetch request...');
         const requestStartTime = Date.now();
         
-        // Create a timeout promise
-        const timeoutPromise = new Promise((_, reject) => {
-          setTimeout(() => reject(new Error('Request timeout after 60 seconds')), 60000);
-        });
-        
-        // Send file to Python backend using config URL
-        const fetchPromise = fetch(`${API_BASE_URL}/upload`, {
-          method: 'POST',
-          body: formData,
-          mode: 'cors',
-          credentials: 'omit'
-        });
-        
-        console.log('Fetch request created, waiting for response...');
+        // Abort if the server goes quiet for 60 seconds; progress events reset the timer
+        const controller = new AbortController();
+        abortControllerRef.current = controller;
+        let timedOut = false;
+        let idleTimer = null;
+        const resetIdleTimer = () => {
+          clearTimeout(idleTimer);
+          idleTimer = setTimeout(() => {
+            timedOut = true;
+            controller.abort();
+          }, 60000);
+        };
+        resetIdleTimer();
+        setStageMessage('Uploading...');
         
-        // Race between fetch and timeout
-        const response = await Promise.race([fetchPromise, timeoutPromise]);
-        
-        const requestEndTime = Date.now();
-        const requestDuration = requestEndTime - requestStartTime;
-        
-        console.log('=== RESPONSE RECEIVED ===');
-        console.log('Response received at:', new Date().toISOString());
-        console.log('Request duration:', requestDuration, 'ms');
-        console.log('Response status:', response.status);
-        console.log('Response status text:', response.statusText);
-        console.log('Response headers:', Object.fromEntries(response.headers.entries()));
-        
-        if (!response.ok) {
-          console.error('Response not OK. Status:', response.status);
-          const errorText = await response.text();
-          console.error('Error response body:', errorText);
-          throw new Error(`HTTP ${response.status}: ${errorText}`);
+        // Send file to Python backend using config URL, streaming progress as JSON lines
+        let response;
+        let result = null;
+        try {
+          response = await fetch(`${API_BASE_URL}/upload?stream=ndjson`, {
+            method: 'POST',
+            body: formData,
+            mode: 'cors',
+            credentials: 'omit',
+            signal: controller.signal
+          });
+          
+          console.log('Fetch request created, waiting for response...');
+          
+          const requestEndTime = Date.now();
+          const requestDuration = requestEndTime - requestStartTime;
+          
+          console.log('=== RESPONSE RECEIVED ===');
+          console.log('Response received at:', new Date().toISOString());
+          console.log('Request duration:', requestDuration, 'ms');
+          console.log('Response status:', response.status);
+          console.log('Response status text:', response.statusText);
+          console.log('Response headers:', Object.fromEntries(response.headers.entries()));
+          
+          if (!response.ok) {
+            console.error('Response not OK. Status:', response.status);
+            const errorText = await response.text();
+            console.error('Error response body:', errorText);
+            throw new Error(`HTTP ${response.status}: ${errorText}`);
+          }
+          
+          console.log('Reading progress stream...');
+          const reader = response.body.getReader();
+          const decoder = new TextDecoder();
+          let buffered = '';
+          for (;;) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            resetIdleTimer();
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            for (const line of lines) {
+              if (!line.trim()) continue;
+              const event = JSON.parse(line);
+              console.log(`Progress: ${event.event} at ${event.elapsed}s`, event);
+              if (event.event === 'result') {
+                result = event;
+              } else if (event.event === 'error') {
+                throw new Error(event.error);
+              } else {
+                const message = describeStage(event);
+                if (message) setStageMessage(message);
+              }
+            }
+          }
+        } catch (streamError) {
+          if (streamError.name === 'AbortError') {
+            throw new Error(timedOut ? 'Request timeout after 60 seconds without progress' : 'Analysis cancelled');
+          }
+          throw streamError;
+        } finally {
+          clearTimeout(idleTimer);
+          abortControllerRef.current = null;
         }
         
-        console.log('Parsing response JSON...');
-        const result = await response.json();
+        if (!result) {
+          throw new Error('Connection closed before the analysis finished');
+        }
         console.log('=== RESPONSE BODY ===');
         console.log('Response body:', result);
-        console.log('Response body type:', typeof result);
         console.log('Response body keys:', Object.keys(result));
         
-        if (response.ok) {
-          console.log('=== UPLOAD SUCCESS ===');
-          console.log('File uploaded successfully:', result);
-          console.log('Analysis result:', result.analysis_result);
-          console.log('Percentage:', result.percentage);
-          console.log('Model used:', result.model_used);
-          console.log('Request duration from backend:', result.request_duration, 'seconds');
-          
-          setAnalysisResult(result.analysis_result);
-          setPercentage(result.percentage);
-        } else {
-          console.error('Upload failed:', result.error);
-          alert(`Upload failed: ${result.error}`);
-        }
+        console.log('=== UPLOAD SUCCESS ===');
+        console.log('File uploaded successfully:', result);
+        console.log('Analysis result:', result.analysis_result);
+        console.log('Percentage:', result.percentage);
+        console.log('Model used:', result.model_used);
+        console.log('Request duration from backend:', result.request_duration, 'seconds');
+        
+        setAnalysisResult(result.analysis_result);
+        setPercentage(result.percentage);
       } catch (error) {
         const uploadEndTime = Date.now();
         const totalUploadDuration = uploadEndTime - uploadStartTime;
@@ -152,6 +210,8 @@ function Home({ isDarkMode, onToggleDarkMode }) {
           alert('Network error: Cannot connect to server. Please check your internet connection.');
         } else if (error.message.includes('CORS')) {
           alert('CORS error: Server is not allowing requests from this domain.');
+        } else if (error.message === 'Analysis cancelled') {
+          console.log('Analysis cancelled by user');
         } else if (error.message.includes('timeout')) {
           alert(`Timeout error: ${error.message}. The server took too long to respond.`);
         } else {
@@ -167,6 +227,7 @@ function Home({ isDarkMode, onToggleDarkMode }) {
         console.log('Loading state set to false');
         
         setIsLoading(false); // Stop loading regardless of success/failure
+        setStageMessage('');
       }
     }
   };
@@ -309,7 +370,13 @@ function Home({ isDarkMode, onToggleDarkMode }) {
             {isLoading && (
               <div className="loading-overlay">
                 <div className="loading-spinner"></div>
-                <p>Processing Image... This could take a while.</p>
+                <p>{stageMessage || 'Processing Image... This could take a while.'}</p>
+                <button
+                  onClick={() => abortControllerRef.current && abortControllerRef.current.abort()}
+                  className="change-btn"
+                >
+                  Cancel
+                </button>
               </div>
             )}
           </div>